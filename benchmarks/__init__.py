@@ -0,0 +1,9 @@
+"""
+ComfyUI Auto LoRA のベンチマーク
+
+GPUやComfyUI本体なしで、合成した設定・プロンプト・LoRAファイルを使って
+トリガーワード検出、設定ファイルの読み書き、LoRA読み込み・適用の処理時間を計測する。
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/compare.py base.json results.json
+"""
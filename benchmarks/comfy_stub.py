@@ -0,0 +1,160 @@
+"""
+ベンチマーク用の folder_paths / comfy のスタブ
+
+ComfyUI本体なしで nodes.py を読み込めるように、AutoLoRANode が使う関数だけを
+持つモジュールを sys.modules に登録する。LoRAの適用は実際のComfyUIと同様に
+重みを書き換えずパッチを登録するだけで、LoRAキーとモデルの重みの対応付けを行う。
+torch は実物を使う（インストールされていない場合は読み込めない）。
+"""
+
+import importlib.util
+import os
+import sys
+import types
+from typing import Dict, List
+
+try:
+    from .synthetic import lora_module_names
+except ImportError:
+    from synthetic import lora_module_names
+
+# パッケージとして読み込む際のモジュール名
+PACKAGE_NAME = 'auto_lora_bench'
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubModel:
+    """state dictのキーだけを持つモデル"""
+
+    def __init__(self, keys: List[str]):
+        self.keys = keys
+        self.key_set = frozenset(keys)
+
+
+class StubModelPatcher:
+    """ComfyUIの ModelPatcher と同様に、元のモデルを共有してパッチだけを持つ"""
+
+    def __init__(self, model: StubModel, patches: Dict = None):
+        self.model = model
+        self.cond_stage_model = model
+        self.patches = dict(patches or {})
+
+    def clone(self) -> 'StubModelPatcher':
+        return StubModelPatcher(self.model, self.patches)
+
+    def add_patches(self, patches: Dict, strength: float):
+        # ComfyUIと同様に、このモデルに存在する重みキーのパッチのみを登録する
+        for key, value in patches.items():
+            if key in self.model.key_set:
+                self.patches.setdefault(key, []).append((strength, value))
+
+
+def make_model_and_clip(modules: int):
+    """
+    合成LoRAのモジュール名に対応するスタブの MODEL / CLIP を作成
+
+    Args:
+        modules: UNet側のモジュール数（synthetic.write_lora_safetensors と同じ値）
+
+    Returns:
+        (model, clip)
+    """
+    names = lora_module_names(modules)
+    model = StubModelPatcher(StubModel([f"diffusion_model.{name[len('lora_unet_'):]}.weight" for name in names['unet']]))
+    clip = StubModelPatcher(StubModel([f"text_model.{name[len('lora_te_'):]}.weight" for name in names['clip']]))
+    return model, clip
+
+
+def _model_lora_keys_unet(model: StubModel, key_map: Dict = None) -> Dict:
+    key_map = {} if key_map is None else key_map
+    for key in model.keys:
+        key_map["lora_unet_" + key[len('diffusion_model.'):-len('.weight')]] = key
+    return key_map
+
+
+def _model_lora_keys_clip(model: StubModel, key_map: Dict = None) -> Dict:
+    key_map = {} if key_map is None else key_map
+    for key in model.keys:
+        key_map["lora_te_" + key[len('text_model.'):-len('.weight')]] = key
+    return key_map
+
+
+def _load_lora(lora: Dict, key_map: Dict) -> Dict:
+    patches = {}
+    for lora_key, weight_key in key_map.items():
+        up = lora.get(f"{lora_key}.lora_up.weight")
+        down = lora.get(f"{lora_key}.lora_down.weight")
+        if up is not None and down is not None:
+            patches[weight_key] = ('lora', (up, down, lora.get(f"{lora_key}.alpha")))
+    return patches
+
+
+def _load_torch_file(path: str, safe_load: bool = False):
+    import safetensors.torch
+    return safetensors.torch.load_file(path, device='cpu')
+
+
+def install(lora_dir: str):
+    """
+    folder_paths と comfy のスタブを sys.modules に登録
+
+    safetensors パッケージがない場合の comfy.utils.load_torch_file は
+    safetensors_utils.load_safetensors_filtered で全てのテンソルを読み込む。
+
+    Args:
+        lora_dir: LoRAファイルを置いたディレクトリ
+    """
+    folder_paths = types.ModuleType('folder_paths')
+    folder_paths.get_folder_paths = lambda folder_name: [lora_dir] if folder_name == 'loras' else []
+    folder_paths.get_filename_list = lambda folder_name: sorted(os.listdir(lora_dir)) if folder_name == 'loras' else []
+    folder_paths.get_full_path = lambda folder_name, filename: os.path.join(lora_dir, filename)
+
+    comfy = types.ModuleType('comfy')
+    comfy.__path__ = []
+    utils = types.ModuleType('comfy.utils')
+    try:
+        import safetensors.torch  # noqa: F401
+        utils.load_torch_file = _load_torch_file
+    except ImportError:
+        from safetensors_utils import load_safetensors_filtered
+        utils.load_torch_file = lambda path, safe_load=False: load_safetensors_filtered(path, lambda name: True)
+    model_management = types.ModuleType('comfy.model_management')
+    model_management.unload_all_models = lambda: None
+    lora = types.ModuleType('comfy.lora')
+    lora.model_lora_keys_unet = _model_lora_keys_unet
+    lora.model_lora_keys_clip = _model_lora_keys_clip
+    lora.load_lora = _load_lora
+
+    comfy.utils = utils
+    comfy.model_management = model_management
+    comfy.lora = lora
+    sys.modules.update({
+        'folder_paths': folder_paths,
+        'comfy': comfy,
+        'comfy.utils': utils,
+        'comfy.model_management': model_management,
+        'comfy.lora': lora,
+    })
+
+
+def load_package():
+    """
+    リポジトリをパッケージとして読み込む（nodes.py の相対インポートのため）
+
+    Returns:
+        パッケージのモジュール（nodes は module.nodes）
+    """
+    if PACKAGE_NAME in sys.modules:
+        return sys.modules[PACKAGE_NAME]
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE_NAME, os.path.join(REPO_DIR, '__init__.py'), submodule_search_locations=[REPO_DIR]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[PACKAGE_NAME]
+        raise
+    return module
@@ -0,0 +1,69 @@
+"""
+2つのベンチマーク結果の比較
+
+    python benchmarks/compare.py base.json new.json [--threshold 0.1]
+
+name と params が同じ結果の中央値を比べ、比率（new / base）を表示する。
+threshold を超えて遅くなった結果がある場合は終了コード1を返す。
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, Tuple
+
+
+def _key(result: Dict) -> Tuple[str, str]:
+    return result['name'], json.dumps(result['params'], sort_keys=True, ensure_ascii=False)
+
+
+def compare(base: Dict, new: Dict, threshold: float = 0.1):
+    """
+    2つの結果の中央値を比較
+
+    Args:
+        base: 基準の結果（run_benchmarks.py の出力）
+        new: 比較する結果
+        threshold: 遅くなったと判定する比率の増加量（0.1 = 10%）
+
+    Returns:
+        (name, params, base中央値, new中央値, 比率, 遅くなったか) のリスト
+    """
+    base_results = {_key(result): result for result in base['results'] if 'skipped' not in result}
+    rows = []
+    for result in new['results']:
+        previous = base_results.get(_key(result))
+        if previous is None or 'skipped' in result:
+            continue
+        ratio = result['median'] / previous['median'] if previous['median'] > 0 else float('inf')
+        rows.append((result['name'], result['params'], previous['median'], result['median'], ratio,
+                     ratio > 1 + threshold))
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='ベンチマーク結果の比較')
+    parser.add_argument('base', help='基準の結果のJSON')
+    parser.add_argument('new', help='比較する結果のJSON')
+    parser.add_argument('--threshold', type=float, default=0.1, help='遅くなったと判定する比率の増加量')
+    args = parser.parse_args(argv)
+
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+
+    rows = compare(base, new, args.threshold)
+    regressions = 0
+    for name, params, base_median, new_median, ratio, regressed in rows:
+        params_text = ' '.join(f"{key}={value}" for key, value in params.items())
+        mark = ' 遅くなりました' if regressed else ''
+        print(f"{name:<22} {params_text:<60} {base_median * 1000:>10.3f}ms -> {new_median * 1000:>10.3f}ms "
+              f"x{ratio:.2f}{mark}")
+        regressions += regressed
+    print(f"比較: {len(rows)}件, 遅くなった結果: {regressions}件")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
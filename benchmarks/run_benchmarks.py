@@ -0,0 +1,398 @@
+"""
+ベンチマークの実行
+
+    python benchmarks/run_benchmarks.py                       # 全て実行し、結果のJSONを標準出力へ
+    python benchmarks/run_benchmarks.py --quick -o quick.json  # 小さいサイズのみ
+    python benchmarks/run_benchmarks.py --only matching --sizes 1000,100000
+
+結果は schema / meta / results を持つJSONで、results の各要素は
+name, params, samples（秒）, min, median, mean, stdev と、必要に応じて
+throughput を持つ。実行できなかったベンチマークは skipped に理由を入れる。
+precision はLoRAキャッシュの精度変換（lora_cache_dtype）の誤差を確認し、
+許容値を超えた場合は終了コード1を返す。
+"""
+
+import argparse
+import contextlib
+import datetime
+import gc
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+try:
+    from . import comfy_stub
+    from .synthetic import make_mappings, make_prompts, write_config, write_lora_safetensors
+except ImportError:
+    import comfy_stub
+    from synthetic import make_mappings, make_prompts, write_config, write_lora_safetensors
+
+from lora_manager import LoraManager
+from mapping_store import migrate_json_to_sqlite
+
+# 結果のJSONの形式のバージョン
+SCHEMA_VERSION = 1
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+QUICK_SIZES = (10, 1000, 10000)
+GROUPS = ('matching', 'config_io', 'apply', 'precision')
+
+# lora_cache_dtype ごとの、LoRAの差分（up @ down）の相対誤差の許容値
+PRECISION_TOLERANCES = {'fp16': 2e-3, 'bf16': 1.6e-2}
+
+
+def measure(fn: Callable[[], object], repeat: int = 5, warmup: int = 1) -> Dict:
+    """
+    関数の実行時間を repeat 回計測
+
+    Args:
+        fn: 計測する関数
+        repeat: 計測回数
+        warmup: 計測前に実行する回数
+
+    Returns:
+        samples, min, median, mean, stdev（秒）を持つ辞書
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return {
+        'samples': samples,
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+class BenchmarkRunner:
+    """ベンチマークを実行して結果を集める"""
+
+    def __init__(self, workdir: str, sizes, prompts: int, repeat: int, verbose: bool = True):
+        self.workdir = workdir
+        self.sizes = sizes
+        self.prompt_count = prompts
+        self.repeat = repeat
+        self.verbose = verbose
+        self.results: List[Dict] = []
+        self.failures = 0
+
+    def record(self, name: str, params: Dict, stats: Optional[Dict] = None,
+               throughput: Optional[Dict] = None, skipped: Optional[str] = None,
+               extra: Optional[Dict] = None):
+        result = {'name': name, 'params': params}
+        if skipped is not None:
+            result['skipped'] = skipped
+        else:
+            result.update(stats)
+            if throughput:
+                result['throughput'] = throughput
+            if extra:
+                result.update(extra)
+        self.results.append(result)
+        if self.verbose:
+            summary = f"skipped: {skipped}" if skipped else f"median {stats['median'] * 1000:.3f}ms"
+            if throughput:
+                summary += ' ' + ' '.join(f"{key}={value:,.0f}" for key, value in throughput.items())
+            print(f"[bench] {name} {json.dumps(params, ensure_ascii=False)} {summary}", file=sys.stderr)
+
+    def _config(self, size: int, settings: Dict = None, suffix: str = '') -> str:
+        path = os.path.join(self.workdir, f"lora_mapping_{size}{suffix}.json")
+        write_config(path, make_mappings(size, seed=size), settings)
+        return path
+
+    # --- トリガーワード検出 ---
+
+    def run_matching(self):
+        for size in self.sizes:
+            mappings = make_mappings(size, seed=size)
+            prompts = make_prompts(mappings, self.prompt_count, seed=1)
+            # 実際のキューのように同じプロンプトが繰り返し使われる場合
+            repeated = make_prompts(mappings, max(1, self.prompt_count // 20), seed=2) * 20
+
+            path = self._config(size, {'match_cache_size': 0}, '_nocache')
+            manager = LoraManager(path)
+            stats = measure(lambda: [manager.find_trigger_words(p) for p in prompts], self.repeat)
+            self.record('find_trigger_words', {'triggers': size, 'prompts': len(prompts), 'cache': 'off'},
+                        stats, {'prompts_per_sec': len(prompts) / stats['median']})
+            stats = measure(lambda: [manager.select_loras(p, multi_lora=True) for p in prompts], self.repeat)
+            self.record('select_loras', {'triggers': size, 'prompts': len(prompts), 'multi_lora': True,
+                                         'cache': 'off'},
+                        stats, {'prompts_per_sec': len(prompts) / stats['median']})
+
+            path = self._config(size)
+            manager = LoraManager(path)
+            stats = measure(lambda: [manager.find_trigger_words(p) for p in repeated], self.repeat)
+            self.record('find_trigger_words', {'triggers': size, 'prompts': len(repeated), 'cache': 'on',
+                                               'unique_prompts': len(set(repeated))},
+                        stats, {'prompts_per_sec': len(repeated) / stats['median']})
+            del manager
+            gc.collect()
+
+    # --- 設定ファイルの読み書き ---
+
+    def run_config_io(self):
+        for size in self.sizes:
+            path = self._config(size)
+            manager = LoraManager(path)
+            stats = measure(manager.load_config, self.repeat)
+            self.record('load_config', {'triggers': size, 'store': 'json'}, stats)
+            stats = measure(manager.save_config, self.repeat)
+            self.record('save_config', {'triggers': size, 'store': 'json'}, stats)
+
+            # 1件の変更とその保存（JSONは全体、SQLiteは変更行のみ書き込む）
+            trigger_word = manager.list_all_mappings()[0]['trigger_word']
+            strengths = itertools.cycle((0.5, 1.5))
+            stats = measure(lambda: manager.update_lora_mapping(trigger_word, strength=next(strengths)),
+                            self.repeat)
+            self.record('update_lora_mapping', {'triggers': size, 'store': 'json'}, stats)
+
+            db_path = os.path.join(self.workdir, f"lora_mapping_{size}.db")
+            migrate_json_to_sqlite(path, db_path)
+            db_manager = LoraManager(db_path)
+            stats = measure(db_manager.load_config, self.repeat)
+            self.record('load_config', {'triggers': size, 'store': 'sqlite'}, stats)
+            stats = measure(lambda: db_manager.update_lora_mapping(trigger_word, strength=next(strengths)),
+                            self.repeat)
+            self.record('update_lora_mapping', {'triggers': size, 'store': 'sqlite'}, stats)
+            db_manager.store.close()
+            del manager, db_manager
+            gc.collect()
+
+    # --- LoRAの読み込み・適用 ---
+
+    def run_apply(self, lora_count: int, modules: int, rank: int, dim: int, dtype: str = 'F16'):
+        params = {'loras': lora_count, 'modules': modules, 'rank': rank, 'dim': dim, 'dtype': dtype}
+        try:
+            import torch  # noqa: F401
+        except ImportError:
+            for name in ('apply_lora', 'apply_auto_lora'):
+                self.record(name, params, skipped='torch がインストールされていません')
+            return
+
+        lora_dir = os.path.join(self.workdir, 'loras')
+        os.makedirs(lora_dir, exist_ok=True)
+        file_bytes = 0
+        mappings = make_mappings(lora_count, seed=7)
+        for i, mapping in enumerate(mappings):
+            file_bytes += write_lora_safetensors(os.path.join(lora_dir, mapping['lora_file']), modules, rank, dim,
+                                                 dtype, extra_modules=modules // 2, seed=i)
+        params['file_mb'] = round(file_bytes / (1024 * 1024), 2)
+
+        comfy_stub.install(lora_dir)
+        package = comfy_stub.load_package()
+        nodes = package.nodes
+        config_path = os.path.join(self.workdir, 'lora_mapping_apply.json')
+        write_config(config_path, mappings, {'max_lora_count': lora_count})
+        manager = package.lora_manager.LoraManager(config_path)
+        # get_shared() の設定ファイル（リポジトリの config/）を使わないよう直接設定する
+        node = nodes.AutoLoRANode.__new__(nodes.AutoLoRANode)
+        node.lora_manager = manager
+        model, clip = comfy_stub.make_model_and_clip(modules)
+        paths = [os.path.join(lora_dir, mapping['lora_file']) for mapping in mappings]
+        state_cache = nodes.lora_state_cache
+        patched_cache = nodes.patched_model_cache
+
+        def apply_all():
+            for path in paths:
+                node._apply_lora(model, clip, path, 1.0, 1.0)
+
+        def cold():
+            state_cache.clear()
+            apply_all()
+
+        for load_mode in ('full', 'lazy'):
+            manager.update_settings(lora_load_mode=load_mode)
+            stats = measure(cold, self.repeat)
+            self.record('apply_lora', dict(params, load_mode=load_mode, cache='cold'), stats,
+                        {'mb_per_sec': file_bytes / (1024 * 1024) / stats['median']})
+            stats = measure(apply_all, self.repeat)
+            self.record('apply_lora', dict(params, load_mode=load_mode, cache='warm'), stats)
+
+        # キャッシュに保持するdtypeを変えた場合の読み込み時間と保持サイズ
+        manager.update_settings(lora_load_mode='full')
+        for cache_dtype in ('fp16', 'bf16'):
+            manager.update_settings(lora_cache_dtype=cache_dtype)
+            stats = measure(cold, self.repeat)
+            cache_stats = state_cache.stats()
+            self.record('apply_lora', dict(params, load_mode='full', cache='cold', cache_dtype=cache_dtype), stats,
+                        extra={'cache_mb': round(cache_stats['bytes'] / (1024 * 1024), 3),
+                               'saved_mb': round(cache_stats['saved_bytes'] / (1024 * 1024), 3)})
+        manager.update_settings(lora_cache_dtype='none')
+
+        prompt = ', '.join(['1girl', 'solo'] + [mapping['trigger_word'] for mapping in mappings])
+
+        def end_to_end_cold():
+            state_cache.clear()
+            patched_cache.clear()
+            node.apply_auto_lora(model, clip, prompt, multi_lora=True)
+
+        stats = measure(end_to_end_cold, self.repeat)
+        self.record('apply_auto_lora', dict(params, cache='cold'), stats)
+        stats = measure(lambda: node.apply_auto_lora(model, clip, prompt, multi_lora=True), self.repeat)
+        self.record('apply_auto_lora', dict(params, cache='patched_model_hit'), stats)
+        state_cache.clear()
+        patched_cache.clear()
+
+
+    # --- LoRAキャッシュの精度変換 ---
+
+    def run_precision(self, modules: int, rank: int, dim: int):
+        params = {'modules': modules, 'rank': rank, 'dim': dim}
+        try:
+            import torch
+        except ImportError:
+            for cache_dtype in PRECISION_TOLERANCES:
+                self.record('cache_downcast', dict(params, cache_dtype=cache_dtype),
+                            skipped='torch がインストールされていません')
+            return
+        from lora_cache import downcast_state_dict, state_dict_nbytes
+
+        # 学習済みLoRAに近い小さな値の fp32 のLoRA
+        generator = torch.Generator().manual_seed(0)
+        state_dict = {}
+        for i in range(modules):
+            state_dict[f"lora_unet_block_{i}.lora_up.weight"] = torch.randn(dim, rank, generator=generator) * 0.02
+            state_dict[f"lora_unet_block_{i}.lora_down.weight"] = torch.randn(rank, dim, generator=generator) * 0.02
+            state_dict[f"lora_unet_block_{i}.alpha"] = torch.tensor(float(rank))
+        original_bytes = state_dict_nbytes(state_dict)
+
+        for cache_dtype, tolerance in PRECISION_TOLERANCES.items():
+            converted, saved = downcast_state_dict(state_dict, cache_dtype)
+            max_error = 0.0
+            for i in range(modules):
+                up = f"lora_unet_block_{i}.lora_up.weight"
+                down = f"lora_unet_block_{i}.lora_down.weight"
+                # 適用時に展開される差分の重み（up @ down）で比較する
+                expected = state_dict[up] @ state_dict[down]
+                actual = converted[up].float() @ converted[down].float()
+                error = (torch.linalg.norm(actual - expected) / torch.linalg.norm(expected)).item()
+                max_error = max(max_error, error)
+            passed = max_error <= tolerance and converted["lora_unet_block_0.alpha"].dtype == torch.float32
+            if not passed:
+                self.failures += 1
+            stats = measure(lambda: downcast_state_dict(state_dict, cache_dtype), self.repeat)
+            self.record('cache_downcast', dict(params, cache_dtype=cache_dtype), stats, extra={
+                'max_relative_error': max_error,
+                'tolerance': tolerance,
+                'passed': passed,
+                'original_mb': round(original_bytes / (1024 * 1024), 3),
+                'cached_mb': round(state_dict_nbytes(converted) / (1024 * 1024), 3),
+                'saved_ratio': round(saved / original_bytes, 4),
+            })
+            if self.verbose:
+                result = '合格' if passed else '不合格'
+                print(f"[bench] cache_downcast {cache_dtype}: 最大相対誤差 {max_error:.2e} "
+                      f"(許容値 {tolerance:.1e}) {result}", file=sys.stderr)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _meta(args) -> Dict:
+    try:
+        import torch
+        torch_version = torch.__version__
+    except ImportError:
+        torch_version = None
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'torch': torch_version,
+        'args': vars(args),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='ComfyUI Auto LoRA のベンチマーク')
+    parser.add_argument('--only', default=','.join(GROUPS),
+                        help=f"実行するベンチマーク（カンマ区切り: {', '.join(GROUPS)}）")
+    parser.add_argument('--sizes', help='トリガーワード数（カンマ区切り）')
+    parser.add_argument('--prompts', type=int, default=2000, help='1回の計測で照合するプロンプト数')
+    parser.add_argument('--repeat', type=int, default=5, help='計測回数')
+    parser.add_argument('--quick', action='store_true', help='小さいサイズ・少ない回数で実行')
+    parser.add_argument('--loras', type=int, default=4, help='LoRA適用ベンチマークのLoRAファイル数')
+    parser.add_argument('--lora-modules', type=int, default=64, help='LoRAファイルのモジュール数')
+    parser.add_argument('--lora-rank', type=int, default=16, help='LoRAのランク')
+    parser.add_argument('--lora-dim', type=int, default=768, help='LoRAの入出力の次元')
+    parser.add_argument('--lora-dtype', choices=('F16', 'BF16', 'F32'), default='F16',
+                        help='合成するLoRAファイルのdtype')
+    parser.add_argument('-o', '--output', help='結果のJSONの保存先（省略時は標準出力）')
+    parser.add_argument('--keep-files', action='store_true', help='合成したファイルを削除しない')
+    args = parser.parse_args(argv)
+
+    groups = [group.strip() for group in args.only.split(',') if group.strip()]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"不明なベンチマーク: {', '.join(sorted(unknown))}")
+    if args.sizes:
+        sizes = [int(size) for size in args.sizes.split(',')]
+    else:
+        sizes = QUICK_SIZES if args.quick else DEFAULT_SIZES
+    if args.quick:
+        args.prompts = min(args.prompts, 500)
+        args.repeat = min(args.repeat, 3)
+
+    workdir = tempfile.mkdtemp(prefix='autolora_bench_')
+    runner = BenchmarkRunner(workdir, sizes, args.prompts, args.repeat)
+    try:
+        # 標準出力は結果のJSONのみにする（処理中のログは標準エラー出力へ）
+        with contextlib.redirect_stdout(sys.stderr):
+            if 'matching' in groups:
+                runner.run_matching()
+            if 'config_io' in groups:
+                runner.run_config_io()
+            if 'apply' in groups:
+                runner.run_apply(args.loras, args.lora_modules, args.lora_rank, args.lora_dim, args.lora_dtype)
+            if 'precision' in groups:
+                runner.run_precision(args.lora_modules, args.lora_rank, args.lora_dim)
+    finally:
+        if args.keep_files:
+            print(f"[bench] 合成したファイル: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {'schema': SCHEMA_VERSION, 'meta': _meta(args), 'results': runner.results}
+    text = json.dumps(output, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if runner.failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+ベンチマーク用の合成データ
+
+乱数のシードを固定して作るため、同じ引数であれば実行ごとに同じデータになる。
+"""
+
+import json
+import os
+import random
+import struct
+from typing import Dict, List, Sequence
+
+# トリガーワードを組み立てる音節
+_SYLLABLES = (
+    'a', 'ka', 'sa', 'ta', 'na', 'ha', 'ma', 'ya', 'ra', 'wa', 'mi', 'ku', 'ri', 'ne', 'to',
+    'shi', 'chi', 'tsu', 'ro', 'yu', 'ki', 'no', 'se', 'ko', 'ran', 'ren', 'kai', 'sei', 'rin',
+)
+_SUFFIXES = ('', '', '', '_v2', '_style', '_xl', ' style', ' outfit', '_chara')
+
+# プロンプトに混ぜる一般的なタグ
+COMMON_TAGS = (
+    '1girl', '1boy', 'solo', 'masterpiece', 'best quality', 'highres', 'absurdres', 'looking at viewer',
+    'smile', 'open mouth', 'blush', 'long hair', 'short hair', 'blue eyes', 'red eyes', 'brown hair',
+    'black hair', 'blonde hair', 'twintails', 'ponytail', 'school uniform', 'dress', 'skirt', 'hat',
+    'outdoors', 'indoors', 'sky', 'cloud', 'day', 'night', 'city', 'street', 'forest', 'beach',
+    'upper body', 'full body', 'portrait', 'cowboy shot', 'from side', 'from above', 'standing',
+    'sitting', 'holding', 'hand up', 'depth of field', 'bokeh', 'detailed background', 'sunlight',
+    'lens flare', 'cinematic lighting', 'anime coloring', 'watercolor', 'sketch', 'monochrome',
+    '(masterpiece:1.2)', '(best quality:1.1)', '(detailed eyes:1.3)', 'simple background',
+    'white background', 'landscape', 'scenery', 'flower', 'cherry blossoms', 'rain', 'snow',
+)
+
+# LoRAファイルのテンソルのdtype（safetensorsの名前, 1要素のバイト数）
+_DTYPE_SIZES = {'F16': 2, 'BF16': 2, 'F32': 4}
+
+
+def make_mappings(count: int, seed: int = 0) -> List[Dict]:
+    """
+    重複しないトリガーワードのマッピングを作成
+
+    Args:
+        count: マッピング数
+        seed: 乱数のシード
+
+    Returns:
+        マッピングのリスト（lora_file は lora_0000.safetensors 形式）
+    """
+    rng = random.Random(seed)
+    seen = set()
+    mappings = []
+    while len(mappings) < count:
+        word = ''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))) + rng.choice(_SUFFIXES)
+        if word.lower() in seen:
+            word = f"{word}_{len(mappings)}"
+        seen.add(word.lower())
+        mappings.append({
+            'trigger_word': word,
+            'lora_file': f"lora_{len(mappings):04d}.safetensors",
+            'strength': round(rng.uniform(0.4, 1.2), 2),
+            'description': f"benchmark {len(mappings)}",
+        })
+    return mappings
+
+
+def make_prompts(mappings: Sequence[Dict], count: int, hit_rate: float = 0.7,
+                 max_triggers: int = 3, seed: int = 0) -> List[str]:
+    """
+    一般的なタグとトリガーワードを混ぜたプロンプトを作成
+
+    Args:
+        mappings: トリガーワードを取り出すマッピング
+        count: プロンプト数
+        hit_rate: トリガーワードを含むプロンプトの割合
+        max_triggers: 1つのプロンプトに含めるトリガーワードの最大数
+        seed: 乱数のシード
+
+    Returns:
+        プロンプトのリスト
+    """
+    rng = random.Random(seed)
+    prompts = []
+    for _ in range(count):
+        tags = rng.sample(COMMON_TAGS, rng.randint(12, 35))
+        if mappings and rng.random() < hit_rate:
+            for _ in range(rng.randint(1, max_triggers)):
+                tags.insert(rng.randrange(len(tags) + 1), rng.choice(mappings)['trigger_word'])
+        prompts.append(', '.join(tags))
+    return prompts
+
+
+def write_config(path: str, mappings: Sequence[Dict], settings: Dict = None):
+    """
+    lora_mapping.json 形式の設定ファイルを書き込む
+
+    Args:
+        path: 保存先
+        mappings: マッピング
+        settings: 設定辞書
+    """
+    config = {
+        'lora_mappings': list(mappings),
+        'settings': dict({'case_sensitive': False, 'max_lora_count': 3, 'default_strength': 1.0}, **(settings or {})),
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+
+def lora_module_names(modules: int) -> Dict[str, List[str]]:
+    """
+    合成LoRAとスタブのモデルで共通に使うモジュール名
+
+    Args:
+        modules: UNet側のモジュール数（テキストエンコーダー側はその1/4）
+
+    Returns:
+        {'unet': [...], 'clip': [...]}
+    """
+    return {
+        'unet': [f"lora_unet_block_{i}" for i in range(modules)],
+        'clip': [f"lora_te_layer_{i}" for i in range(max(1, modules // 4))],
+    }
+
+
+def write_lora_safetensors(path: str, modules: int = 64, rank: int = 8, dim: int = 768,
+                           dtype: str = 'F16', extra_modules: int = 0, seed: int = 0) -> int:
+    """
+    LoRA形式（lora_up / lora_down / alpha）のsafetensorsファイルを作成
+
+    Args:
+        path: 保存先
+        modules: UNet側のモジュール数
+        rank: LoRAのランク
+        dim: 入出力の次元
+        dtype: テンソルのdtype（F16 / BF16 / F32）
+        extra_modules: 適用先のモデルに存在しないモジュール数（lazy読み込みで読み飛ばされる）
+        seed: 乱数のシード
+
+    Returns:
+        ファイルサイズ（バイト）
+    """
+    rng = random.Random(seed)
+    element_size = _DTYPE_SIZES[dtype]
+    names = lora_module_names(modules)
+    module_names = names['unet'] + names['clip'] + [f"lora_unet_unused_{i}" for i in range(extra_modules)]
+
+    header = {'__metadata__': {'ss_output_name': os.path.splitext(os.path.basename(path))[0]}}
+    offset = 0
+    tensors = []
+    for module in module_names:
+        for suffix, shape in (('lora_up.weight', [dim, rank]), ('lora_down.weight', [rank, dim])):
+            nbytes = shape[0] * shape[1] * element_size
+            header[f"{module}.{suffix}"] = {'dtype': dtype, 'shape': shape, 'data_offsets': [offset, offset + nbytes]}
+            tensors.append(nbytes)
+            offset += nbytes
+        header[f"{module}.alpha"] = {'dtype': 'F32', 'shape': [], 'data_offsets': [offset, offset + 4]}
+        tensors.append(-1)
+        offset += 4
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for nbytes in tensors:
+            if nbytes < 0:
+                f.write(struct.pack('<f', float(rank)))
+            else:
+                # 16ビットは小さな正の値（0x2000 前後）で埋める（NaN/Infを含まない）
+                value = struct.pack('<H', 0x2000 | rng.randrange(0x400)) if element_size == 2 else struct.pack('<f', 1e-3)
+                f.write(value * (nbytes // element_size))
+    return 8 + len(header_bytes) + offset
@@ -0,0 +1,200 @@
+"""
+Server-Sent Events の配信
+
+接続してきたクライアントのソケットをリクエスト処理スレッドから引き取り、
+1つの配信スレッドから全クライアントにイベントを書き込む。長時間つながったままの
+接続がWebUIのワーカースレッドを占有しないようにするため。
+"""
+
+import json
+import queue
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# 接続を維持するためのコメント行を送る間隔（秒）
+HEARTBEAT_INTERVAL = 15.0
+
+# 配信するイベントがない場合に on_tick を呼ぶ間隔（秒）
+TICK_INTERVAL = 2.0
+
+# 1クライアントへの書き込みを待つ最大秒数（超えた場合は切断）
+SEND_TIMEOUT = 5.0
+
+
+def format_event(event: str, data, event_id=None) -> bytes:
+    """
+    SSEの1イベント分のバイト列を作成
+
+    Args:
+        event: イベント名
+        data: JSONに変換するデータ
+        event_id: イベントID（再接続時に Last-Event-ID として送られる）
+
+    Returns:
+        送信するバイト列
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return ("\n".join(lines) + "\n\n").encode('utf-8')
+
+
+class EventHub:
+    """SSEクライアントの管理とイベントの配信"""
+
+    def __init__(self, on_tick: Optional[Callable[[], None]] = None,
+                 heartbeat_interval: float = HEARTBEAT_INTERVAL):
+        """
+        Args:
+            on_tick: 配信スレッドが定期的に呼ぶ関数（外部での設定変更の検出等）
+            heartbeat_interval: コメント行を送る間隔（秒）
+        """
+        self.on_tick = on_tick
+        self.heartbeat_interval = heartbeat_interval
+        self._clients = []
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='AutoLoRA-Events', daemon=True)
+        self._thread.start()
+
+    @property
+    def client_count(self) -> int:
+        """接続中のクライアント数"""
+        with self._lock:
+            return len(self._clients)
+
+    def attach(self, connection: socket.socket, initial: Optional[Callable[[], bytes]] = None):
+        """
+        レスポンスヘッダー送信済みのソケットを配信対象に加える
+
+        追加は配信スレッドで行うため、initial が作成した最初のイベントと
+        その後に配信されるイベントの間に抜けや順序の入れ替わりは生じない。
+
+        Args:
+            connection: クライアントのソケット
+            initial: 最初に送るイベントを作成する関数（配信スレッドで呼ばれる）
+        """
+        if self._closed:
+            self._close_connection(connection)
+            return
+        connection.settimeout(SEND_TIMEOUT)
+        self._queue.put(('attach', connection, initial))
+
+    def _attach(self, connection: socket.socket, initial: Optional[Callable[[], bytes]]):
+        if initial is not None:
+            try:
+                connection.sendall(initial())
+            except OSError:
+                self._close_connection(connection)
+                return
+        with self._lock:
+            self._clients.append(connection)
+
+    def publish(self, event: str, data, event_id=None):
+        """
+        全クライアントにイベントを送る（配信スレッドで送信するため呼び出し側は待たない）
+
+        Args:
+            event: イベント名
+            data: JSONに変換するデータ
+            event_id: イベントID
+        """
+        self._queue.put(('broadcast', format_event(event, data, event_id)))
+
+    def _broadcast(self, payload: bytes):
+        with self._lock:
+            clients = list(self._clients)
+        dead = []
+        for connection in clients:
+            try:
+                connection.sendall(payload)
+            except OSError:
+                dead.append(connection)
+        if dead:
+            with self._lock:
+                self._clients = [c for c in self._clients if c not in dead]
+            for connection in dead:
+                self._close_connection(connection)
+
+    def _run(self):
+        last_sent = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=TICK_INTERVAL)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item and item[0] == 'attach':
+                self._attach(item[1], item[2])
+            elif item:
+                self._broadcast(item[1])
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= self.heartbeat_interval:
+                self._broadcast(b': ping\n\n')
+                last_sent = time.monotonic()
+            if self.on_tick is not None:
+                try:
+                    self.on_tick()
+                except Exception as e:
+                    print(f"[AutoLoRA] イベント配信の定期処理でエラーが発生しました: {e}")
+
+    @staticmethod
+    def _close_connection(connection: socket.socket):
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        connection.close()
+
+    def close(self):
+        """配信を停止し、全クライアントを切断"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            clients = self._clients
+            self._clients = []
+        self._queue.put(None)
+        self._thread.join(timeout=SEND_TIMEOUT)
+        with self._lock:
+            clients.extend(self._clients)
+            self._clients = []
+        for connection in clients:
+            self._close_connection(connection)
+        # 配信スレッドが処理しなかった接続待ちのソケット
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item[0] == 'attach':
+                self._close_connection(item[1])
+
+
+def change_event_to_sse(hub: EventHub, max_changes: int = 500) -> Callable[[Dict], None]:
+    """
+    LoraManager の変更通知をSSEで配信する関数を作成
+
+    差分が max_changes 件を超える場合は reloaded として送り、
+    クライアントに一覧を取得し直させる。
+
+    Args:
+        hub: 配信に使うEventHub
+        max_changes: 差分として送る最大件数
+
+    Returns:
+        LoraManager.add_change_listener に渡す関数
+    """
+    def listener(event: Dict):
+        if event['type'] == 'changes' and len(event['changes']) > max_changes:
+            event = {'type': 'reloaded', 'version': event['version'],
+                     'previous_version': event['previous_version']}
+        hub.publish(event['type'], event, event['version'])
+
+    return listener
@@ -0,0 +1,539 @@
+"""
+複数のLoRAを1つのファイルに結合したバンドル
+
+同じLoRAの組み合わせ（キャラクター・画風・ディテール等）を同じ強度で
+繰り返し使う場合、毎回それぞれのファイルを読み込み、モデルのキーとの
+対応付けを行うことになる。バンドルはLoRAファイルと強度の並びを、
+強度と alpha / rank を up 側に掛けたうえでランク方向に連結した1つの
+LoRA（up = [s1·up1, s2·up2, ...], down = [down1; down2; ...], alpha = 合計ランク）
+として保存する。ComfyUIは up @ down をパッチとして加えるため、バンドルを
+強度 1.0 で適用した結果は各ファイルを順に適用した結果と（丸め誤差を除き）同じになる。
+
+バンドルのファイル名は、元のファイルの内容のハッシュ・mtime と強度から決まる。
+ハッシュはバンドルディレクトリの index.json に (パス, mtime, サイズ) ごとに
+記録するため、検索時にファイルを読み直すことはない。
+
+    python lora_bundle.py build --prompt "miku, watercolor style" --multi-lora
+    python lora_bundle.py build --lora miku.safetensors:0.8 --lora watercolor.safetensors:0.6
+    python lora_bundle.py list
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from .lora_file_index import LoraFileIndex, get_lora_directories
+    from .lora_manager import LoraManager
+    from .mapping_store import write_json_atomic
+    from .safetensors_utils import load_safetensors_filtered, read_safetensors_metadata, save_safetensors
+except ImportError:
+    from lora_file_index import LoraFileIndex, get_lora_directories
+    from lora_manager import LoraManager
+    from mapping_store import write_json_atomic
+    from safetensors_utils import load_safetensors_filtered, read_safetensors_metadata, save_safetensors
+
+# バンドルの形式のバージョン（結合方法を変えた場合は別のバンドルとして作り直す）
+BUNDLE_FORMAT_VERSION = 1
+
+# バンドルのデフォルトの保存先
+DEFAULT_BUNDLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bundles')
+
+# 元のファイルのハッシュを記録するファイル
+INDEX_FILE = 'index.json'
+
+# safetensorsのメタデータのキー
+METADATA_KEY = 'autolora_bundle'
+
+# 使用回数を数えるLoRAの組み合わせの上限（古いものから忘れる）
+MAX_TRACKED_COMBINATIONS = 4096
+
+# ハッシュを計算する際の読み込み単位
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# 結合できるLoRAの形式（up側の接尾辞, down側の接尾辞）
+_PAIR_SUFFIXES = (
+    ('.lora_up.weight', '.lora_down.weight'),
+    ('_lora.up.weight', '_lora.down.weight'),
+    ('.lora_B.weight', '.lora_A.weight'),
+    ('.lora.up.weight', '.lora.down.weight'),
+)
+_ALPHA_SUFFIX = '.alpha'
+
+# (LoRAファイルのパス, 強度)
+Source = Tuple[str, float]
+
+
+def file_sha256(path: str) -> str:
+    """ファイルの内容のSHA-256（16進数）を計算"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def split_lora_modules(state_dict: Dict) -> Dict[str, Dict]:
+    """
+    LoRAのstate dictをモジュールごとの up / down / alpha に分ける
+
+    Args:
+        state_dict: LoRAのstate dict
+
+    Returns:
+        モジュール名 -> {'up', 'down', 'alpha'（ない場合は省略）} の辞書
+
+    Raises:
+        ValueError: up / down の行列以外の形式（LoHa・LoKr・DoRA・lora_mid等）を含む場合
+    """
+    modules = OrderedDict()
+    for name, value in state_dict.items():
+        for up_suffix, down_suffix in _PAIR_SUFFIXES:
+            if name.endswith(up_suffix):
+                prefix, role = name[:-len(up_suffix)], 'up'
+                break
+            if name.endswith(down_suffix):
+                prefix, role = name[:-len(down_suffix)], 'down'
+                break
+        else:
+            if not name.endswith(_ALPHA_SUFFIX):
+                raise ValueError(f"結合できない形式のテンソルです: {name}")
+            prefix, role = name[:-len(_ALPHA_SUFFIX)], 'alpha'
+        modules.setdefault(prefix, {})[role] = value
+
+    for prefix, parts in modules.items():
+        if 'up' not in parts or 'down' not in parts:
+            raise ValueError(f"up / down の揃っていないモジュールです: {prefix}")
+    return modules
+
+
+def _naming_style(prefix: str) -> str:
+    # kohya形式（lora_unet_xxx）は '.' を含まず、diffusers形式（unet.xxx）は含む
+    return 'dotted' if '.' in prefix else 'flat'
+
+
+def fuse_loras(loras: Sequence[Tuple[Dict, float]]) -> Dict:
+    """
+    複数のLoRAを強度を掛けたうえでランク方向に連結する
+
+    同じモジュールのLoRAは up を強度 × alpha / rank 倍して列方向に、down を
+    行方向に連結し、alpha を合計ランクにする（適用時の倍率が1になる）。
+    連結したテンソルは元のテンソルのdtypeのうち精度の高い方で保持する。
+
+    Args:
+        loras: (LoRAのstate dict, 強度) のリスト（強度0のLoRAは含めない）
+
+    Returns:
+        結合したLoRAのstate dict（kohya形式のキー）
+
+    Raises:
+        ValueError: 結合できない形式のLoRA、形状の一致しないモジュール、
+            モジュール名の形式（kohya / diffusers）が異なるLoRAを含む場合
+    """
+    import torch
+
+    grouped = OrderedDict()
+    styles = set()
+    for state_dict, strength in loras:
+        if strength == 0:
+            continue
+        modules = split_lora_modules(state_dict)
+        # 形式の異なるモジュール名は同じ重みを指していても別のモジュールとして
+        # 連結されてしまい、適用時に一方が失われるため結合しない
+        styles.add(frozenset(_naming_style(prefix) for prefix in modules))
+        if len(styles) > 1:
+            raise ValueError("モジュール名の形式が異なるLoRAは結合できません")
+        for prefix, parts in modules.items():
+            up, down = parts['up'], parts['down']
+            scale = float(strength)
+            if parts.get('alpha') is not None:
+                scale *= float(parts['alpha']) / down.shape[0]
+            grouped.setdefault(prefix, []).append((up.float() * scale, down, up.dtype, down.dtype))
+
+    fused = OrderedDict()
+    for prefix, parts in grouped.items():
+        dtype = parts[0][2]
+        for _, _, up_dtype, down_dtype in parts:
+            dtype = torch.promote_types(torch.promote_types(dtype, up_dtype), down_dtype)
+        try:
+            up = torch.cat([scaled_up for scaled_up, _, _, _ in parts], dim=1).to(dtype)
+            down = torch.cat([down.to(dtype) for _, down, _, _ in parts], dim=0)
+        except RuntimeError as e:
+            raise ValueError(f"形状の一致しないモジュールです: {prefix} ({e})")
+        fused[f"{prefix}.lora_up.weight"] = up
+        fused[f"{prefix}.lora_down.weight"] = down
+        fused[f"{prefix}.alpha"] = torch.tensor(float(down.shape[0]))
+    return fused
+
+
+def load_lora_file(path: str) -> Dict:
+    """
+    LoRAファイルを読み込む（ComfyUI内では comfy.utils.load_torch_file を使う）
+
+    Args:
+        path: LoRAファイルのパス
+
+    Returns:
+        LoRAのstate dict
+    """
+    try:
+        import comfy.utils
+    except ImportError:
+        return load_safetensors_filtered(path, lambda name: True)
+    return comfy.utils.load_torch_file(path, safe_load=True)
+
+
+class LoraBundleStore:
+    """バンドルディレクトリの検索・作成"""
+
+    def __init__(self, bundle_dir: str = DEFAULT_BUNDLE_DIR):
+        """
+        Args:
+            bundle_dir: バンドルと index.json の保存先
+        """
+        self.bundle_dir = os.path.abspath(bundle_dir)
+        self.index_path = os.path.join(self.bundle_dir, INDEX_FILE)
+        # 実パス -> {'mtime_ns', 'size', 'sha256'}
+        self._hashes: Dict[str, Dict] = {}
+        self._index_mtime = None
+        self._uses = OrderedDict()
+        self._unsupported = set()
+        # バックグラウンドで作成中の組み合わせ
+        self._building = set()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def _merge_entries_locked(self, entries: Dict[str, Dict]):
+        for path, entry in entries.items():
+            current = self._hashes.get(path)
+            if current is None or entry.get('mtime_ns', 0) >= current.get('mtime_ns', 0):
+                self._hashes[path] = entry
+
+    def _refresh_index_locked(self):
+        # 他のプロセス（CLI等）が更新した index.json を取り込む
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._index_mtime:
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[AutoLoRA] バンドルの索引を読み込めません: {e}")
+            return
+        self._merge_entries_locked(data.get('files', {}))
+        self._index_mtime = mtime
+
+    def _save_index_locked(self):
+        os.makedirs(self.bundle_dir, exist_ok=True)
+        self._refresh_index_locked()
+        write_json_atomic(self.index_path, {'version': BUNDLE_FORMAT_VERSION, 'files': self._hashes})
+        self._index_mtime = os.stat(self.index_path).st_mtime_ns
+
+    def _known_entry(self, path: str) -> Optional[Dict]:
+        # 記録済みのハッシュのうち、現在のファイルと mtime・サイズが一致するもの
+        stat = os.stat(path)
+        with self._lock:
+            self._refresh_index_locked()
+            entry = self._hashes.get(path)
+        if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return entry
+        return None
+
+    def content_hash(self, path: str) -> Dict:
+        """
+        ファイルの内容のハッシュを取得（mtime・サイズが変わっていなければ記録済みの値）
+
+        Args:
+            path: LoRAファイルのパス
+
+        Returns:
+            mtime_ns, size, sha256 を持つ辞書
+        """
+        path = os.path.realpath(path)
+        entry = self._known_entry(path)
+        if entry is not None:
+            return entry
+        stat = os.stat(path)
+        entry = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': file_sha256(path)}
+        with self._lock:
+            self._hashes[path] = entry
+            self._save_index_locked()
+        return entry
+
+    def bundle_path(self, entries: Sequence[Dict], strengths: Sequence[float]) -> str:
+        """
+        元のファイルのハッシュ・mtime と強度からバンドルのパスを決める
+
+        Args:
+            entries: content_hash の結果（適用順）
+            strengths: 強度（適用順）
+
+        Returns:
+            バンドルファイルのパス
+        """
+        key = json.dumps({
+            'version': BUNDLE_FORMAT_VERSION,
+            'sources': [[entry['sha256'], entry['mtime_ns'], float(strength)]
+                        for entry, strength in zip(entries, strengths)],
+        }, sort_keys=True)
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.bundle_dir, f"bundle_{name}.safetensors")
+
+    def find(self, sources: Sequence[Source]) -> Optional[str]:
+        """
+        LoRAの組み合わせのバンドルを検索（ファイルの内容は読まない）
+
+        Args:
+            sources: (LoRAファイルのパス, 強度) のリスト（適用順）
+
+        Returns:
+            バンドルファイルのパス、または作成されていない場合はNone
+        """
+        entries = []
+        try:
+            for path, _ in sources:
+                entry = self._known_entry(os.path.realpath(path))
+                if entry is None:
+                    return None
+                entries.append(entry)
+        except OSError:
+            return None
+        path = self.bundle_path(entries, [strength for _, strength in sources])
+        return path if os.path.isfile(path) else None
+
+    def _combination_key(self, sources: Sequence[Source]) -> Tuple:
+        # ファイルが更新された場合は別の組み合わせとして数える
+        key = []
+        for path, strength in sources:
+            stat = os.stat(path)
+            key.append((os.path.realpath(path), stat.st_mtime_ns, stat.st_size, float(strength)))
+        return tuple(key)
+
+    def record_use(self, sources: Sequence[Source]) -> int:
+        """
+        LoRAの組み合わせの使用回数を数える
+
+        Args:
+            sources: (LoRAファイルのパス, 強度) のリスト（適用順）
+
+        Returns:
+            この組み合わせのプロセス内での使用回数（結合できなかった組み合わせは0）
+        """
+        key = self._combination_key(sources)
+        with self._lock:
+            if key in self._unsupported:
+                return 0
+            count = self._uses.pop(key, 0) + 1
+            self._uses[key] = count
+            while len(self._uses) > MAX_TRACKED_COMBINATIONS:
+                self._uses.popitem(last=False)
+        return count
+
+    def build(self, sources: Sequence[Source], loader: Callable[[str], Dict] = load_lora_file) -> str:
+        """
+        LoRAの組み合わせのバンドルを作成（作成済みの場合はそのパスを返す）
+
+        Args:
+            sources: (LoRAファイルのパス, 強度) のリスト（適用順）
+            loader: パスを受け取りstate dictを返す読み込み関数
+
+        Returns:
+            バンドルファイルのパス
+
+        Raises:
+            ValueError: 結合できないLoRAを含む場合（同じ組み合わせは以降 record_use で数えない）
+        """
+        with self._build_lock:
+            entries = [self.content_hash(path) for path, _ in sources]
+            bundle_path = self.bundle_path(entries, [strength for _, strength in sources])
+            if os.path.isfile(bundle_path):
+                return bundle_path
+
+            try:
+                fused = fuse_loras([(loader(path), strength) for path, strength in sources])
+                if not fused:
+                    raise ValueError("結合するLoRAがありません")
+            except ValueError:
+                with self._lock:
+                    self._unsupported.add(self._combination_key(sources))
+                raise
+
+            metadata = {METADATA_KEY: json.dumps({
+                'version': BUNDLE_FORMAT_VERSION,
+                'sources': [
+                    {'path': os.path.realpath(path), 'strength': float(strength),
+                     'sha256': entry['sha256'], 'mtime_ns': entry['mtime_ns'], 'size': entry['size']}
+                    for (path, strength), entry in zip(sources, entries)
+                ],
+            }, ensure_ascii=False)}
+            os.makedirs(self.bundle_dir, exist_ok=True)
+            save_safetensors(bundle_path, fused, metadata)
+            print(f"[AutoLoRA] LoRAバンドルを作成しました: {os.path.basename(bundle_path)} "
+                  f"({len(sources)}ファイル, {len(fused) // 3}モジュール)")
+            return bundle_path
+
+    def build_in_background(self, sources: Sequence[Source],
+                            loader: Callable[[str], Dict] = load_lora_file) -> bool:
+        """
+        LoRAの組み合わせのバンドルを別スレッドで作成
+
+        作成には全ファイルの読み込みと結合・書き込みが必要なため、ノードの処理を
+        止めないように使う。作成が終わるまでは find() が None を返す。
+
+        Args:
+            sources: (LoRAファイルのパス, 強度) のリスト（適用順）
+            loader: パスを受け取りstate dictを返す読み込み関数
+
+        Returns:
+            作成を開始したかどうか（同じ組み合わせを作成中の場合はFalse）
+        """
+        key = self._combination_key(sources)
+        with self._lock:
+            if key in self._building:
+                return False
+            self._building.add(key)
+
+        def run():
+            try:
+                self.build(sources, loader)
+            except (OSError, ValueError) as e:
+                print(f"[AutoLoRA] バンドルを作成できません: {e}")
+            finally:
+                with self._lock:
+                    self._building.discard(key)
+
+        threading.Thread(target=run, name='AutoLoRA-Bundle', daemon=True).start()
+        return True
+
+    def list_bundles(self) -> List[Dict]:
+        """
+        作成済みのバンドルの一覧
+
+        Returns:
+            path, size, sources（作成時の元ファイルと強度）, current（元のファイルが
+            作成時から変更されていないか）を持つ辞書のリスト
+        """
+        bundles = []
+        if not os.path.isdir(self.bundle_dir):
+            return bundles
+        for name in sorted(os.listdir(self.bundle_dir)):
+            if not (name.startswith('bundle_') and name.endswith('.safetensors')):
+                continue
+            path = os.path.join(self.bundle_dir, name)
+            try:
+                info = json.loads(read_safetensors_metadata(path).get(METADATA_KEY, '{}'))
+            except (OSError, ValueError):
+                info = {}
+            sources = info.get('sources', [])
+            current = bool(sources)
+            for source in sources:
+                try:
+                    stat = os.stat(source['path'])
+                except OSError:
+                    current = False
+                    break
+                if stat.st_mtime_ns != source['mtime_ns'] or stat.st_size != source['size']:
+                    current = False
+            bundles.append({'path': path, 'size': os.path.getsize(path), 'sources': sources, 'current': current})
+        return bundles
+
+
+_stores: Dict[str, LoraBundleStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_bundle_store(settings: Dict) -> LoraBundleStore:
+    """
+    設定の bundle_dir のバンドルストアを取得（同じディレクトリには同じインスタンス）
+
+    Args:
+        settings: LoraManager の設定辞書
+
+    Returns:
+        LoraBundleStore
+    """
+    bundle_dir = os.path.abspath(settings.get('bundle_dir') or DEFAULT_BUNDLE_DIR)
+    with _stores_lock:
+        store = _stores.get(bundle_dir)
+        if store is None:
+            store = _stores[bundle_dir] = LoraBundleStore(bundle_dir)
+        return store
+
+
+def _parse_lora_arg(value: str) -> Tuple[str, float]:
+    # "ファイル:強度"（強度を省略した場合は1.0）
+    name, separator, strength = value.rpartition(':')
+    if separator:
+        try:
+            return name, float(strength)
+        except ValueError:
+            pass
+    return value, 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='複数のLoRAを1つのファイルに結合したバンドルを作成する')
+    parser.add_argument('--config', help='設定ファイルのパス（省略時は config/lora_mapping.json）')
+    parser.add_argument('--bundle-dir', help='バンドルの保存先（省略時は設定の bundle_dir）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='バンドルを作成')
+    build_parser.add_argument('--prompt', help='このプロンプトに適用されるLoRAの組み合わせで作成')
+    build_parser.add_argument('--lora', action='append', default=[], metavar='FILE[:STRENGTH]',
+                              help='結合するLoRAファイルと強度（適用順に複数指定）')
+    build_parser.add_argument('--multi-lora', action='store_true', help='--prompt を複数LoRA適用モードで照合する')
+    build_parser.add_argument('--manual-strength', type=float, default=-1.0,
+                              help='ノードの manual_strength（0以上の場合は全てのLoRAの強度として使う）')
+    subparsers.add_parser('list', help='作成済みのバンドルを表示')
+    args = parser.parse_args()
+
+    lora_manager = LoraManager.get_shared(args.config)
+    settings = dict(lora_manager.settings)
+    if args.bundle_dir:
+        settings['bundle_dir'] = args.bundle_dir
+    store = get_bundle_store(settings)
+
+    if args.command == 'list':
+        for bundle in store.list_bundles():
+            state = '' if bundle['current'] else '（元のファイルが変更されています）'
+            print(f"{os.path.basename(bundle['path'])} {bundle['size'] / (1024 * 1024):.1f} MB{state}")
+            for source in bundle['sources']:
+                print(f"  {source['path']} (強度: {source['strength']})")
+        return
+
+    if bool(args.prompt) == bool(args.lora):
+        parser.error('--prompt と --lora のどちらか一方を指定してください')
+    file_index = LoraFileIndex(lambda: get_lora_directories(settings), refresh_interval=0)
+
+    if args.prompt:
+        requested = []
+        for lora in lora_manager.select_loras(args.prompt, args.multi_lora):
+            strength = args.manual_strength if args.manual_strength >= 0 else lora['strength']
+            requested.append((lora['lora_file'], strength))
+    else:
+        requested = [_parse_lora_arg(value) for value in args.lora]
+
+    sources = []
+    for name, strength in requested:
+        path = name if os.path.isfile(name) else file_index.resolve(name)
+        if path is None:
+            parser.error(f"LoRAファイルが見つかりません: {name}")
+        sources.append((path, strength))
+    if len(sources) < 2:
+        parser.error(f"バンドルには2つ以上のLoRAが必要です（{len(sources)}件）")
+
+    try:
+        bundle_path = store.build(sources)
+    except ValueError as e:
+        parser.exit(1, f"[AutoLoRA] バンドルを作成できません: {e}\n")
+    print(bundle_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+LoRA関連のプロセス内キャッシュ
+
+- LoraStateDictCache: 読み込み済みLoRA（state dict）のキャッシュ。
+  キーは (ファイルパス, mtime, サイズ) で、ファイルが更新されると別エントリになる。
+  合計サイズが上限を超えた場合は最も長く使われていないものから破棄する（LRU）。
+  cache_dtype を指定すると浮動小数点のテンソルを fp16 / bf16 に変換して保持する。
+  LoRAは up / down の行列のまま保持し（適用時もComfyUIがパッチとして扱う）、
+  差分の重みを展開することはない。
+- PatchedModelCache: LoRAから作成したパッチ（重みキー -> 差分）のキャッシュ。
+  同じ入力モデルに同じLoRAの組み合わせ・強度を適用する場合に、LoRAの読み込みと
+  キーの対応付けを省略し、入力モデルの複製にパッチを登録するだけで済ませる。
+"""
+
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+# キャッシュ上限のデフォルト値（MB）
+DEFAULT_CACHE_SIZE_MB = 1024
+
+# LoRAのパッチを保持する組み合わせ数のデフォルト値
+DEFAULT_PATCHED_CACHE_SIZE = 16
+
+# キャッシュに保持するテンソルのdtype（none はファイルのまま）
+CACHE_DTYPES = {
+    'none': None,
+    'fp16': 'float16',
+    'bf16': 'bfloat16',
+}
+
+
+def state_dict_nbytes(state_dict: Dict) -> int:
+    """state dict内のテンソルの合計バイト数を計算"""
+    total = 0
+    for value in state_dict.values():
+        if hasattr(value, 'element_size') and hasattr(value, 'numel'):
+            total += value.element_size() * value.numel()
+    return total
+
+
+def downcast_state_dict(state_dict: Dict, cache_dtype: str) -> Tuple[Dict, int]:
+    """
+    浮動小数点のテンソルを cache_dtype に変換
+
+    要素数が1以下のテンソル（alpha等）と、既に cache_dtype 以下のサイズの
+    テンソル（fp16 / fp8等）はそのままにする。
+
+    Args:
+        state_dict: LoRAのstate dict
+        cache_dtype: CACHE_DTYPES のキー
+
+    Returns:
+        (変換後のstate dict, 削減したバイト数)
+
+    Raises:
+        ValueError: 不正な cache_dtype の場合
+    """
+    if cache_dtype not in CACHE_DTYPES:
+        raise ValueError(f"不正な lora_cache_dtype です: {cache_dtype}（{', '.join(CACHE_DTYPES)}）")
+    dtype_name = CACHE_DTYPES[cache_dtype]
+    if dtype_name is None:
+        return state_dict, 0
+
+    import torch
+    dtype = getattr(torch, dtype_name)
+    target_size = torch.empty((), dtype=dtype).element_size()
+
+    converted = {}
+    saved = 0
+    for name, value in state_dict.items():
+        if (hasattr(value, 'is_floating_point') and value.is_floating_point()
+                and value.numel() > 1 and value.element_size() > target_size):
+            saved += (value.element_size() - target_size) * value.numel()
+            value = value.to(dtype)
+        converted[name] = value
+    return converted, saved
+
+
+class LoraStateDictCache:
+    """バイト数上限付きのLRUキャッシュ"""
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_SIZE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self._saved_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_max_bytes(self, max_bytes: int):
+        """上限を変更（超過分は直ちに破棄）"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict_locked(0)
+
+    def get_or_load(self, path: str, loader: Callable[[str], Dict], variant: Hashable = None,
+                    cache_dtype: str = 'none') -> Dict:
+        """
+        キャッシュからLoRAを取得し、なければ読み込んで登録する
+
+        Args:
+            path: LoRAファイルのパス
+            loader: パスを受け取りstate dictを返す読み込み関数
+            variant: 同じファイルを異なる方法で読み込む場合の識別子
+            cache_dtype: 保持するテンソルのdtype（CACHE_DTYPES のキー）
+
+        Returns:
+            LoRAのstate dict
+        """
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size, variant, cache_dtype)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        state_dict, saved = downcast_state_dict(loader(path), cache_dtype)
+        nbytes = state_dict_nbytes(state_dict)
+
+        with self._lock:
+            # 上限を超える単体ファイルはキャッシュしない
+            if nbytes > self.max_bytes or key in self._entries:
+                return state_dict
+            # 同じファイルの古いバージョンは不要なので破棄
+            for old_key in [k for k in self._entries if k[0] == path and k[1:3] != key[1:3]]:
+                self._remove_locked(old_key)
+            self._evict_locked(nbytes)
+            self._entries[key] = (state_dict, nbytes, saved)
+            self._current_bytes += nbytes
+            self._saved_bytes += saved
+
+        return state_dict
+
+    def _remove_locked(self, key):
+        _, nbytes, saved = self._entries.pop(key)
+        self._current_bytes -= nbytes
+        self._saved_bytes -= saved
+
+    def _evict_locked(self, incoming_bytes: int):
+        while self._entries and self._current_bytes + incoming_bytes > self.max_bytes:
+            key = next(iter(self._entries))
+            self._remove_locked(key)
+            self.evictions += 1
+
+    def clear(self):
+        """全エントリを破棄"""
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+            self._saved_bytes = 0
+
+    def stats(self) -> Dict:
+        """
+        キャッシュの統計情報を取得
+
+        Returns:
+            hits, misses, evictions, entries, bytes, max_bytes, saved_bytes
+            （cache_dtype への変換で削減している保持中のバイト数）を含む辞書
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._current_bytes,
+                'max_bytes': self.max_bytes,
+                'saved_bytes': self._saved_bytes,
+            }
+
+
+def _make_ref(obj):
+    """弱参照を作成（Noneの場合は常にNoneを返す関数）"""
+    if obj is None:
+        return lambda: None
+    return weakref.ref(obj)
+
+
+class PatchedModelCache:
+    """
+    LoRAのパッチを入力モデルの同一性とLoRA構成で引くキャッシュ
+
+    適用後のMODEL/CLIPは入力モデルを親として参照するため保持せず、LoRAから作成した
+    パッチ（LoRAのテンソルのみを参照する）を保持する。ヒットした場合は現在の
+    入力モデルを複製してパッチを登録し直す。入力モデルは弱参照で保持するため、
+    チェックポイントがアンロードされて入力モデルが解放されると対応するエントリも破棄される。
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_PATCHED_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._finalizers = {}
+        # GCによるfinalizeがロック保持中に走っても良いようにRLockを使用
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, model, clip, lora_key: Hashable):
+        return (id(model), id(clip), lora_key)
+
+    def get(self, model, clip, lora_key: Hashable) -> Optional[Tuple]:
+        """
+        キャッシュ済みのパッチを取得
+
+        Args:
+            model: 入力MODEL
+            clip: 入力CLIP
+            lora_key: 適用するLoRAの順序付きリストと強度から作ったキー
+
+        Returns:
+            (パッチ, モデル強度, CLIP強度) のタプル、またはNone
+        """
+        key = self._key(model, clip, lora_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            # id() の再利用に備え、弱参照先が同一オブジェクトか確認
+            if entry is not None and entry[0]() is model and entry[1]() is clip:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            return None
+
+    def put(self, model, clip, lora_key: Hashable, steps: Tuple):
+        """
+        パッチを登録
+
+        Args:
+            model: 入力MODEL
+            clip: 入力CLIP
+            lora_key: 適用するLoRAの順序付きリストと強度から作ったキー
+            steps: 適用する順の (パッチ, モデル強度, CLIP強度) のタプル
+                （入力モデルや適用後のモデルを参照するものを含めないこと）
+        """
+        if self.max_entries <= 0:
+            return
+        try:
+            model_ref = _make_ref(model)
+            clip_ref = _make_ref(clip)
+        except TypeError:
+            # 弱参照できないオブジェクトはキャッシュしない
+            return
+
+        key = self._key(model, clip, lora_key)
+        with self._lock:
+            self._entries[key] = (model_ref, clip_ref, steps)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            for obj in (model, clip):
+                if obj is not None and id(obj) not in self._finalizers:
+                    self._finalizers[id(obj)] = weakref.finalize(obj, self._discard, id(obj))
+
+    def _discard(self, object_id: int):
+        """入力モデルが解放された際に関連エントリを破棄"""
+        with self._lock:
+            self._finalizers.pop(object_id, None)
+            for key in [k for k in self._entries if k[0] == object_id or k[1] == object_id]:
+                del self._entries[key]
+
+    def clear(self):
+        """全エントリを破棄"""
+        with self._lock:
+            self._entries.clear()
+            # 解放済みのオブジェクトとidが重なった場合に登録できなくなるため、監視も解除する
+            for finalizer in self._finalizers.values():
+                finalizer.detach()
+            self._finalizers.clear()
+
+    def stats(self) -> Dict:
+        """
+        キャッシュの統計情報を取得
+
+        Returns:
+            hits, misses, entries, max_entries を含む辞書
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+
+# プロセス全体で共有するキャッシュ
+lora_state_cache = LoraStateDictCache()
+patched_model_cache = PatchedModelCache()
+
+_hook_installed = False
+
+
+def install_free_memory_hook(model_management):
+    """
+    ComfyUIがメモリ解放を要求した際（unload_all_models）にキャッシュも破棄する
+
+    Args:
+        model_management: comfy.model_management モジュール
+    """
+    global _hook_installed
+    if _hook_installed or not hasattr(model_management, 'unload_all_models'):
+        return
+
+    original = model_management.unload_all_models
+
+    def unload_all_models(*args, **kwargs):
+        lora_state_cache.clear()
+        patched_model_cache.clear()
+        return original(*args, **kwargs)
+
+    model_management.unload_all_models = unload_all_models
+    _hook_installed = True
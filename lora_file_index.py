@@ -0,0 +1,284 @@
+"""
+LoRAファイルの索引
+
+LoRAディレクトリを一度だけ再帰的に走査し、ファイル名・拡張子なしの名前・
+相対パスから完全パスを引けるようにする。以降はディレクトリのmtimeだけを
+確認し、変更のあったディレクトリのみ再走査する。
+大文字小文字を区別しないファイルシステム（Windows等）のディレクトリでは、
+大文字小文字の異なる名前でも解決できる。
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional
+
+# ファイル名解決に使う拡張子（folder_pathsが利用できない場合）
+LORA_EXTENSIONS = {'.safetensors', '.ckpt', '.pt', '.pth', '.bin'}
+
+# ディレクトリのmtimeを確認する最小間隔（秒）のデフォルト値
+DEFAULT_REFRESH_INTERVAL = 5.0
+
+
+def get_lora_directories(settings: Dict = None) -> List[str]:
+    """
+    LoRAディレクトリの一覧を取得
+
+    ComfyUI内では folder_paths の設定を使い、WebUIを単独で起動した
+    場合は settings.lora_directories を使う。
+
+    Args:
+        settings: LoraManagerの設定辞書
+
+    Returns:
+        ディレクトリパスのリスト
+    """
+    try:
+        import folder_paths
+        return list(folder_paths.get_folder_paths("loras"))
+    except ImportError:
+        return list((settings or {}).get('lora_directories', []))
+
+
+def is_case_insensitive_directory(path: str) -> bool:
+    """
+    ディレクトリのあるファイルシステムが大文字小文字を区別しないかを判定
+
+    ディレクトリ名の大文字小文字を入れ替えたパスが同じディレクトリを指すかで判定する
+    （名前に英字がない場合はOSの既定で判断する）。
+
+    Args:
+        path: ディレクトリのパス
+
+    Returns:
+        大文字小文字を区別しない場合はTrue
+    """
+    parent, name = os.path.split(os.path.abspath(path))
+    swapped = name.swapcase()
+    if swapped == name:
+        return os.path.normcase('A') == 'a'
+    try:
+        return os.path.samefile(path, os.path.join(parent, swapped))
+    except OSError:
+        return False
+
+
+class _DirectoryState:
+    """走査済みディレクトリ1つ分の情報"""
+
+    __slots__ = ('mtime', 'realpath', 'files', 'subdirs')
+
+    def __init__(self, mtime: int, realpath: str, files: List[str], subdirs: List[str]):
+        self.mtime = mtime
+        # シンボリックリンクを解決した実際のパス（循環の検出用）
+        self.realpath = realpath
+        self.files = files
+        self.subdirs = subdirs
+
+
+class LoraFileIndex:
+    """LoRAファイル名 -> 完全パス の索引"""
+
+    def __init__(self, directories_provider: Callable[[], Iterable[str]],
+                 refresh_interval: float = DEFAULT_REFRESH_INTERVAL):
+        """
+        Args:
+            directories_provider: LoRAディレクトリ一覧を返す関数
+            refresh_interval: ディレクトリのmtimeを確認する最小間隔（秒）
+        """
+        self.directories_provider = directories_provider
+        self.refresh_interval = refresh_interval
+        self._roots: List[str] = []
+        self._dirs: Dict[str, _DirectoryState] = {}
+        self._by_relpath: Dict[str, str] = {}
+        self._by_name: Dict[str, str] = {}
+        self._by_stem: Dict[str, str] = {}
+        # 大文字小文字を区別しないディレクトリのファイルの casefold した名前 -> 完全パス
+        self._folded: List[Dict[str, str]] = [{}, {}, {}]
+        self._case_insensitive: Dict[str, bool] = {}
+        self._last_refresh = None
+        self._lock = threading.Lock()
+        # 索引が変化するたびに増える番号と、最後に変化した時刻（UNIX時間）
+        self.generation = 0
+        self.changed_at = time.time()
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        変更のあったディレクトリのみ再走査して索引を更新
+
+        Args:
+            force: Trueの場合は間隔制限を無視して確認
+
+        Returns:
+            索引が変化したかどうか
+        """
+        now = time.monotonic()
+        if (not force and self._last_refresh is not None
+                and now - self._last_refresh < self.refresh_interval):
+            return False
+
+        with self._lock:
+            self._last_refresh = now
+            roots = [os.path.abspath(d) for d in self.directories_provider()]
+            changed = roots != self._roots
+            for old_root in self._roots:
+                if old_root not in roots:
+                    self._forget(old_root)
+                    self._case_insensitive.pop(old_root, None)
+            self._roots = roots
+
+            for directory in list(self._dirs):
+                if directory in self._dirs and self._scan_if_changed(directory):
+                    changed = True
+            for root in roots:
+                if root not in self._dirs and self._scan_if_changed(root):
+                    changed = True
+                    self._case_insensitive[root] = is_case_insensitive_directory(root)
+
+            if changed:
+                self._rebuild_lookup()
+            return changed
+
+    def _scan_if_changed(self, directory: str) -> bool:
+        """ディレクトリのmtimeが変わっていれば再走査（サブディレクトリは再帰）"""
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            if directory in self._dirs:
+                self._forget(directory)
+                return True
+            return False
+
+        state = self._dirs.get(directory)
+        if state is not None and state.mtime == mtime:
+            return False
+
+        realpath = os.path.realpath(directory)
+        if self._is_ancestor_link(directory, realpath):
+            # 上位のディレクトリへのシンボリックリンク等は無限に辿らないよう索引に含めない
+            if state is not None:
+                self._forget(directory)
+                return True
+            return False
+
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            subdirs.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in LORA_EXTENSIONS:
+                            files.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            return False
+
+        old_subdirs = set(state.subdirs) if state is not None else set()
+        self._dirs[directory] = _DirectoryState(mtime, realpath, sorted(files), sorted(subdirs))
+
+        for removed in old_subdirs - set(subdirs):
+            self._forget(removed)
+        for subdir in subdirs:
+            if subdir not in old_subdirs:
+                self._scan_if_changed(subdir)
+        return True
+
+    def _is_ancestor_link(self, directory: str, realpath: str) -> bool:
+        """索引内の上位のディレクトリと同じ実体か（シンボリックリンク・ジャンクションの循環）"""
+        parent = os.path.dirname(directory)
+        while parent != directory:
+            state = self._dirs.get(parent)
+            if state is None:
+                return False
+            if state.realpath == realpath:
+                return True
+            directory, parent = parent, os.path.dirname(parent)
+        return False
+
+    def _forget(self, directory: str):
+        """ディレクトリとその配下を索引から除外"""
+        state = self._dirs.pop(directory, None)
+        if state is not None:
+            for subdir in state.subdirs:
+                self._forget(subdir)
+
+    def _walk(self, root: str):
+        """ディレクトリ配下のファイルを浅い階層から順に列挙"""
+        queue = deque([root])
+        while queue:
+            directory = queue.popleft()
+            state = self._dirs.get(directory)
+            if state is None:
+                continue
+            for name in state.files:
+                yield directory, name
+            queue.extend(state.subdirs)
+
+    def _rebuild_lookup(self):
+        by_relpath = {}
+        by_name = {}
+        by_stem = {}
+        folded = [{}, {}, {}]
+        # 先に指定されたディレクトリ・浅い階層のファイルを優先
+        for root in self._roots:
+            case_insensitive = self._case_insensitive.get(root, False)
+            for directory, name in self._walk(root):
+                full_path = os.path.join(directory, name)
+                relpath = os.path.relpath(full_path, root).replace(os.sep, '/')
+                stem = os.path.splitext(name)[0]
+                by_relpath.setdefault(relpath, full_path)
+                by_name.setdefault(name, full_path)
+                by_stem.setdefault(stem, full_path)
+                if case_insensitive:
+                    for lookup, key in zip(folded, (relpath, name, stem)):
+                        lookup.setdefault(key.casefold(), full_path)
+        self._by_relpath = by_relpath
+        self._by_name = by_name
+        self._by_stem = by_stem
+        self._folded = folded
+        self.generation += 1
+        self.changed_at = time.time()
+
+    def resolve(self, lora_filename: str) -> Optional[str]:
+        """
+        設定上のLoRAファイル名から完全パスを解決
+
+        相対パス、ファイル名、拡張子なしの名前の順に照合する。見つからない場合は、
+        大文字小文字を区別しないディレクトリのファイルに限り大文字小文字を無視して照合する
+        （Windowsでは設定上の名前と実際のファイル名の大文字小文字が異なっても読み込めるため）。
+
+        Args:
+            lora_filename: LoRAファイル名（サブディレクトリを含む相対パスも可）
+
+        Returns:
+            LoRAファイルの完全パス、またはNone
+        """
+        if not lora_filename:
+            return None
+        self.refresh()
+        key = lora_filename.replace('\\', '/')
+        found = (self._by_relpath.get(key)
+                 or self._by_name.get(key)
+                 or self._by_stem.get(key))
+        if found is None:
+            folded_key = key.casefold()
+            found = next((lookup[folded_key] for lookup in self._folded if folded_key in lookup), None)
+        return found
+
+    def iter_files(self):
+        """
+        索引内の全LoRAファイルを列挙
+
+        Returns:
+            (LoRAディレクトリからの相対パス, 完全パス) のイテレータ
+        """
+        self.refresh()
+        return iter(list(self._by_relpath.items()))
+
+    def exists(self, lora_filename: str) -> bool:
+        """LoRAファイルが索引に存在するか"""
+        return self.resolve(lora_filename) is not None
@@ -1,30 +1,462 @@
-import json
+import atexit
+import hashlib
 import os
-import re
-from typing import Dict, List, Optional, Tuple
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from operator import attrgetter, itemgetter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    from .mapping_store import create_store
+    from .trigger_matcher import TriggerMatcher
+except ImportError:
+    from mapping_store import create_store
+    from trigger_matcher import TriggerMatcher
+
+# 変更検出のためにファイルをstatする最小間隔（秒）のデフォルト値
+DEFAULT_RELOAD_INTERVAL = 2.0
+
+# プロンプトごとの検出結果を保持する件数のデフォルト値
+DEFAULT_MATCH_CACHE_SIZE = 1024
+
+_shared_managers = {}
+_shared_lock = threading.Lock()
+
+
+def _default_config_path() -> str:
+    """
+    カスタムノードのディレクトリを基準にconfigファイルのパスを返す
+    
+    環境変数 AUTO_LORA_STORAGE=sqlite の場合はSQLiteデータベースを使う。
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    if os.environ.get('AUTO_LORA_STORAGE', '').lower() == 'sqlite':
+        return os.path.join(current_dir, "config", "lora_mapping.db")
+    return os.path.join(current_dir, "config", "lora_mapping.json")
+
+
+def normalize_trigger(trigger_word: str, case_sensitive: bool) -> str:
+    """
+    重複判定・検索に使うトリガーワードのキー
+    
+    大文字小文字を区別しない場合のみ小文字にする（区別する場合は "Foo" と "foo" は別のキー）。
+    """
+    return trigger_word if case_sensitive else trigger_word.lower()
+
+
+def build_trigger_index(entries: Sequence[Dict], case_sensitive: bool) -> Dict[str, 'TriggerGroup']:
+    """
+    保存されているマッピングから検索用の索引を作成
+    
+    同じキーになるトリガーワードは先に書かれたものしかマッチしないため、
+    キーごとに設定ファイル上の順でまとめて先頭を有効な定義とする
+    （残りは重複として扱い、保存されている内容からは削除しない）。
+    
+    Args:
+        entries: 設定ファイル上の順のマッピング
+        case_sensitive: 大文字小文字を区別するか
+    
+    Returns:
+        キー -> TriggerGroup の辞書（挿入順が優先順）。番号は entries での位置
+    """
+    grouped = {}
+    for order, mapping in enumerate(entries):
+        key = normalize_trigger(mapping['trigger_word'], case_sensitive)
+        grouped.setdefault(key, []).append((order, mapping))
+    return {key: TriggerGroup(tuple(members)) for key, members in grouped.items()}
+
+
+class TriggerGroup:
+    """
+    同じキーになるマッピングの組（作成後は変更しない）
+    
+    members は (番号, マッピング) を設定ファイル上の順に並べたタプルで、
+    番号が小さいほど設定ファイル上で前にある。先頭の定義のみが検出に使われる。
+    """
+    
+    __slots__ = ('members',)
+    
+    def __init__(self, members: Tuple[Tuple[int, Dict], ...]):
+        self.members = members
+    
+    @property
+    def order(self) -> int:
+        """有効な定義の番号"""
+        return self.members[0][0]
+    
+    @property
+    def mapping(self) -> Dict:
+        """有効な定義（検出に使うマッピング）"""
+        return self.members[0][1]
+    
+    def locate(self, trigger_word: str) -> int:
+        """完全に一致するトリガーワードの組の中での位置（なければ有効な定義の0）"""
+        for position, (_, mapping) in enumerate(self.members):
+            if mapping['trigger_word'] == trigger_word:
+                return position
+        return 0
+    
+    def replace(self, position: int, mapping: Optional[Dict]) -> Optional['TriggerGroup']:
+        """
+        position 番目のマッピングを置き換えた組を返す
+        
+        Args:
+            position: 組の中での位置
+            mapping: 新しいマッピング（Noneの場合は削除し、次の重複が有効になる）
+        
+        Returns:
+            新しい TriggerGroup（全て削除した場合はNone）
+        """
+        members = self.members
+        if mapping is None:
+            members = members[:position] + members[position + 1:]
+        else:
+            members = members[:position] + ((members[position][0], mapping),) + members[position + 1:]
+        return TriggerGroup(members) if members else None
+
+
+class ConfigSnapshot:
+    """
+    ある時点の設定内容（公開後は変更しない）
+    
+    読み込み側はロックを取らずに LoraManager._snapshot を1回だけ参照し、
+    処理の最後までそのスナップショットを使う。書き込み側は新しい
+    スナップショットを作成して参照を差し替える（属性の代入はアトミック）。
+    
+    索引はマッチャー（正規化済みトリガーワード -> TriggerGroup）のみで、
+    1件の変更では変更したトリガーワードの経路だけを複製した新しいマッチャーから
+    スナップショットを作るため、マッピング数に比例する処理を行わない。
+    全マッピングの一覧（entries / mapping_list / duplicates）は最初に参照したときに作成する。
+    """
+    
+    __slots__ = ('version', 'published_at', 'settings', 'case_sensitive', 'matcher', 'next_order',
+                 'duplicate_count', 'match_cache', '_entries', '_mapping_list', '_duplicates')
+    
+    def __init__(self, version: int, matcher: TriggerMatcher, settings: Dict,
+                 next_order: int = 0, duplicate_count: int = 0):
+        """
+        Args:
+            version: 設定バージョン
+            matcher: 正規化済みトリガーワード -> TriggerGroup のマッチャー
+            settings: 設定辞書
+            next_order: 次に追加するマッピングの番号
+            duplicate_count: 重複しているため検出に使われないマッピングの数
+        """
+        self.version = version
+        # 公開した時刻（UNIX時間）
+        self.published_at = time.time()
+        self.settings = settings
+        self.case_sensitive = settings.get('case_sensitive', False)
+        self.matcher = matcher
+        self.next_order = next_order
+        self.duplicate_count = duplicate_count
+        # プロンプト -> 検出結果 のLRUキャッシュ（スナップショットごと）
+        self.match_cache = OrderedDict()
+        # 参照時に作成する一覧（複数のスレッドが同時に作成しても内容は同じ）
+        self._entries = None
+        self._mapping_list = None
+        self._duplicates = None
+    
+    def lookup(self, key: str) -> Optional[TriggerGroup]:
+        """正規化済みトリガーワードのマッピングの組（なければNone）"""
+        values = self.matcher.get(key)
+        return values[0] if values else None
+    
+    def active_mapping(self, key: str) -> Optional[Dict]:
+        """正規化済みトリガーワードに対応する有効なマッピング（なければNone）"""
+        group = self.lookup(key)
+        return group.mapping if group is not None else None
+    
+    def get_entry(self, trigger_word: str) -> Optional[Dict]:
+        """完全に一致するトリガーワードのマッピング（重複した定義を含む、なければNone）"""
+        group = self.lookup(normalize_trigger(trigger_word, self.case_sensitive))
+        if group is None:
+            return None
+        mapping = group.members[group.locate(trigger_word)][1]
+        return mapping if mapping['trigger_word'] == trigger_word else None
+    
+    @property
+    def entries(self) -> Tuple[Dict, ...]:
+        """保存されている全マッピング（重複を含む、設定ファイル上の順）"""
+        if self._entries is None:
+            members = [member for group in self.matcher.values() for member in group.members]
+            members.sort(key=itemgetter(0))
+            self._entries = tuple(mapping for _, mapping in members)
+        return self._entries
+    
+    @property
+    def mapping_list(self) -> Tuple[Dict, ...]:
+        """検出に使う有効なマッピング（設定ファイル上の順）"""
+        if self._mapping_list is None:
+            groups = sorted(self.matcher.values(), key=attrgetter('order'))
+            self._mapping_list = tuple(group.mapping for group in groups)
+        return self._mapping_list
+    
+    @property
+    def duplicates(self) -> List[Tuple[Dict, Dict]]:
+        """(重複したマッピング, 優先される定義) のリスト（設定ファイル上の順）"""
+        if self._duplicates is None:
+            duplicates = []
+            if self.duplicate_count:
+                duplicates = [
+                    (order, mapping, group.mapping)
+                    for group in self.matcher.values() for order, mapping in group.members[1:]
+                ]
+                duplicates.sort(key=itemgetter(0))
+            self._duplicates = [(mapping, active) for _, mapping, active in duplicates]
+        return self._duplicates
+
+
+class WorkingCopy:
+    """
+    書き込み用の設定内容（LoraManager._lock を保持して操作する）
+    
+    公開中のスナップショットのマッチャーから変更したトリガーワードの分だけ
+    新しいマッチャーを作り、公開するまで読み込み側からは見えない。トリガーワードの
+    検索・削除・重複の繰り上げはキーで行うため、マッピング数によらない。
+    マッピングの辞書自体はスナップショットと共有しているため、変更する場合は置き換えること。
+    """
+    
+    __slots__ = ('matcher', 'settings', 'next_order', 'duplicate_count')
+    
+    def __init__(self, matcher: TriggerMatcher, settings: Dict, next_order: int = 0, duplicate_count: int = 0):
+        self.matcher = matcher
+        self.settings = settings
+        self.next_order = next_order
+        self.duplicate_count = duplicate_count
+    
+    @classmethod
+    def from_snapshot(cls, snapshot: ConfigSnapshot) -> 'WorkingCopy':
+        """公開中のスナップショットから作成（マッチャーは共有し、設定のみ複製）"""
+        return cls(snapshot.matcher, dict(snapshot.settings), snapshot.next_order, snapshot.duplicate_count)
+    
+    @classmethod
+    def from_entries(cls, entries: Sequence[Dict], settings: Dict) -> 'WorkingCopy':
+        """全マッピングから作成（設定ファイルを読み込んだ場合）"""
+        index = build_trigger_index(entries, settings.get('case_sensitive', False))
+        return cls(TriggerMatcher((key, group) for key, group in index.items()), settings,
+                   len(entries), len(entries) - len(index))
+    
+    def to_snapshot(self, version: int) -> ConfigSnapshot:
+        """公開するスナップショットを作成"""
+        return ConfigSnapshot(version, self.matcher, self.settings, self.next_order, self.duplicate_count)
+    
+    def key(self, trigger_word: str) -> str:
+        """現在の case_sensitive でのトリガーワードのキー"""
+        return normalize_trigger(trigger_word, self.settings.get('case_sensitive', False))
+    
+    def lookup(self, key: str) -> Optional[TriggerGroup]:
+        """正規化済みトリガーワードのマッピングの組（なければNone）"""
+        values = self.matcher.get(key)
+        return values[0] if values else None
+    
+    def locate(self, trigger_word: str) -> Optional[Tuple[str, int]]:
+        """
+        トリガーワードに対応するマッピングの (キー, 組の中での位置) を取得
+        
+        完全に一致するトリガーワードを優先し、なければ索引（大文字小文字を
+        区別しない場合は小文字で比較）で有効なマッピングを返す。
+        """
+        key = self.key(trigger_word)
+        group = self.lookup(key)
+        if group is None:
+            return None
+        return key, group.locate(trigger_word)
+    
+    def get(self, key: str, position: int) -> Dict:
+        """locate で取得した位置のマッピング"""
+        return self.lookup(key).members[position][1]
+    
+    def append(self, mapping: Dict):
+        """マッピングを末尾に追加（同じキーがある場合は重複として追加）"""
+        key = self.key(mapping['trigger_word'])
+        member = (self.next_order, mapping)
+        self.next_order += 1
+        group = self.lookup(key)
+        if group is None:
+            group = TriggerGroup((member,))
+        else:
+            group = TriggerGroup(group.members + (member,))
+            self.duplicate_count += 1
+        self.matcher = self.matcher.with_values(key, (group,))
+    
+    def replace(self, key: str, position: int, mapping: Optional[Dict]):
+        """locate で取得した位置のマッピングを置き換える（Noneの場合は削除）"""
+        group = self.lookup(key)
+        if mapping is None and len(group.members) > 1:
+            self.duplicate_count -= 1
+        group = group.replace(position, mapping)
+        self.matcher = self.matcher.with_values(key, (group,) if group is not None else ())
+    
+    def entries(self) -> List[Dict]:
+        """全マッピングを設定ファイル上の順で取得（重複を含む）"""
+        members = [member for group in self.matcher.values() for member in group.members]
+        members.sort(key=itemgetter(0))
+        return [mapping for _, mapping in members]
+    
+    def reindex(self):
+        """重複判定のキー（case_sensitive）が変わった場合に索引を作り直す"""
+        rebuilt = self.from_entries(self.entries(), self.settings)
+        self.matcher = rebuilt.matcher
+        self.next_order = rebuilt.next_order
+        self.duplicate_count = rebuilt.duplicate_count
+
 
 class LoraManager:
     """Loraの管理とトリガーワード検出を行うクラス"""
     
-    def __init__(self, config_path: str = None):
+    def __init__(self, config_path: str = None, store=None):
+        """
+        Args:
+            config_path: 設定ファイルのパス（.db / .sqlite の場合はSQLiteに保存）
+            store: 保存先のストア（省略時は config_path から作成）
+        """
         if config_path is None:
-            # カスタムノードのディレクトリを基準にconfigファイルのパスを設定
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            config_path = os.path.join(current_dir, "config", "lora_mapping.json")
+            config_path = _default_config_path()
         
         self.config_path = config_path
-        self.lora_mappings = []
-        self.settings = {}
+        self.store = store or create_store(config_path)
+        # 読み込み側が参照する公開済みの設定内容
+        self._snapshot = ConfigSnapshot(0, TriggerMatcher(), {})
+        self.match_cache_hits = 0
+        self.match_cache_misses = 0
+        # 最後に読み書きした設定ファイルの (mtime, size)
+        self._file_signature = None
+        self._last_reload_check = 0.0
+        # 書き込み側の状態（すべて _lock を保持して操作する）
+        self._lock = threading.RLock()
+        # 編集中の設定内容（WorkingCopy）。公開するまで読み込み側からは見えない
+        self._working = None
+        self._batch_depth = 0
+        self._dirty = False
+        # 未保存の変更 ('upsert'|'delete', トリガーワード) / ('settings', 設定項目のタプル)
+        # （行単位の書き込みと、外部で変更された設定ファイルへの再適用に使用）
+        self._pending_changes = []
+        # 最後に公開してからの変更（変更通知用。形式は _pending_changes と同じ）
+        self._unpublished_changes = []
+        self._listeners = []
+        self._flush_timer = None
+        self._atexit_registered = False
         self.load_config()
     
+    @property
+    def lora_mappings(self) -> Tuple[Dict, ...]:
+        """設定ファイル上の順序に並んだLoraマッピング（重複した定義を含む、読み取り専用）"""
+        return self._snapshot.entries
+    
+    @property
+    def settings(self) -> Dict:
+        """現在の設定辞書（読み取り専用。変更は update_settings で行う）"""
+        return self._snapshot.settings
+    
+    @property
+    def config_version(self) -> int:
+        """設定変更のたびに増えるバージョン番号"""
+        return self._snapshot.version
+    
+    def snapshot(self) -> ConfigSnapshot:
+        """
+        現在のスナップショットを取得
+        
+        バージョンとマッピングの組み合わせが一貫している必要がある場合に使う。
+        返されたスナップショットの内容は変更しないこと。
+        
+        Returns:
+            公開中のConfigSnapshot
+        """
+        return self._snapshot
+    
+    @classmethod
+    def get_shared(cls, config_path: str = None) -> 'LoraManager':
+        """
+        プロセス内で共有するLoraManagerを取得
+        
+        同じ設定ファイルに対しては常に同じインスタンスを返すため、
+        ノードごとに設定ファイルを読み直すことがない。
+        
+        Args:
+            config_path: 設定ファイルのパス（Noneの場合はデフォルト）
+        
+        Returns:
+            共有LoraManagerインスタンス
+        """
+        key = os.path.abspath(config_path or _default_config_path())
+        with _shared_lock:
+            manager = _shared_managers.get(key)
+            if manager is None:
+                manager = cls(key)
+                _shared_managers[key] = manager
+            return manager
+    
+    def _stat_config_file(self):
+        """設定ファイルの変更検出用の値を取得（JSONの場合は (mtime, size)、存在しない場合はNone）"""
+        try:
+            return self.store.change_token()
+        except Exception:
+            return None
+    
+    def reload_if_changed(self, force: bool = False) -> bool:
+        """
+        設定ファイルが他のプロセス等で更新されていれば再読み込みする
+        
+        statによる (mtime, size) の比較のみを行い、変更がある場合に限り
+        JSONを読み込んでマッチャーを再構築する。チェックは
+        settings.reload_interval 秒に1回までに制限される。
+        他のスレッドが書き込み中の場合は待たずに次回のチェックに回す。
+        
+        Args:
+            force: Trueの場合は間隔制限を無視してチェック
+        
+        Returns:
+            再読み込みしたかどうか
+        """
+        now = time.monotonic()
+        interval = self.settings.get('reload_interval', DEFAULT_RELOAD_INTERVAL)
+        if not force and now - self._last_reload_check < interval:
+            return False
+        
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._last_reload_check = now
+            
+            signature = self._stat_config_file()
+            if signature is None or signature == self._file_signature:
+                return False
+            if self._dirty or self._batch_depth > 0:
+                # 未保存の変更がある間は読み込まず、書き込み時に外部の変更と統合する
+                return False
+            
+            try:
+                config = self.store.load()
+            except Exception as e:
+                # 書き込み途中の可能性があるため現在の設定を維持し、次回再試行する
+                print(f"設定ファイルの再読み込みエラー: {e}")
+                return False
+            
+            self._apply_config(config, signature)
+        finally:
+            self._lock.release()
+        print(f"[AutoLoRA] 設定ファイルの変更を検出し再読み込みしました: {self.config_path}")
+        return True
+    
+    def _apply_config(self, config: Dict, signature):
+        """読み込んだ設定内容を反映"""
+        with self._lock:
+            self._working = None
+            working = WorkingCopy.from_entries(config.get('lora_mappings', []), dict(config.get('settings', {})))
+            self._publish(working, reloaded=True)
+            self._file_signature = signature
+            self._pending_changes = []
+    
     def load_config(self):
         """設定ファイルを読み込む"""
         try:
-            if os.path.exists(self.config_path):
-                with open(self.config_path, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    self.lora_mappings = config.get('lora_mappings', [])
-                    self.settings = config.get('settings', {})
+            if self.store.exists():
+                signature = self._stat_config_file()
+                self._apply_config(self.store.load(), signature)
             else:
                 print(f"設定ファイルが見つかりません: {self.config_path}")
                 self.create_default_config()
@@ -50,35 +482,386 @@ class LoraManager:
             }
         }
         
-        # ディレクトリが存在しない場合は作成
-        os.makedirs(os.path.dirname(self.config_path), exist_ok=True)
+        self.store.save(default_config)
         
-        with open(self.config_path, 'w', encoding='utf-8') as f:
-            json.dump(default_config, f, indent=2, ensure_ascii=False)
+        self._apply_config(default_config, self._stat_config_file())
+    
+    def _publish(self, working: WorkingCopy, reloaded: bool = False):
+        """
+        新しいスナップショットを作成して公開し、変更を通知する（_lock を保持して呼ぶ）
         
-        self.lora_mappings = default_config['lora_mappings']
-        self.settings = default_config['settings']
+        Args:
+            working: 公開する設定内容
+            reloaded: 設定ファイル全体を読み込み直した場合はTrue
+        """
+        previous = self._snapshot
+        self._snapshot = working.to_snapshot(previous.version + 1)
+        changes = self._unpublished_changes
+        self._unpublished_changes = []
+        if self._listeners:
+            self._notify(self._build_change_event(previous, self._snapshot, changes, reloaded))
+    
+    @staticmethod
+    def _build_change_event(previous: ConfigSnapshot, snapshot: ConfigSnapshot,
+                            changes: List[Tuple], reloaded: bool) -> Dict:
+        """公開前後のスナップショットと記録した変更から通知内容を作成"""
+        event = {
+            'version': snapshot.version,
+            'previous_version': previous.version
+        }
+        if (reloaded or previous.duplicate_count or snapshot.duplicate_count
+                or previous.case_sensitive != snapshot.case_sensitive):
+            # 外部での変更は差分が分からないため、読み込み直したことだけを通知
+            # （重複や case_sensitive の変更で有効なマッピングが入れ替わる場合も同様）
+            event['type'] = 'reloaded'
+            return event
+        
+        deltas = []
+        seen = set()
+        settings_changed = False
+        for change in changes:
+            if change[0] == 'settings':
+                settings_changed = True
+                continue
+            key = normalize_trigger(change[1], snapshot.case_sensitive)
+            if key in seen:
+                continue
+            seen.add(key)
+            old = previous.active_mapping(key)
+            new = snapshot.active_mapping(key)
+            if old is None and new is not None:
+                deltas.append({'type': 'added', 'mapping': new})
+            elif old is not None and new is None:
+                deltas.append({'type': 'removed', 'trigger_word': old['trigger_word']})
+            elif old is not None and old != new:
+                deltas.append({'type': 'updated', 'mapping': new})
+        if settings_changed and previous.settings != snapshot.settings:
+            deltas.append({'type': 'settings', 'settings': snapshot.settings})
+        
+        event['type'] = 'changes'
+        event['changes'] = deltas
+        return event
+    
+    def _notify(self, event: Dict):
+        for listener in list(self._listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"[AutoLoRA] 変更通知の処理でエラーが発生しました: {e}")
+    
+    def add_change_listener(self, listener):
+        """
+        設定の変更を通知する関数を登録
+        
+        新しいスナップショットを公開するたびに、書き込み用のロックを保持したまま
+        公開順に呼ばれるため、時間のかかる処理は行わないこと。
+        
+        Args:
+            listener: 通知内容の辞書を受け取る関数。通知内容は
+                type が 'changes' の場合: version, previous_version, changes
+                （added / removed / updated / settings の差分のリスト）
+                type が 'reloaded' の場合: version, previous_version
+        """
+        with self._lock:
+            self._listeners.append(listener)
+    
+    def remove_change_listener(self, listener):
+        """add_change_listener で登録した関数を解除"""
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+    
+    def _edit(self) -> WorkingCopy:
+        """
+        書き込み用の設定内容を取得（_lock を保持して呼ぶ）
+        
+        初回は公開中のスナップショットから作成する（batch() の中では終了まで同じものを使う）。
+        """
+        if self._working is None:
+            self._working = WorkingCopy.from_snapshot(self._snapshot)
+        return self._working
+    
+    def _commit(self) -> bool:
+        """
+        編集内容を公開して保存する（_lock を保持して呼ぶ）
+        
+        batch() の中では公開・保存ともにブロックの終了時にまとめて行う。
+        """
+        if self._batch_depth > 0:
+            self._dirty = True
+            return True
+        if self._working is not None:
+            self._publish(self._working)
+            self._working = None
+        return self.save_config()
+    
+    def _discard_edit(self):
+        """変更しなかった編集用のコピーを破棄する（batch() の中では保持）"""
+        if self._batch_depth == 0:
+            self._working = None
+    
+    def _find_matching_groups(self, text: str, snapshot: ConfigSnapshot = None):
+        """
+        テキストにマッチする全トリガーワードのマッピングの組を取得（結果はキャッシュ）
+        
+        ロックは取らない。キャッシュはスナップショットごとに持つため、
+        設定が変わると古い結果は参照されなくなる。
+        
+        Args:
+            text: 検索対象のテキスト
+            snapshot: 使用するスナップショット（Noneの場合は現在のもの）
+        
+        Returns:
+            マッチした TriggerGroup のfrozenset
+        """
+        if snapshot is None:
+            snapshot = self._snapshot
+        search_text = text if snapshot.case_sensitive else text.lower()
+        
+        max_entries = snapshot.settings.get('match_cache_size', DEFAULT_MATCH_CACHE_SIZE)
+        if max_entries <= 0:
+            return frozenset(snapshot.matcher.find_all(search_text))
+        
+        cache = snapshot.match_cache
+        key = hashlib.sha1(search_text.encode('utf-8')).digest()
+        groups = cache.get(key)
+        if groups is not None:
+            try:
+                cache.move_to_end(key)
+            except KeyError:
+                # 他のスレッドが同時に破棄した場合
+                pass
+            self.match_cache_hits += 1
+            return groups
+        
+        self.match_cache_misses += 1
+        groups = frozenset(snapshot.matcher.find_all(search_text))
+        cache[key] = groups
+        try:
+            while len(cache) > max_entries:
+                cache.popitem(last=False)
+        except KeyError:
+            pass
+        return groups
+    
+    def get_match_cache_stats(self) -> Dict:
+        """
+        プロンプト検出結果キャッシュの統計情報を取得
+        
+        Returns:
+            hits, misses, hit_rate, entries, max_entries を含む辞書
+        """
+        snapshot = self._snapshot
+        total = self.match_cache_hits + self.match_cache_misses
+        return {
+            'hits': self.match_cache_hits,
+            'misses': self.match_cache_misses,
+            'hit_rate': self.match_cache_hits / total if total else 0.0,
+            'entries': len(snapshot.match_cache),
+            'max_entries': snapshot.settings.get('match_cache_size', DEFAULT_MATCH_CACHE_SIZE),
+        }
     
     def save_config(self):
-        """設定ファイルを保存"""
+        """
+        設定ファイルを保存
+        
+        batch() の中では終了時にまとめて保存し、settings.write_behind_delay が
+        正の値の場合はその秒数だけ待ってから（その間の変更をまとめて）保存する。
+        
+        Returns:
+            成功したかどうか（保存を予約した場合もTrue）
+        """
+        with self._lock:
+            if self._batch_depth > 0:
+                self._dirty = True
+                return True
+            
+            delay = self.settings.get('write_behind_delay', 0)
+            if delay and delay > 0:
+                self._dirty = True
+                self._schedule_flush(delay)
+                return True
+        
+        return self._write_config()
+    
+    def _record_change(self, *change):
+        """
+        変更内容を記録（変更通知、行単位の書き込み、外部の変更との統合に使用）
+        
+        Args:
+            change: ('upsert', トリガーワード) / ('delete', トリガーワード) / ('settings', 設定項目のタプル)
+        """
+        self._unpublished_changes.append(change)
+        self._pending_changes.append(change)
+    
+    def _merge_external_changes(self) -> bool:
+        """
+        他のプロセスが更新した設定ファイルを読み込み、未保存の変更を再適用して公開する（_lock を保持して呼ぶ）
+        
+        最後に読み書きした後に設定ファイルが変更されていた場合、そのまま書き込むと
+        他のプロセスの変更が失われるため、読み込んだ内容に自分の変更
+        （追加・更新・削除したマッピングと変更した設定項目）だけを適用し直す。
+        
+        Returns:
+            成功したかどうか（読み込めなかった場合はFalse）
+        """
         try:
-            config = {
-                "lora_mappings": self.lora_mappings,
-                "settings": self.settings
-            }
-            with open(self.config_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=2, ensure_ascii=False)
-            return True
+            config = self.store.load()
         except Exception as e:
-            print(f"設定ファイルの保存エラー: {e}")
+            print(f"[AutoLoRA] 外部で変更された設定ファイルを読み込めないため保存を見送ります: {e}")
             return False
+        
+        snapshot = self._snapshot
+        entries = list(config.get('lora_mappings', []))
+        settings = dict(config.get('settings', {}))
+        # トリガーワード -> 読み込んだ内容での位置（完全に同じトリガーワードが複数ある場合は前から）
+        positions = {}
+        for position, entry in enumerate(entries):
+            positions.setdefault(entry['trigger_word'], []).append(position)
+        for change in self._pending_changes:
+            if change[0] == 'settings':
+                for key in change[1]:
+                    if key in snapshot.settings:
+                        settings[key] = snapshot.settings[key]
+                    else:
+                        settings.pop(key, None)
+                continue
+            
+            trigger_word = change[1]
+            mapping = snapshot.get_entry(trigger_word) if change[0] == 'upsert' else None
+            found = positions.get(trigger_word)
+            if mapping is None:
+                if found:
+                    # 削除した位置は最後にまとめて詰める
+                    entries[found.pop(0)] = None
+            elif not found:
+                positions[trigger_word] = [len(entries)]
+                entries.append(mapping)
+            else:
+                entries[found[0]] = mapping
+        
+        entries = [entry for entry in entries if entry is not None]
+        self._publish(WorkingCopy.from_entries(entries, settings), reloaded=True)
+        print(f"[AutoLoRA] 設定ファイルが外部で変更されていたため、未保存の変更"
+              f"（{len(self._pending_changes)}件）を再適用しました: {self.config_path}")
+        return True
     
-    def find_trigger_words(self, text: str) -> List[Dict]:
+    def _write_config(self) -> bool:
+        """
+        公開中の設定内容を保存先に書き込む（JSONはアトミックに全体、SQLiteは変更行のみ）
+        
+        最後に読み書きした後に他のプロセスが設定ファイルを更新していた場合は、
+        先にその内容へ未保存の変更を再適用する（_merge_external_changes）。
+        """
+        with self._lock:
+            signature = self._stat_config_file()
+            if signature is not None and signature != self._file_signature:
+                if not self._merge_external_changes():
+                    self._dirty = True
+                    return False
+            snapshot = self._snapshot
+            try:
+                if self.store.supports_incremental:
+                    # 変更したトリガーワードのマッピングのみを渡す
+                    by_trigger_word = {}
+                    for change in self._pending_changes:
+                        mapping = snapshot.get_entry(change[1]) if change[0] == 'upsert' else None
+                        if mapping is not None:
+                            by_trigger_word[change[1]] = mapping
+                    self.store.apply_changes(self._pending_changes, by_trigger_word, snapshot.settings)
+                else:
+                    config = {
+                        "lora_mappings": list(snapshot.entries),
+                        "settings": snapshot.settings
+                    }
+                    self.store.save(config)
+                self._pending_changes = []
+                # 自分自身の書き込みを外部変更として再読み込みしないよう記録
+                self._file_signature = self._stat_config_file()
+                self._dirty = False
+                return True
+            except Exception as e:
+                print(f"設定ファイルの保存エラー: {e}")
+                self._dirty = True
+                return False
+    
+    def _schedule_flush(self, delay: float):
+        """遅延書き込みを予約（予約済みの場合はその書き込みにまとめる）"""
+        if self._flush_timer is not None:
+            return
+        if not self._atexit_registered:
+            atexit.register(self.flush)
+            self._atexit_registered = True
+        self._flush_timer = threading.Timer(delay, self._flush_from_timer)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+    
+    def _flush_from_timer(self):
+        with self._lock:
+            self._flush_timer = None
+            if self._dirty and self._batch_depth == 0:
+                self._write_config()
+    
+    def flush(self) -> bool:
+        """
+        予約中の遅延書き込みを直ちに実行
+        
+        Returns:
+            成功したかどうか（未保存の変更がない場合もTrue）
+        """
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._dirty:
+                return True
+            return self._write_config()
+    
+    @contextmanager
+    def batch(self):
+        """
+        複数の変更を1回の公開・書き込みにまとめるコンテキストマネージャー
+        
+        ブロック内の変更は終了時にまとめて公開・保存される（それまで読み込み側からは
+        見えない）。例外が発生した場合はブロック内の変更を破棄し、何も保存しない。
+        ブロックの間は書き込み用のロックを保持するため、他のスレッドの変更が
+        混ざることはない（読み込み側は待たされない）。
+        
+        使用例:
+            with manager.batch():
+                manager.add_lora_mapping(...)
+                manager.remove_lora_mapping(...)
+        """
+        with self._lock:
+            backup = None
+            if self._batch_depth == 0:
+                backup = (self._working, self._dirty, list(self._pending_changes),
+                          list(self._unpublished_changes))
+            self._batch_depth += 1
+            
+            try:
+                yield self
+            except BaseException:
+                self._batch_depth -= 1
+                if backup is not None:
+                    (self._working, self._dirty, self._pending_changes,
+                     self._unpublished_changes) = backup
+                raise
+            
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                if self._dirty:
+                    self._commit()
+                else:
+                    self._working = None
+    
+    def find_trigger_words(self, text: str, snapshot: ConfigSnapshot = None) -> List[Dict]:
         """
         テキスト内のトリガーワードを検出する
         
         Args:
             text: 検索対象のテキスト
+            snapshot: 使用するスナップショット（Noneの場合は現在のもの）
             
         Returns:
             マッチしたトリガーワード情報のリスト
@@ -86,32 +869,76 @@ class LoraManager:
         if not text:
             return []
         
-        case_sensitive = self.settings.get('case_sensitive', False)
-        search_text = text if case_sensitive else text.lower()
+        if snapshot is None:
+            snapshot = self._snapshot
+        # 全トリガーワードを1回の走査で検出（単語境界を考慮した完全一致）
+        groups = self._find_matching_groups(text, snapshot)
         
         found_triggers = []
+        if groups:
+            # 最初に見つかったもののみ返す（仕様通り）
+            first = min(groups, key=attrgetter('order'))
+            found_triggers.append(self._build_trigger_info(first.mapping, snapshot.settings))
+        
+        return found_triggers
+    
+    def find_matching_loras(self, text: str, max_count: int = None,
+                            snapshot: ConfigSnapshot = None) -> List[Dict]:
+        """
+        テキスト内のトリガーワードから適用するLoraを複数選択する
         
-        for mapping in self.lora_mappings:
-            trigger_word = mapping['trigger_word']
-            if not case_sensitive:
-                trigger_word = trigger_word.lower()
-            
-            # 完全一致での検出（単語境界を考慮）
-            pattern = r'\b' + re.escape(trigger_word) + r'\b'
-            
-            if re.search(pattern, search_text):
-                found_triggers.append({
-                    'trigger_word': mapping['trigger_word'],
-                    'lora_file': mapping['lora_file'],
-                    'strength': mapping.get('strength', self.settings.get('default_strength', 1.0)),
-                    'description': mapping.get('description', ''),
-                    'original_mapping': mapping
-                })
-                
-                # 最初に見つかったもののみ返す（仕様通り）
+        1回の走査で全トリガーワードを検出し、priority（大きい順）と
+        設定ファイル上の順序で並べ、LoRAファイルが重複しないように
+        最大 max_count 件まで返す。
+        
+        Args:
+            text: 検索対象のテキスト
+            max_count: 最大件数（Noneの場合は settings.max_lora_count）
+            snapshot: 使用するスナップショット（Noneの場合は現在のもの）
+            
+        Returns:
+            適用順に並んだLora情報のリスト
+        """
+        if not text:
+            return []
+        
+        if snapshot is None:
+            snapshot = self._snapshot
+        if max_count is None:
+            max_count = snapshot.settings.get('max_lora_count', 3)
+        if max_count <= 0:
+            return []
+        
+        groups = self._find_matching_groups(text, snapshot)
+        ranked = sorted(
+            groups,
+            key=lambda group: (-group.mapping.get('priority', 0), group.order)
+        )
+        
+        results = []
+        seen_files = set()
+        for group in ranked:
+            mapping = group.mapping
+            # 同じLoRAファイルを指すトリガーワードは最上位のもののみ採用
+            if mapping['lora_file'] in seen_files:
+                continue
+            seen_files.add(mapping['lora_file'])
+            results.append(self._build_trigger_info(mapping, snapshot.settings))
+            if len(results) >= max_count:
                 break
         
-        return found_triggers
+        return results
+    
+    @staticmethod
+    def _build_trigger_info(mapping: Dict, settings: Dict) -> Dict:
+        """マッピングから検出結果の辞書を作成"""
+        return {
+            'trigger_word': mapping['trigger_word'],
+            'lora_file': mapping['lora_file'],
+            'strength': mapping.get('strength', settings.get('default_strength', 1.0)),
+            'description': mapping.get('description', ''),
+            'original_mapping': mapping
+        }
     
     def get_first_matching_lora(self, text: str) -> Optional[Dict]:
         """
@@ -126,8 +953,65 @@ class LoraManager:
         triggers = self.find_trigger_words(text)
         return triggers[0] if triggers else None
     
+    def select_loras(self, text: str, multi_lora: bool = False,
+                     snapshot: ConfigSnapshot = None) -> List[Dict]:
+        """
+        テキストから適用するLoRAを選択（AutoLoRANodeと同じ規則）
+        
+        Args:
+            text: 入力テキスト
+            multi_lora: Trueの場合は find_matching_loras、Falseの場合は最初にマッチした1件
+            snapshot: 使用するスナップショット（Noneの場合は現在のもの）
+            
+        Returns:
+            適用順に並んだLora情報のリスト
+        """
+        if multi_lora:
+            return self.find_matching_loras(text, snapshot=snapshot)
+        return self.find_trigger_words(text, snapshot)
+    
+    def match_prompts(self, prompts: List[str], multi_lora: bool = False, executor=None,
+                      chunk_size: int = 256,
+                      snapshot: ConfigSnapshot = None) -> List[Tuple[List[Dict], float]]:
+        """
+        複数のプロンプトについて適用されるLoRAを調べる
+        
+        全てのプロンプトを同じスナップショットで照合する。executor が指定され、
+        プロンプトが chunk_size 件を超える場合は chunk_size 件ずつ分けて並行に処理する。
+        
+        Args:
+            prompts: プロンプトのリスト
+            multi_lora: 複数LoRA適用モード
+            executor: concurrent.futures のExecutor（Noneの場合は順番に処理）
+            chunk_size: 1回のタスクで処理する件数
+            snapshot: 使用するスナップショット（Noneの場合は現在のもの）
+            
+        Returns:
+            プロンプトと同じ順序の (Lora情報のリスト, 照合にかかった秒数) のリスト
+        """
+        if snapshot is None:
+            snapshot = self._snapshot
+        
+        def match_chunk(chunk):
+            results = []
+            for prompt in chunk:
+                start = time.perf_counter()
+                loras = self.select_loras(prompt, multi_lora, snapshot)
+                results.append((loras, time.perf_counter() - start))
+            return results
+        
+        if executor is None or len(prompts) <= chunk_size:
+            return match_chunk(prompts)
+        
+        chunks = [prompts[i:i + chunk_size] for i in range(0, len(prompts), chunk_size)]
+        results = []
+        for chunk_results in executor.map(match_chunk, chunks):
+            results.extend(chunk_results)
+        return results
+    
     def add_lora_mapping(self, trigger_word: str, lora_file: str, 
-                        strength: float = 1.0, description: str = "") -> bool:
+                        strength: float = 1.0, description: str = "",
+                        priority: Optional[int] = None) -> bool:
         """
         新しいLora マッピングを追加
         
@@ -136,43 +1020,95 @@ class LoraManager:
             lora_file: Loraファイル名
             strength: 強度
             description: 説明
+            priority: 優先度（Noneの場合は設定しない）
             
         Returns:
             成功したかどうか
         """
-        # 既存のトリガーワードをチェック
-        for mapping in self.lora_mappings:
-            if mapping['trigger_word'].lower() == trigger_word.lower():
+        with self._lock:
+            working = self._edit()
+            # 既存のトリガーワードをチェック
+            if working.lookup(working.key(trigger_word)) is not None:
                 print(f"トリガーワード '{trigger_word}' は既に登録されています")
+                self._discard_edit()
                 return False
+            
+            new_mapping = {
+                "trigger_word": trigger_word,
+                "lora_file": lora_file,
+                "strength": strength,
+                "description": description
+            }
+            if priority is not None:
+                new_mapping["priority"] = priority
+            
+            working.append(new_mapping)
+            self._record_change('upsert', trigger_word)
+            return self._commit()
+    
+    def add_lora_mappings(self, mappings: List[Dict]) -> Tuple[int, List[str]]:
+        """
+        複数のLoraマッピングをまとめて追加（公開・設定ファイルの保存は1回のみ）
         
-        new_mapping = {
-            "trigger_word": trigger_word,
-            "lora_file": lora_file,
-            "strength": strength,
-            "description": description
-        }
-        
-        self.lora_mappings.append(new_mapping)
-        return self.save_config()
+        Args:
+            mappings: trigger_word, lora_file, strength, description を持つ辞書のリスト
+            
+        Returns:
+            (追加した件数, スキップしたトリガーワードのリスト)
+        """
+        with self._lock:
+            working = self._edit()
+            added = 0
+            skipped = []
+            
+            for mapping in mappings:
+                trigger_word = mapping.get('trigger_word', '')
+                if (not trigger_word or not mapping.get('lora_file')
+                        or working.lookup(working.key(trigger_word)) is not None):
+                    skipped.append(trigger_word)
+                    continue
+                new_mapping = {
+                    "trigger_word": trigger_word,
+                    "lora_file": mapping['lora_file'],
+                    "strength": mapping.get('strength', working.settings.get('default_strength', 1.0)),
+                    "description": mapping.get('description', '')
+                }
+                working.append(new_mapping)
+                self._record_change('upsert', trigger_word)
+                added += 1
+            
+            if not added:
+                self._discard_edit()
+                return 0, skipped
+            if not self._commit():
+                return 0, skipped
+            return added, skipped
     
     def remove_lora_mapping(self, trigger_word: str) -> bool:
         """
         Loraマッピングを削除
         
+        完全に一致するトリガーワードのマッピングを優先して削除する（重複した
+        定義のうち有効でない方も削除できる）。
+        
         Args:
             trigger_word: 削除するトリガーワード
             
         Returns:
             成功したかどうか
         """
-        for i, mapping in enumerate(self.lora_mappings):
-            if mapping['trigger_word'].lower() == trigger_word.lower():
-                del self.lora_mappings[i]
-                return self.save_config()
-        
-        print(f"トリガーワード '{trigger_word}' が見つかりません")
-        return False
+        with self._lock:
+            working = self._edit()
+            location = working.locate(trigger_word)
+            if location is not None:
+                removed = working.get(*location)
+                working.replace(*location, None)
+                self._record_change('delete', removed['trigger_word'])
+                return self._commit()
+            
+            print(f"トリガーワード '{trigger_word}' が見つかりません")
+            self._discard_edit()
+            return False
     
     def update_lora_mapping(self, trigger_word: str, **updates) -> bool:
         """
@@ -185,24 +1121,68 @@ class LoraManager:
         Returns:
             成功したかどうか
         """
-        for mapping in self.lora_mappings:
-            if mapping['trigger_word'].lower() == trigger_word.lower():
+        with self._lock:
+            working = self._edit()
+            location = working.locate(trigger_word)
+            if location is not None:
+                # 公開中のスナップショットと共有している辞書は変更せずに置き換える
+                mapping = dict(working.get(*location))
                 for key, value in updates.items():
-                    if key in ['lora_file', 'strength', 'description']:
+                    if key in ['lora_file', 'strength', 'description', 'priority']:
                         mapping[key] = value
-                return self.save_config()
+                working.replace(*location, mapping)
+                self._record_change('upsert', mapping['trigger_word'])
+                return self._commit()
+            
+            print(f"トリガーワード '{trigger_word}' が見つかりません")
+            self._discard_edit()
+            return False
+    
+    def get_lora_mapping(self, trigger_word: str) -> Optional[Dict]:
+        """
+        トリガーワードに対応する有効なLoraマッピングを取得
+        （case_sensitive が無効の場合は大文字小文字を区別しない）
         
-        print(f"トリガーワード '{trigger_word}' が見つかりません")
-        return False
+        Args:
+            trigger_word: トリガーワード
+            
+        Returns:
+            Loraマッピング、またはNone
+        """
+        snapshot = self._snapshot
+        mapping = snapshot.active_mapping(normalize_trigger(trigger_word, snapshot.case_sensitive))
+        return dict(mapping) if mapping is not None else None
     
     def list_all_mappings(self) -> List[Dict]:
         """
-        全てのLoraマッピングを取得
+        保存されている全てのLoraマッピングを取得（重複した定義を含む）
         
         Returns:
             Loraマッピングのリスト
         """
-        return self.lora_mappings.copy()
+        return list(self._snapshot.entries)
+    
+    def get_duplicate_mappings(self) -> List[Dict]:
+        """
+        重複しているため検出に使われないマッピングを取得
+        
+        先に書かれた定義と同じトリガーワード（case_sensitive が無効の場合は
+        大文字小文字の違いのみのものを含む）のマッピング。設定ファイルには
+        残したまま、検出には最初の定義のみを使う。
+        
+        Returns:
+            trigger_word, lora_file, active_trigger_word（有効な定義のトリガーワード）,
+            active_lora_file を持つ辞書のリスト
+        """
+        return [
+            {
+                'trigger_word': mapping['trigger_word'],
+                'lora_file': mapping.get('lora_file', ''),
+                'active_trigger_word': active['trigger_word'],
+                'active_lora_file': active.get('lora_file', ''),
+            }
+            for mapping, active in self._snapshot.duplicates
+        ]
     
     def get_settings(self) -> Dict:
         """
@@ -223,5 +1203,12 @@ class LoraManager:
         Returns:
             成功したかどうか
         """
-        self.settings.update(settings)
-        return self.save_config()
\ No newline at end of file
+        with self._lock:
+            working = self._edit()
+            case_sensitive = working.settings.get('case_sensitive', False)
+            working.settings.update(settings)
+            if working.settings.get('case_sensitive', False) != case_sensitive:
+                # 重複判定のキーが変わるため索引を作り直す
+                working.reindex()
+            self._record_change('settings', tuple(settings))
+            return self._commit()
\ No newline at end of file
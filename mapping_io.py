@@ -0,0 +1,246 @@
+"""
+Loraマッピングの一括エクスポート・インポート（JSONL / CSV）
+
+エクスポートはマッピングを1行ずつ文字列にして返すジェネレーターで、
+全体を1つの文字列にまとめずにそのまま送信・書き込みできる。
+インポートは1行ずつ読み込んで検証し、問題がなければ
+LoraManager.batch() の中で登録して設定ファイルへの書き込みを1回にまとめる。
+"""
+
+import csv
+import io
+import json
+import math
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+try:
+    from .lora_manager import normalize_trigger
+except ImportError:
+    from lora_manager import normalize_trigger
+
+# 対応する形式
+FORMATS = ('jsonl', 'csv')
+
+# エクスポート・インポートする項目（CSVの列順）
+EXPORT_FIELDS = ('trigger_word', 'lora_file', 'strength', 'description', 'priority')
+
+# インポート結果に含めるエラーの最大件数
+MAX_REPORTED_ERRORS = 1000
+
+
+class _ImportConflict(Exception):
+    """検証後に登録できなくなった行があり、インポート全体を取り消す場合"""
+
+
+def iter_export_lines(mappings: Iterable[Dict], fmt: str = 'jsonl') -> Iterator[str]:
+    """
+    マッピングを1行ずつエクスポート形式の文字列にする
+
+    Args:
+        mappings: マッピングの列
+        fmt: 'jsonl' または 'csv'（CSVは先頭にヘッダー行）
+
+    Returns:
+        改行付きの文字列を返すイテレーター
+    """
+    if fmt == 'jsonl':
+        for mapping in mappings:
+            row = {field: mapping[field] for field in EXPORT_FIELDS if field in mapping}
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+    elif fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(EXPORT_FIELDS)
+        for mapping in mappings:
+            writer.writerow([mapping.get(field, '') for field in EXPORT_FIELDS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # ヘッダーのみの場合
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        raise ValueError(f"不正な形式です: {fmt}")
+
+
+def iter_import_rows(lines: Iterable[str], fmt: str = 'jsonl') -> Iterator[Tuple[int, object]]:
+    """
+    インポートデータを1行ずつ読み込む
+
+    Args:
+        lines: 改行付きの文字列の列（ファイルオブジェクト等）
+        fmt: 'jsonl' または 'csv'（CSVは先頭行をヘッダーとして扱う）
+
+    Returns:
+        (行番号, 行の辞書) を返すイテレーター。解析できない行は辞書の代わりに
+        エラーメッセージの文字列を返す。
+    """
+    if fmt == 'jsonl':
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, f"JSONとして解析できません: {e}"
+                continue
+            yield line_number, row
+    elif fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # 行番号はヘッダー行を1行目とした、その行の終わりの行
+            yield reader.line_num, row
+    else:
+        raise ValueError(f"不正な形式です: {fmt}")
+
+
+def validate_row(row, default_strength: float = 1.0) -> Dict:
+    """
+    インポートする1行を検証してマッピングに変換
+
+    Args:
+        row: 行の辞書
+        default_strength: strength が空の場合の値
+
+    Returns:
+        trigger_word, lora_file, strength, description（と priority）を持つマッピング
+
+    Raises:
+        ValueError: 不正な行の場合
+    """
+    if not isinstance(row, dict):
+        raise ValueError("行はオブジェクトである必要があります")
+
+    trigger_word = row.get('trigger_word')
+    if not isinstance(trigger_word, str) or not trigger_word.strip():
+        raise ValueError("trigger_word がありません")
+    lora_file = row.get('lora_file')
+    if not isinstance(lora_file, str) or not lora_file.strip():
+        raise ValueError("lora_file がありません")
+
+    strength = row.get('strength')
+    if strength is None or strength == '':
+        strength = default_strength
+    try:
+        strength = float(strength)
+    except (TypeError, ValueError):
+        raise ValueError(f"strength が数値ではありません: {row.get('strength')!r}")
+    if not math.isfinite(strength):
+        raise ValueError(f"strength が不正です: {row.get('strength')!r}")
+
+    description = row.get('description') or ''
+    if not isinstance(description, str):
+        raise ValueError("description は文字列である必要があります")
+
+    mapping = {
+        "trigger_word": trigger_word.strip(),
+        "lora_file": lora_file.strip(),
+        "strength": strength,
+        "description": description
+    }
+
+    priority = row.get('priority')
+    if priority is not None and priority != '':
+        try:
+            mapping['priority'] = int(priority)
+        except (TypeError, ValueError):
+            raise ValueError(f"priority が整数ではありません: {priority!r}")
+    return mapping
+
+
+def import_mappings(lora_manager, lines: Iterable[str], fmt: str = 'jsonl',
+                    mode: str = 'add', partial: bool = False, dry_run: bool = False) -> Dict:
+    """
+    JSONL / CSV のマッピングを検証して一括登録する
+
+    全ての行を検証した後、LoraManager.batch() の中で登録するため
+    設定ファイルへの書き込みは1回だけになる。
+
+    Args:
+        lora_manager: LoraManager
+        lines: 改行付きの文字列の列（ファイルオブジェクト等）
+        fmt: 'jsonl' または 'csv'
+        mode: 'add'（登録済みのトリガーワードはエラー）または 'upsert'（更新）
+        partial: Trueの場合はエラーのない行だけを登録。Falseの場合は
+            1行でもエラーがあれば何も登録しない
+        dry_run: Trueの場合は検証のみ行う
+
+    Returns:
+        rows, added, updated, error_count, errors（行番号とメッセージ）, committed を持つ辞書
+    """
+    if mode not in ('add', 'upsert'):
+        raise ValueError(f"不正なモードです: {mode}")
+
+    settings = lora_manager.get_settings()
+    default_strength = settings.get('default_strength', 1.0)
+    # ファイル内の重複は登録時と同じキー（case_sensitive に従う）で判定する
+    case_sensitive = settings.get('case_sensitive', False)
+    errors: List[Dict] = []
+    error_count = 0
+    rows: List[Tuple[int, Dict]] = []
+    seen = {}
+
+    def report(line_number: int, message: str):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'line': line_number, 'error': message})
+
+    total = 0
+    for line_number, row in iter_import_rows(lines, fmt):
+        total += 1
+        if isinstance(row, str):
+            report(line_number, row)
+            continue
+        try:
+            mapping = validate_row(row, default_strength)
+        except ValueError as e:
+            report(line_number, str(e))
+            continue
+        key = normalize_trigger(mapping['trigger_word'], case_sensitive)
+        if key in seen:
+            report(line_number, f"トリガーワード '{mapping['trigger_word']}' が{seen[key]}行目と重複しています")
+            continue
+        seen[key] = line_number
+        if mode == 'add' and lora_manager.get_lora_mapping(mapping['trigger_word']) is not None:
+            report(line_number, f"トリガーワード '{mapping['trigger_word']}' は既に登録されています")
+            continue
+        rows.append((line_number, mapping))
+
+    result = {
+        'rows': total,
+        'added': 0,
+        'updated': 0,
+        'error_count': error_count,
+        'errors': errors,
+        'committed': False
+    }
+    if dry_run or not rows or (error_count and not partial):
+        return result
+
+    added = 0
+    updated = 0
+    try:
+        with lora_manager.batch():
+            for line_number, mapping in rows:
+                trigger_word = mapping.pop('trigger_word')
+                if lora_manager.get_lora_mapping(trigger_word) is not None:
+                    if mode == 'upsert' and lora_manager.update_lora_mapping(trigger_word, **mapping):
+                        updated += 1
+                        continue
+                elif lora_manager.add_lora_mapping(trigger_word, mapping['lora_file'],
+                                                   mapping['strength'], mapping['description'],
+                                                   mapping.get('priority')):
+                    added += 1
+                    continue
+                # 検証後に他のユーザーが同じトリガーワードを登録・削除した場合
+                report(line_number, f"トリガーワード '{trigger_word}' を登録できませんでした（他の変更と競合）")
+                if not partial:
+                    raise _ImportConflict()
+    except _ImportConflict:
+        # batch() により変更は破棄され、何も保存されない
+        result.update(error_count=error_count)
+        return result
+
+    result.update(added=added, updated=updated, error_count=error_count, committed=True)
+    return result
@@ -0,0 +1,169 @@
+"""
+Loraマッピング一覧の検索・並べ替え・ページ分割
+
+WebUIの一覧表示用に、設定バージョンごとの索引（小文字化した各項目、
+項目ごとの並び順、前方一致用のソート済みキー）を作成し、
+1ページ分の行だけを取り出す。並び順と前方一致用のキーは
+初めて使われた時点で作成する。
+"""
+
+import bisect
+import threading
+from typing import Dict, List, Optional, Sequence
+
+# 並べ替えに使える項目（position は設定ファイル上の順序）
+SORT_FIELDS = ('position', 'trigger_word', 'lora_file', 'strength', 'description')
+
+# 絞り込みに使える項目
+FILTER_FIELDS = ('trigger_word', 'lora_file', 'description')
+
+# 1ページの件数のデフォルト値と上限
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class MappingQueryIndex:
+    """1つの設定バージョンのマッピングに対する検索用の索引"""
+
+    def __init__(self, mappings: Sequence[Dict], version: int):
+        """
+        Args:
+            mappings: 設定ファイル上の順序に並んだマッピング
+            version: 設定バージョン
+        """
+        self.mappings = mappings
+        self.version = version
+        self._values = {
+            field: [str(mapping.get(field) or '').lower() for mapping in mappings]
+            for field in FILTER_FIELDS
+        }
+        self._orders: Dict[str, List[int]] = {}
+        self._prefix_keys: Dict[str, List] = {}
+        self._lock = threading.Lock()
+
+    def _order(self, field: str) -> List[int]:
+        """項目の昇順に並べたマッピング番号（同じ値は設定ファイル上の順序）"""
+        order = self._orders.get(field)
+        if order is None:
+            if field == 'position':
+                order = list(range(len(self.mappings)))
+            elif field == 'strength':
+                order = sorted(range(len(self.mappings)),
+                               key=lambda i: _as_float(self.mappings[i].get('strength')))
+            else:
+                values = self._values[field]
+                order = sorted(range(len(self.mappings)), key=values.__getitem__)
+            self._orders[field] = order
+        return order
+
+    def _prefix_matches(self, field: str, prefix: str) -> set:
+        """項目が prefix で始まるマッピング番号（ソート済みキーを二分探索）"""
+        with self._lock:
+            keys = self._prefix_keys.get(field)
+            if keys is None:
+                keys = sorted((value, i) for i, value in enumerate(self._values[field]))
+                self._prefix_keys[field] = keys
+        start = bisect.bisect_left(keys, (prefix, -1))
+        matches = set()
+        for value, i in keys[start:]:
+            if not value.startswith(prefix):
+                break
+            matches.add(i)
+        return matches
+
+    def query(self, q: str = '', prefix: str = '', field: str = 'all',
+              sort: str = 'position', order: str = 'asc',
+              offset: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> Dict:
+        """
+        条件に合うマッピングを1ページ分取得
+
+        Args:
+            q: 部分一致で絞り込む文字列（大文字小文字を区別しない）
+            prefix: 前方一致で絞り込む文字列（大文字小文字を区別しない）
+            field: 絞り込む項目（FILTER_FIELDS のいずれか、または 'all'）
+            sort: 並べ替える項目（SORT_FIELDS のいずれか）
+            order: 'asc' または 'desc'
+            offset: 先頭から読み飛ばす件数
+            limit: 取得する件数
+
+        Returns:
+            total（条件に合う件数）と items（マッピングのリスト）を持つ辞書
+
+        Raises:
+            ValueError: 不正なパラメータが指定された場合
+        """
+        if field != 'all' and field not in FILTER_FIELDS:
+            raise ValueError(f"不正な絞り込み項目です: {field}")
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"不正な並べ替え項目です: {sort}")
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"不正な並び順です: {order}")
+        if offset < 0 or limit < 0:
+            raise ValueError("offset と limit は0以上で指定してください")
+
+        fields = FILTER_FIELDS if field == 'all' else (field,)
+        q = q.lower()
+        prefix = prefix.lower()
+
+        candidates: Optional[set] = None
+        if prefix:
+            candidates = set()
+            for name in fields:
+                candidates |= self._prefix_matches(name, prefix)
+        if q:
+            pool = candidates if candidates is not None else range(len(self.mappings))
+            candidates = {i for i in pool
+                          if any(q in self._values[name][i] for name in fields)}
+
+        with self._lock:
+            ordered = self._order(sort)
+        if order == 'desc':
+            ordered = ordered[::-1]
+
+        if candidates is None:
+            total = len(ordered)
+            page = ordered[offset:offset + limit]
+        else:
+            matched = [i for i in ordered if i in candidates]
+            total = len(matched)
+            page = matched[offset:offset + limit]
+
+        return {'total': total, 'items': [self.mappings[i] for i in page]}
+
+
+def _as_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class MappingQueryCache:
+    """最新の設定バージョンの MappingQueryIndex を保持する（複数スレッドで共有）"""
+
+    def __init__(self):
+        self._index: Optional[MappingQueryIndex] = None
+        self._lock = threading.Lock()
+
+    def get(self, snapshot) -> MappingQueryIndex:
+        """
+        スナップショットに対応する索引を取得（バージョンが変わった場合のみ作成）
+
+        Args:
+            snapshot: LoraManager.snapshot() の戻り値
+
+        Returns:
+            MappingQueryIndex
+        """
+        index = self._index
+        if index is not None and index.version == snapshot.version:
+            return index
+        with self._lock:
+            index = self._index
+            if index is not None and index.version == snapshot.version:
+                return index
+            new_index = MappingQueryIndex(snapshot.mapping_list, snapshot.version)
+            # 古いスナップショットを参照したリクエストで最新の索引を置き換えない
+            if index is None or snapshot.version > index.version:
+                self._index = new_index
+            return new_index
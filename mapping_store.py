@@ -0,0 +1,346 @@
+"""
+Loraマッピングの保存先（ストレージバックエンド）
+
+- JsonMappingStore: 従来どおり1つのJSONファイルに全設定を保存（デフォルト）
+- SQLiteMappingStore: ローカルのSQLiteデータベースに保存。追加・削除・更新は
+  該当する行のみを書き込む
+
+LoraManager も変更したトリガーワードの分だけ索引（マッチャー）を置き換えるため、
+SQLiteでは1件の変更にかかる時間がマッピング数によらない。
+
+どちらも LoraManager から同じメソッドで利用する。
+JSONからSQLiteへの移行はコマンドラインから実行できる:
+
+    python mapping_store.py migrate config/lora_mapping.json config/lora_mapping.db
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# SQLiteで保存する拡張子
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+# 専用の列を持つマッピングの項目（それ以外は extra 列にJSONで保存）
+_MAPPING_COLUMNS = ('trigger_word', 'lora_file', 'strength', 'description')
+
+
+def write_json_atomic(path: str, data, indent: Optional[int] = 2):
+    """
+    JSONファイルをアトミックに書き込む
+
+    同じディレクトリの一時ファイルに書き込んでfsyncした後、renameで置き換えるため、
+    書き込み途中でプロセスが終了しても元のファイルが壊れることはなく、
+    他のプロセスからは常に完全なファイルが見える。
+
+    Args:
+        path: 書き込み先のパス
+        data: JSONに変換するデータ
+        indent: インデント幅
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(
+        dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+    # rename自体を永続化するためディレクトリもfsync（対応していない環境では無視）
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
+class JsonMappingStore:
+    """1つのJSONファイルに全設定を保存するストア"""
+
+    # 行単位の書き込みに対応していない（変更時は全体を書き直す）
+    supports_incremental = False
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def exists(self) -> bool:
+        """保存済みの設定があるか"""
+        return os.path.exists(self.path)
+
+    def change_token(self) -> Optional[Tuple[int, int]]:
+        """外部からの変更を検出するための値（ファイルの (mtime, size)）"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def load(self) -> Dict:
+        """
+        全設定を読み込む
+
+        Returns:
+            lora_mappings と settings を持つ辞書
+        """
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, config: Dict):
+        """全設定をアトミックに書き込む"""
+        write_json_atomic(self.path, config)
+
+
+class SQLiteMappingStore:
+    """SQLiteデータベースにマッピングを保存するストア"""
+
+    supports_incremental = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = None
+        self._lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            # WALにより別プロセス（WebUI）の読み込みと書き込みが互いを妨げない
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS mappings (
+                    position INTEGER PRIMARY KEY AUTOINCREMENT,
+                    trigger_key TEXT NOT NULL UNIQUE,
+                    trigger_word TEXT NOT NULL,
+                    lora_file TEXT NOT NULL,
+                    strength REAL,
+                    description TEXT,
+                    extra TEXT
+                )
+            """)
+            # 以前は小文字化したトリガーワードをキーにしていた（case_sensitive で
+            # 大文字小文字だけが異なるトリガーワードを保存できるよう、そのままの値にする）
+            connection.execute("UPDATE mappings SET trigger_key = trigger_word WHERE trigger_key <> trigger_word")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def exists(self) -> bool:
+        """保存済みの設定があるか"""
+        if not os.path.exists(self.path):
+            return False
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT (SELECT COUNT(*) FROM settings) + (SELECT COUNT(*) FROM mappings)"
+            ).fetchone()
+            return row[0] > 0
+
+    def change_token(self) -> Optional[int]:
+        """
+        外部からの変更を検出するための値
+
+        PRAGMA data_version は他の接続（別プロセス）がコミットした場合のみ変化する。
+        """
+        if not os.path.exists(self.path):
+            return None
+        with self._lock:
+            return self._connect().execute("PRAGMA data_version").fetchone()[0]
+
+    @staticmethod
+    def _row_to_mapping(row) -> Dict:
+        trigger_word, lora_file, strength, description, extra = row
+        mapping = {
+            "trigger_word": trigger_word,
+            "lora_file": lora_file,
+            "strength": strength,
+            "description": description or ""
+        }
+        if extra:
+            mapping.update(json.loads(extra))
+        return mapping
+
+    @staticmethod
+    def _mapping_to_row(trigger_key: str, mapping: Dict) -> Tuple:
+        extra = {key: value for key, value in mapping.items() if key not in _MAPPING_COLUMNS}
+        return (
+            trigger_key,
+            mapping['trigger_word'],
+            mapping['lora_file'],
+            mapping.get('strength'),
+            mapping.get('description', ''),
+            json.dumps(extra, ensure_ascii=False) if extra else None
+        )
+
+    def load(self) -> Dict:
+        """
+        全設定を読み込む
+
+        Returns:
+            lora_mappings と settings を持つ辞書
+        """
+        with self._lock:
+            connection = self._connect()
+            mappings = [
+                self._row_to_mapping(row) for row in connection.execute(
+                    "SELECT trigger_word, lora_file, strength, description, extra "
+                    "FROM mappings ORDER BY position"
+                )
+            ]
+            settings = {
+                key: json.loads(value)
+                for key, value in connection.execute("SELECT key, value FROM settings")
+            }
+        return {"lora_mappings": mappings, "settings": settings}
+
+    def save(self, config: Dict) -> List[str]:
+        """
+        全設定を1トランザクションで書き直す
+
+        トリガーワードは行のキーのため、完全に同じトリガーワードの2件目以降は保存できない。
+
+        Returns:
+            保存できなかった（完全に同じトリガーワードが既にある）トリガーワードのリスト
+        """
+        with self._lock:
+            connection = self._connect()
+            skipped = []
+            with connection:
+                connection.execute("DELETE FROM mappings")
+                for mapping in config.get('lora_mappings', []):
+                    cursor = connection.execute(
+                        "INSERT OR IGNORE INTO mappings "
+                        "(trigger_key, trigger_word, lora_file, strength, description, extra) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        self._mapping_to_row(mapping['trigger_word'], mapping)
+                    )
+                    if cursor.rowcount == 0:
+                        skipped.append(mapping['trigger_word'])
+                self._replace_settings(connection, config.get('settings', {}))
+            return skipped
+
+    def apply_changes(self, operations: List[Tuple], mappings: Dict[str, Dict], settings: Dict):
+        """
+        変更のあった行のみを1トランザクションで書き込む
+
+        Args:
+            operations: ('upsert', トリガーワード) / ('delete', トリガーワード) / ('settings', 設定項目のタプル) の列
+            mappings: 現在の トリガーワード -> マッピング
+            settings: 現在の設定辞書
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                for operation in operations:
+                    if operation[0] == 'settings':
+                        self._replace_settings(connection, settings)
+                        continue
+                    trigger_key = operation[1]
+                    mapping = mappings.get(trigger_key)
+                    if operation[0] == 'delete' or mapping is None:
+                        connection.execute("DELETE FROM mappings WHERE trigger_key = ?", (trigger_key,))
+                    else:
+                        # 既存の行は位置（マッチの優先順）を保ったまま更新
+                        connection.execute(
+                            "INSERT INTO mappings "
+                            "(trigger_key, trigger_word, lora_file, strength, description, extra) "
+                            "VALUES (?, ?, ?, ?, ?, ?) "
+                            "ON CONFLICT(trigger_key) DO UPDATE SET "
+                            "trigger_word = excluded.trigger_word, lora_file = excluded.lora_file, "
+                            "strength = excluded.strength, description = excluded.description, "
+                            "extra = excluded.extra",
+                            self._mapping_to_row(trigger_key, mapping)
+                        )
+
+    @staticmethod
+    def _replace_settings(connection: sqlite3.Connection, settings: Dict):
+        connection.execute("DELETE FROM settings")
+        connection.executemany(
+            "INSERT INTO settings (key, value) VALUES (?, ?)",
+            [(key, json.dumps(value, ensure_ascii=False)) for key, value in settings.items()]
+        )
+
+    def close(self):
+        """データベース接続を閉じる"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def create_store(path: str):
+    """
+    パスの拡張子に応じたストアを作成
+
+    Args:
+        path: 設定ファイルのパス（.db / .sqlite / .sqlite3 の場合はSQLite）
+
+    Returns:
+        JsonMappingStore または SQLiteMappingStore
+    """
+    if path.lower().endswith(SQLITE_EXTENSIONS):
+        return SQLiteMappingStore(path)
+    return JsonMappingStore(path)
+
+
+def migrate_json_to_sqlite(json_path: str, db_path: str) -> int:
+    """
+    JSON設定ファイルの内容をSQLiteデータベースに移行
+
+    Args:
+        json_path: 移行元の lora_mapping.json
+        db_path: 移行先のデータベース
+
+    Returns:
+        移行したマッピングの件数
+    """
+    config = JsonMappingStore(json_path).load()
+    store = SQLiteMappingStore(db_path)
+    try:
+        skipped = store.save(config)
+        if skipped:
+            print(f"完全に同じトリガーワードの定義は移行できません（{len(skipped)}件）: {', '.join(skipped)}")
+        return len(store.load()['lora_mappings'])
+    finally:
+        store.close()
+
+
+def main():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Loraマッピングのストレージ管理')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate = subparsers.add_parser('migrate', help='JSON設定ファイルをSQLiteに移行')
+    migrate.add_argument('json_path', nargs='?',
+                         default=os.path.join(current_dir, 'config', 'lora_mapping.json'))
+    migrate.add_argument('db_path', nargs='?',
+                         default=os.path.join(current_dir, 'config', 'lora_mapping.db'))
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        count = migrate_json_to_sqlite(args.json_path, args.db_path)
+        print(f"{count}件のマッピングを移行しました: {args.json_path} -> {args.db_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+LoRAファイルのメタデータからトリガーワードを収集するスキャナー
+
+LoRAディレクトリ内の全safetensorsファイルについて、スレッドプールで
+ヘッダー（__metadata__）のみを読み込み、modelspec.trigger_phrase や
+ss_output_name などから トリガーワード -> LoRAファイル のマッピング候補を作成する。
+学習時のタグ（ss_tag_frequency）から推定した候補は確認してから登録する。
+結果はファイルのmtime・サイズをキーにキャッシュし、再スキャン時は
+新規・更新されたファイルのみを読み込む。
+"""
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+try:
+    from .lora_file_index import LoraFileIndex, get_lora_directories
+    from .lora_manager import LoraManager
+    from .mapping_store import write_json_atomic
+    from .safetensors_utils import read_safetensors_metadata
+except ImportError:
+    from lora_file_index import LoraFileIndex, get_lora_directories
+    from lora_manager import LoraManager
+    from mapping_store import write_json_atomic
+    from safetensors_utils import read_safetensors_metadata
+
+# ヘッダー読み込みに使うスレッド数のデフォルト値
+DEFAULT_MAX_WORKERS = 8
+
+# メタデータキャッシュの形式（抽出方法を変えた場合は上げて読み直す）
+CACHE_VERSION = 2
+
+# 多くのLoRAの学習データに付いているため、トリガーワードにはならない汎用タグ
+COMMON_TAGS = frozenset({
+    '1girl', '1boy', '1other', '2girls', '2boys', 'multiple girls', 'multiple boys', 'solo',
+    'solo focus', 'male focus', 'no humans', 'looking at viewer', 'smile', 'blush',
+    'open mouth', 'closed mouth', 'closed eyes', 'parted lips', 'teeth', 'grin',
+    'simple background', 'white background', 'grey background', 'black background',
+    'upper body', 'full body', 'cowboy shot', 'portrait', 'close-up', 'standing', 'sitting',
+    'long hair', 'short hair', 'medium hair', 'bangs', 'black hair', 'brown hair',
+    'blonde hair', 'white hair', 'blue eyes', 'brown eyes', 'red eyes', 'green eyes',
+    'breasts', 'hair ornament', 'jewelry', 'shirt', 'dress', 'skirt', 'jacket',
+    'long sleeves', 'holding', 'outdoors', 'indoors', 'day', 'night', 'sky', 'cloud',
+    'monochrome', 'greyscale', 'realistic', 'photorealistic', 'anime coloring',
+    'masterpiece', 'best quality', 'high quality', 'absurdres', 'highres', 'lowres',
+})
+
+
+def default_cache_path() -> str:
+    """メタデータキャッシュファイルのパスを返す"""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(current_dir, "config", "metadata_cache.json")
+
+
+def _normalize_tag(tag: str) -> str:
+    """タグの表記揺れ（大文字小文字・アンダースコア区切り）を揃える"""
+    return tag.strip().replace('_', ' ').lower()
+
+
+def extract_tag_candidates(metadata: Dict[str, str]) -> List[str]:
+    """
+    学習時のタグからトリガーワード候補を推定
+
+    全ての学習画像に付いているタグのうち、汎用タグ（COMMON_TAGS）以外を候補とする。
+    データセットごとの画像数（ss_dataset_dirs の img_count）が分からない場合は
+    全画像に付いているか判定できないため候補なしとする。
+
+    Args:
+        metadata: safetensorsの __metadata__
+
+    Returns:
+        候補のリスト（付いている回数の多い順）
+    """
+    try:
+        datasets = json.loads(metadata.get('ss_tag_frequency') or '{}')
+        dataset_dirs = json.loads(metadata.get('ss_dataset_dirs') or '{}')
+        image_counts = {name: int(dataset_dirs[name]['img_count']) for name in datasets}
+    except (ValueError, KeyError, AttributeError, TypeError):
+        return []
+    if not datasets or any(count <= 0 for count in image_counts.values()):
+        return []
+
+    common = None
+    totals = {}
+    for name, tags in datasets.items():
+        in_every_image = set()
+        for tag, count in tags.items():
+            if not tag.strip():
+                continue
+            totals[tag.strip()] = totals.get(tag.strip(), 0) + count
+            if count >= image_counts[name]:
+                in_every_image.add(tag.strip())
+        common = in_every_image if common is None else common & in_every_image
+
+    candidates = [tag for tag in common if _normalize_tag(tag) not in COMMON_TAGS]
+    return sorted(candidates, key=lambda tag: (-totals[tag], tag))
+
+
+def extract_trigger_info(metadata: Dict[str, str]) -> Dict:
+    """
+    メタデータからトリガーワード候補を抽出
+
+    modelspec.trigger_phrase、ss_output_name の順に候補とする。
+    学習時のタグから推定した候補は確度が低いため tag_candidates として分けて返す。
+
+    Args:
+        metadata: safetensorsの __metadata__
+
+    Returns:
+        trigger_words（候補リスト）, tag_candidates, output_name を持つ辞書
+    """
+    candidates = []
+
+    trigger_phrase = metadata.get('modelspec.trigger_phrase', '')
+    for phrase in trigger_phrase.split(','):
+        if phrase.strip():
+            candidates.append(phrase.strip())
+
+    output_name = metadata.get('ss_output_name', '')
+    if output_name:
+        candidates.append(output_name)
+
+    # 順序を保ったまま重複を除く
+    trigger_words = list(dict.fromkeys(candidates))
+    tag_candidates = [tag for tag in extract_tag_candidates(metadata) if tag not in trigger_words]
+    return {'trigger_words': trigger_words, 'tag_candidates': tag_candidates, 'output_name': output_name}
+
+
+class MetadataScanner:
+    """LoRAファイルのヘッダーを並列に読み込むスキャナー"""
+
+    def __init__(self, directories: List[str], cache_path: str = None,
+                 max_workers: int = DEFAULT_MAX_WORKERS):
+        """
+        Args:
+            directories: LoRAディレクトリのリスト
+            cache_path: メタデータキャッシュファイルのパス
+            max_workers: ヘッダー読み込みに使うスレッド数
+        """
+        self.file_index = LoraFileIndex(lambda: directories, refresh_interval=0)
+        self.cache_path = cache_path or default_cache_path()
+        self.max_workers = max_workers
+
+    def _load_cache(self) -> Dict:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, cache: Dict):
+        try:
+            write_json_atomic(self.cache_path, cache, indent=None)
+        except OSError as e:
+            print(f"[AutoLoRA] メタデータキャッシュの保存エラー: {e}")
+
+    @staticmethod
+    def _read_entry(full_path: str, stat) -> Dict:
+        try:
+            info = extract_trigger_info(read_safetensors_metadata(full_path))
+        except (OSError, ValueError) as e:
+            info = {'trigger_words': [], 'tag_candidates': [], 'output_name': '', 'error': str(e)}
+        return {'version': CACHE_VERSION, 'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'info': info}
+
+    def scan(self) -> List[Dict]:
+        """
+        全safetensorsファイルのトリガーワード候補を取得
+
+        Returns:
+            lora_file（相対パス）, path, trigger_words, tag_candidates, output_name を持つ辞書のリスト
+        """
+        cache = self._load_cache()
+        new_cache = {}
+        pending = []
+
+        files = [(relpath, full_path) for relpath, full_path in self.file_index.iter_files()
+                 if full_path.lower().endswith('.safetensors')]
+        for relpath, full_path in files:
+            try:
+                stat = os.stat(full_path)
+            except OSError:
+                continue
+            entry = cache.get(full_path)
+            if (entry and entry.get('version') == CACHE_VERSION
+                    and entry.get('mtime') == stat.st_mtime_ns and entry.get('size') == stat.st_size):
+                new_cache[full_path] = entry
+            else:
+                pending.append((full_path, stat))
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                entries = executor.map(lambda item: self._read_entry(*item), pending)
+                for (full_path, _), entry in zip(pending, entries):
+                    new_cache[full_path] = entry
+
+        if pending or len(new_cache) != len(cache):
+            self._save_cache(new_cache)
+
+        results = []
+        for relpath, full_path in files:
+            entry = new_cache.get(full_path)
+            if entry is None:
+                continue
+            results.append(dict(entry['info'], lora_file=relpath, path=full_path))
+        return results
+
+
+def propose_mappings(lora_manager: LoraManager, scan_results: List[Dict]) -> List[Dict]:
+    """
+    スキャン結果から未登録のマッピング候補を作成
+
+    既にマッピングのあるLoRAファイルや、登録済みのトリガーワードは除外する。
+    メタデータに候補がない場合のみタグから推定した候補を使い、source を 'tags' とする
+    （それ以外は 'metadata'）。
+
+    Args:
+        lora_manager: LoraManager
+        scan_results: MetadataScanner.scan() の結果
+
+    Returns:
+        マッピングに source を加えた辞書のリスト
+    """
+    mappings = lora_manager.list_all_mappings()
+    used_triggers = {mapping['trigger_word'].lower() for mapping in mappings}
+    mapped_files = {mapping['lora_file'] for mapping in mappings}
+    default_strength = lora_manager.get_settings().get('default_strength', 1.0)
+
+    proposals = []
+    for result in scan_results:
+        lora_file = result['lora_file']
+        if lora_file in mapped_files or os.path.basename(lora_file) in mapped_files:
+            continue
+        source = 'metadata'
+        trigger_word = next((word for word in result['trigger_words']
+                             if word.lower() not in used_triggers), None)
+        if trigger_word is None and not result['trigger_words']:
+            source = 'tags'
+            trigger_word = next((word for word in result.get('tag_candidates', [])
+                                 if word.lower() not in used_triggers), None)
+        if trigger_word is None:
+            continue
+        used_triggers.add(trigger_word.lower())
+        proposals.append({
+            "trigger_word": trigger_word,
+            "lora_file": lora_file,
+            "strength": default_strength,
+            "description": f"自動登録: {result['output_name'] or os.path.basename(lora_file)}",
+            "source": source
+        })
+    return proposals
+
+
+def scan_and_propose(lora_manager: LoraManager, directories: Optional[List[str]] = None,
+                     import_mappings: bool = False, max_workers: int = DEFAULT_MAX_WORKERS,
+                     include_tags: bool = False) -> Dict:
+    """
+    LoRAディレクトリをスキャンし、マッピング候補の作成（と一括登録）を行う
+
+    Args:
+        lora_manager: LoraManager
+        directories: LoRAディレクトリ（Noneの場合は get_lora_directories）
+        import_mappings: Trueの場合は候補を一括登録（設定ファイルの保存は1回）
+        max_workers: ヘッダー読み込みに使うスレッド数
+        include_tags: Trueの場合はタグから推定した候補も登録する（確認済みの場合のみ指定する）
+
+    Returns:
+        scanned, proposals, added を持つ辞書
+    """
+    if directories is None:
+        directories = get_lora_directories(lora_manager.get_settings())
+    scanner = MetadataScanner(directories, max_workers=max_workers)
+    results = scanner.scan()
+    proposals = propose_mappings(lora_manager, results)
+
+    added = 0
+    if import_mappings:
+        mappings = [
+            {key: value for key, value in proposal.items() if key != 'source'}
+            for proposal in proposals if include_tags or proposal['source'] != 'tags'
+        ]
+        if mappings:
+            added, _ = lora_manager.add_lora_mappings(mappings)
+
+    return {'scanned': len(results), 'proposals': proposals, 'added': added}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LoRAファイルのメタデータからトリガーワードを収集')
+    parser.add_argument('directories', nargs='*', help='LoRAディレクトリ（省略時は settings.lora_directories）')
+    parser.add_argument('--import', dest='import_mappings', action='store_true',
+                        help='候補を設定ファイルに一括登録する')
+    parser.add_argument('--include-tags', action='store_true',
+                        help='学習時のタグから推定した候補も登録する（内容を確認してから指定）')
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS, help='スレッド数')
+    args = parser.parse_args()
+
+    lora_manager = LoraManager.get_shared()
+    result = scan_and_propose(lora_manager, args.directories or None,
+                              args.import_mappings, args.workers, args.include_tags)
+
+    for proposal in result['proposals']:
+        note = "（タグから推定）" if proposal['source'] == 'tags' else ""
+        print(f"'{proposal['trigger_word']}' -> {proposal['lora_file']}{note}")
+    print(f"スキャン: {result['scanned']}件, 候補: {len(result['proposals'])}件, 登録: {result['added']}件")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+処理段階ごとの計測（Prometheusのテキスト形式で出力）
+
+カウンターとヒストグラムをプロセス内のレジストリに登録し、render() で
+Prometheusのテキスト形式（text/plain; version=0.0.4）に変換する。
+キャッシュの件数など、値を別のオブジェクトが持っているものは
+register_collector() で出力時に読み取る。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Prometheusのテキスト形式のContent-Type
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 処理時間（秒）のヒストグラムの区切り
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """ラベルごとの値を持つ計測項目の共通部分"""
+
+    type_name = ''
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} のラベルは {self.labelnames} です: {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        """全ての値を破棄"""
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """増加のみするカウンター"""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        if not self.labelnames:
+            # ラベルのないカウンターは最初から0として出力
+            self._values[()] = 0
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        値を増やす
+
+        Args:
+            amount: 増やす量（0以上）
+            **labels: ラベルの値
+        """
+        if amount < 0:
+            raise ValueError("カウンターは減らせません")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """現在の値"""
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def _render_samples(self, items) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    """値の分布（処理時間等）を区切りごとの件数で記録"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        """
+        値を1件記録
+
+        Args:
+            value: 記録する値
+            **labels: ラベルの値
+        """
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [区切りごとの件数..., 合計, 件数]
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with ブロックの処理時間（秒）を記録"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_samples(self, items) -> List[str]:
+        lines = []
+        for key, entry in items:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(entry[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {entry[-1]}")
+        return lines
+
+
+# 出力時に値を読み取る関数の戻り値:
+# (名前, 種類, 説明, [(ラベルの辞書, 値), ...]) の列
+CollectorResult = Iterable[Tuple[str, str, str, Iterable[Tuple[Dict[str, str], float]]]]
+
+
+class MetricsRegistry:
+    """プロセス内の計測項目の一覧"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Callable[[], CollectorResult]] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # モジュールの再読み込み等で同じ項目を登録する場合は既存のものを使う
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"{metric.name} は別の種類で登録済みです")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        """カウンターを登録"""
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """ヒストグラムを登録"""
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def register_collector(self, key: str, collector: Callable[[], CollectorResult]):
+        """
+        出力時に値を読み取る関数を登録（同じ key の関数は置き換える）
+
+        Args:
+            key: 登録を識別する名前
+            collector: (名前, 種類, 説明, [(ラベルの辞書, 値), ...]) の列を返す関数
+        """
+        with self._lock:
+            self._collectors[key] = collector
+
+    def unregister_collector(self, key: str):
+        """register_collector で登録した関数を削除"""
+        with self._lock:
+            self._collectors.pop(key, None)
+
+    def render(self) -> str:
+        """
+        全ての計測項目をPrometheusのテキスト形式に変換
+
+        Returns:
+            テキスト形式の文字列
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.items())
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for key, collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"[AutoLoRA] 計測値の取得でエラーが発生しました ({key}): {e}")
+                continue
+            for name, type_name, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+# プロセス全体で共有するレジストリ
+registry = MetricsRegistry()
+
+# Auto LoRA ノードの処理段階ごとの時間
+# stage: match（トリガーワード検出）/ find_file（ファイル検索）/ bundle（バンドルの検索・作成）
+#        / load（ディスクからの読み込み）/ apply（モデルへの適用）/ total（ノード全体）
+stage_seconds = registry.histogram(
+    'autolora_stage_seconds', 'Auto LoRA処理段階ごとの時間（秒）', ('stage',)
+)
+
+# プロンプトごとのトリガーワード検出結果（result: matched / unmatched）
+prompts_total = registry.counter(
+    'autolora_prompts_total', 'トリガーワードを照合したプロンプト数', ('result',)
+)
+
+# 適用したLoRAの数
+loras_applied_total = registry.counter('autolora_loras_applied_total', '適用したLoRAの数')
+
+# マッピングに登録されているがファイルが見つからなかったLoRAの数
+missing_files_total = registry.counter(
+    'autolora_missing_files_total', 'LoRAファイルが見つからなかった回数'
+)
+
+# ディスクから読み込んだLoRAのテンソルの合計バイト数（キャッシュヒットは含まない）
+bytes_loaded_total = registry.counter(
+    'autolora_lora_bytes_loaded_total', 'ディスクから読み込んだLoRAのバイト数'
+)
+
+
+# 複数LoRAの組み合わせごとのバンドルの検索結果（result: hit / miss / building / failed）
+bundle_lookups_total = registry.counter(
+    'autolora_bundle_lookups_total', 'LoRAバンドルの検索結果', ('result',)
+)
+
+
+class StageTimer:
+    """
+    1回のノード実行の段階ごとの時間を記録
+
+    stage_seconds に記録すると同時に、lora_info に付ける要約用に
+    段階ごとの合計時間を保持する。tracer を指定した場合は各段階を
+    トレースのスパンとしても書き込む。
+    """
+
+    def __init__(self, histogram: Histogram = stage_seconds, tracer=None):
+        """
+        Args:
+            histogram: 記録先のヒストグラム
+            tracer: スパンを書き込む tracing.TraceWriter（省略時はトレースしない）
+        """
+        self.histogram = histogram
+        self.tracer = tracer
+        self.durations: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str, **args):
+        """
+        with ブロックの処理時間を段階 name として記録
+
+        Args:
+            name: 段階の名前
+            **args: スパンの引数（with ブロック内で返される辞書に追加もできる）
+
+        Returns:
+            スパンの引数の辞書
+        """
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            elapsed = time.perf_counter() - start
+            self.histogram.observe(elapsed, stage=name)
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+            if self.tracer is not None:
+                self.tracer.complete(name, start, elapsed, args)
+
+    def mark(self, name: str, **args):
+        """時間を持たない出来事（キャッシュヒット等）をトレースに記録"""
+        if self.tracer is not None:
+            self.tracer.instant(name, args)
+
+    def summary(self) -> str:
+        """
+        lora_info に付ける1行の要約
+
+        Returns:
+            例: "計測: match 0.05ms / find_file 0.02ms / load 152.3ms / apply 20.1ms"
+        """
+        if not self.durations:
+            return "計測: -"
+        return "計測: " + " / ".join(
+            f"{name} {seconds * 1000:.2f}ms" for name, seconds in self.durations.items()
+        )
+
+
+def cache_stats_collector(name: str, help_prefix: str, stats_fn: Callable[[], Dict],
+                          counters: Sequence[str] = ('hits', 'misses'),
+                          gauges: Sequence[str] = ('entries',)) -> Callable[[], CollectorResult]:
+    """
+    キャッシュの stats() を計測値として出力する関数を作成
+
+    Args:
+        name: 計測項目名の接頭辞（例: autolora_lora_cache）
+        help_prefix: 説明の接頭辞
+        stats_fn: 統計の辞書を返す関数
+        counters: カウンターとして出力する項目（{name}_{項目}_total）
+        gauges: 現在値として出力する項目（{name}_{項目}）
+
+    Returns:
+        register_collector に渡す関数
+    """
+    def collect():
+        stats = stats_fn()
+        for key in counters:
+            if key in stats:
+                yield f"{name}_{key}_total", 'counter', f"{help_prefix} {key}", [({}, stats[key])]
+        for key in gauges:
+            if key in stats:
+                yield f"{name}_{key}", 'gauge', f"{help_prefix} {key}", [({}, stats[key])]
+
+    return collect
+
+
+def render() -> str:
+    """共有レジストリの全ての計測項目をPrometheusのテキスト形式で返す"""
+    return registry.render()
@@ -3,9 +3,71 @@ ComfyUI Auto LoRA カスタムノード実装
 """
 
 import torch
+import hashlib
 import os
 import folder_paths
 from .lora_manager import LoraManager
+from .lora_cache import (
+    CACHE_DTYPES,
+    DEFAULT_CACHE_SIZE_MB,
+    DEFAULT_PATCHED_CACHE_SIZE,
+    install_free_memory_hook,
+    lora_state_cache,
+    patched_model_cache,
+    state_dict_nbytes,
+)
+from .lora_file_index import LoraFileIndex
+from .lora_bundle import get_bundle_store
+from .safetensors_utils import load_safetensors_filtered, lora_key_filter
+from .metadata_scanner import scan_and_propose
+from .tracing import get_tracer
+from .metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    StageTimer,
+    bundle_lookups_total,
+    bytes_loaded_total,
+    cache_stats_collector,
+    loras_applied_total,
+    missing_files_total,
+    prompts_total,
+    registry as metrics_registry,
+)
+
+# ComfyUIのLoRAディレクトリの索引（全ノードで共有）
+lora_file_index = LoraFileIndex(lambda: folder_paths.get_folder_paths("loras"))
+
+try:
+    import comfy.model_management
+    install_free_memory_hook(comfy.model_management)
+except ImportError:
+    pass
+
+# キャッシュの統計を計測値として出力
+metrics_registry.register_collector('lora_cache', cache_stats_collector(
+    'autolora_lora_cache', 'LoRAキャッシュ', lora_state_cache.stats,
+    counters=('hits', 'misses', 'evictions'), gauges=('entries', 'bytes', 'max_bytes', 'saved_bytes')
+))
+metrics_registry.register_collector('patched_model_cache', cache_stats_collector(
+    'autolora_patched_model_cache', '適用済みモデルキャッシュ', patched_model_cache.stats,
+    gauges=('entries', 'max_entries')
+))
+metrics_registry.register_collector('match_cache', cache_stats_collector(
+    'autolora_match_cache', 'プロンプト検出キャッシュ',
+    lambda: LoraManager.get_shared().get_match_cache_stats(),
+    gauges=('entries', 'max_entries')
+))
+
+try:
+    # ComfyUIのサーバーで計測値を公開（GET /autolora/metrics）
+    from aiohttp import web
+    from server import PromptServer
+    
+    @PromptServer.instance.routes.get('/autolora/metrics')
+    async def autolora_metrics(request):
+        return web.Response(body=metrics_registry.render().encode('utf-8'),
+                            headers={'Content-Type': METRICS_CONTENT_TYPE})
+except (ImportError, AttributeError):
+    pass
 
 class AutoLoRANode:
     """
@@ -32,6 +94,7 @@ class AutoLoRANode:
                     "step": 0.01,
                     "display": "slider"
                 }),
+                "multi_lora": ("BOOLEAN", {"default": False}),
             }
         }
     
@@ -42,9 +105,40 @@ class AutoLoRANode:
     DESCRIPTION = "テキストからトリガーワードを検出し、対応するLoRAを自動適用"
     
     def __init__(self):
-        self.lora_manager = LoraManager()
+        self.lora_manager = LoraManager.get_shared()
     
-    def apply_auto_lora(self, model, clip, text, enable_auto_lora=True, manual_strength=-1.0):
+    @classmethod
+    def IS_CHANGED(cls, text="", enable_auto_lora=True, manual_strength=-1.0, multi_lora=False, **kwargs):
+        """
+        ComfyUIの実行キャッシュ用のフィンガープリント
+        
+        適用されるLoRAファイル・強度・ファイルのmtime・設定バージョンから作るため、
+        同じLoRAの組み合わせになる限り同じ値を返し、設定ファイルやLoRAファイルが
+        更新された場合は異なる値を返す。
+        
+        Returns:
+            フィンガープリント文字列
+        """
+        if not enable_auto_lora:
+            return "disabled"
+        
+        lora_manager = LoraManager.get_shared()
+        lora_manager.reload_if_changed()
+        
+        parts = [str(lora_manager.config_version)]
+        for matching_lora in lora_manager.select_loras(text, multi_lora):
+            strength = manual_strength if manual_strength >= 0 else matching_lora['strength']
+            lora_path = lora_file_index.resolve(matching_lora['lora_file'])
+            try:
+                mtime = os.stat(lora_path).st_mtime_ns if lora_path else None
+            except OSError:
+                mtime = None
+            parts.append(f"{lora_path or matching_lora['lora_file']}|{strength}|{mtime}")
+        
+        return hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()
+    
+    def apply_auto_lora(self, model, clip, text, enable_auto_lora=True, manual_strength=-1.0,
+                        multi_lora=False):
         """
         自動LoRA適用の主要処理
         
@@ -54,6 +148,7 @@ class AutoLoRANode:
             text: 入力テキスト
             enable_auto_lora: 自動LoRA適用の有効/無効
             manual_strength: 手動強度設定（-1.0の場合は設定ファイルの値を使用）
+            multi_lora: 複数LoRA適用モード（settings.max_lora_count 件まで連続適用）
             
         Returns:
             (model, clip, text, lora_info): 処理結果
@@ -67,29 +162,50 @@ class AutoLoRANode:
             return (output_model, output_clip, output_text, "自動LoRA無効")
         
         try:
-            # トリガーワードを検出
-            matching_lora = self.lora_manager.get_first_matching_lora(text)
-            
-            if matching_lora:
-                lora_file = matching_lora['lora_file']
-                strength = manual_strength if manual_strength >= 0 else matching_lora['strength']
+            # trace_enabled 設定または環境変数 AUTO_LORA_TRACE が有効な場合は各段階をトレース
+            timer = StageTimer(tracer=get_tracer(self.lora_manager.settings))
+            with timer.stage('total', prompt=text[:200], multi_lora=multi_lora) as total_span:
+                # 別プロセス（WebUI等）による設定ファイルの変更を反映
+                self.lora_manager.reload_if_changed()
                 
-                # LoRAファイルのパスを構築
-                lora_path = self._find_lora_file(lora_file)
+                # トリガーワードを検出
+                with timer.stage('match') as span:
+                    matching_loras = self.lora_manager.select_loras(text, multi_lora)
+                    span['trigger_words'] = [lora['trigger_word'] for lora in matching_loras]
+                prompts_total.inc(result='matched' if matching_loras else 'unmatched')
                 
-                if lora_path and os.path.exists(lora_path):
-                    # LoRAを適用
-                    output_model, output_clip = self._apply_lora(
-                        model, clip, lora_path, strength, strength
-                    )
+                if matching_loras:
+                    info_lines = []
+                    resolved_loras = []
+                    for matching_lora in matching_loras:
+                        lora_file = matching_lora['lora_file']
+                        strength = manual_strength if manual_strength >= 0 else matching_lora['strength']
+                        
+                        # LoRAファイルのパスを構築
+                        with timer.stage('find_file', lora_file=lora_file) as span:
+                            lora_path = self._find_lora_file(lora_file)
+                            span['found'] = lora_path is not None
+                        
+                        if lora_path:
+                            resolved_loras.append((lora_path, strength, strength))
+                            line = f"適用: {matching_lora['trigger_word']} -> {lora_file} (強度: {strength})"
+                        else:
+                            missing_files_total.inc()
+                            line = f"エラー: LoRAファイルが見つかりません - {lora_file}"
+                        print(f"[AutoLoRA] {line}")
+                        info_lines.append(line)
                     
-                    lora_info = f"適用: {matching_lora['trigger_word']} -> {lora_file} (強度: {strength})"
-                    print(f"[AutoLoRA] {lora_info}")
+                    if resolved_loras:
+                        # LoRAを適用（複数の場合は前段の出力に連続して適用）
+                        output_model, output_clip = self._apply_loras(model, clip, resolved_loras, timer)
+                    total_span['applied'] = len(resolved_loras)
+                    
+                    lora_info = "\n".join(info_lines)
                 else:
-                    lora_info = f"エラー: LoRAファイルが見つかりません - {lora_file}"
-                    print(f"[AutoLoRA] {lora_info}")
-            else:
-                lora_info = "トリガーワード未検出"
+                    lora_info = "トリガーワード未検出"
+            
+            if self.lora_manager.settings.get('metrics_in_lora_info', False):
+                lora_info += "\n" + timer.summary()
                 
         except Exception as e:
             lora_info = f"エラー: {str(e)}"
@@ -107,17 +223,129 @@ class AutoLoRANode:
         Returns:
             LoRAファイルの完全パス、またはNone
         """
-        # ComfyUIのLoRAディレクトリから検索
-        lora_paths = folder_paths.get_folder_paths("loras")
+        # ComfyUIのLoRAディレクトリの索引から検索（サブディレクトリ・拡張子省略にも対応）
+        return lora_file_index.resolve(lora_filename)
+    
+    def _apply_loras(self, model, clip, resolved_loras, timer=None):
+        """
+        複数のLoRAを順番に適用（LoRAから作成したパッチはキャッシュして再利用）
         
-        for lora_dir in lora_paths:
-            lora_path = os.path.join(lora_dir, lora_filename)
-            if os.path.exists(lora_path):
-                return lora_path
+        Args:
+            model: モデル
+            clip: CLIP
+            resolved_loras: (LoRAファイルパス, モデル強度, CLIP強度) のリスト
+            timer: 処理時間を記録するStageTimer（省略時は計測値にのみ記録）
+            
+        Returns:
+            (model, clip): LoRA適用後のモデルとCLIP
+        """
+        patched_model_cache.max_entries = self.lora_manager.settings.get(
+            'patched_model_cache_size', DEFAULT_PATCHED_CACHE_SIZE
+        )
+        
+        # ファイルが更新された場合に別の組み合わせとして扱うためmtimeもキーに含める
+        lora_key = tuple(
+            (lora_path, os.stat(lora_path).st_mtime_ns, model_strength, clip_strength)
+            for lora_path, model_strength, clip_strength in resolved_loras
+        )
+        timer = timer or StageTimer()
+        cached = patched_model_cache.get(model, clip, lora_key)
+        if cached is not None:
+            loras_applied_total.inc(len(resolved_loras))
+            timer.mark('patched_model_cache_hit', lora_files=[lora[0] for lora in resolved_loras])
+            # 適用後のモデルは入力モデルを参照するため、パッチのみを保持して毎回複製し直す
+            return self._patch_models(model, clip, cached)
+        
+        bundle_path = self._find_bundle(resolved_loras, timer)
+        if bundle_path is not None:
+            # 組み合わせ全体を結合したバンドルを強度1.0で1回だけ適用
+            patches = self._lora_patches(model, clip, bundle_path, 1.0, 1.0, timer)
+            if patches is not None:
+                loras_applied_total.inc(len(resolved_loras))
+                steps = ((patches, 1.0, 1.0),)
+                patched_model_cache.put(model, clip, lora_key, steps)
+                return self._patch_models(model, clip, steps)
+            print(f"[AutoLoRA] バンドルを適用できないため個別に適用します: {bundle_path}")
         
-        return None
+        steps = []
+        applied = True
+        for lora_path, model_strength, clip_strength in resolved_loras:
+            patches = self._lora_patches(model, clip, lora_path, model_strength, clip_strength, timer)
+            # 適用に失敗したLoRAは飛ばし、その組み合わせはキャッシュしない
+            if patches is not None:
+                loras_applied_total.inc()
+                steps.append((patches, model_strength, clip_strength))
+            else:
+                applied = False
+        
+        steps = tuple(steps)
+        if applied:
+            patched_model_cache.put(model, clip, lora_key, steps)
+        return self._patch_models(model, clip, steps)
     
-    def _apply_lora(self, model, clip, lora_path, model_strength, clip_strength):
+    @staticmethod
+    def _patch_models(model, clip, steps):
+        """
+        入力モデルを複製してパッチを登録（comfy.sd.load_lora_for_models と同様）
+        
+        Args:
+            model: モデル
+            clip: CLIP
+            steps: 適用する順の (パッチ, モデル強度, CLIP強度) のタプル
+            
+        Returns:
+            (model, clip): パッチを登録したモデルとCLIP（パッチがない場合は入力のまま）
+        """
+        output_model, output_clip = model, clip
+        for patches, model_strength, clip_strength in steps:
+            if model is not None and model_strength != 0:
+                if output_model is model:
+                    output_model = model.clone()
+                output_model.add_patches(patches, model_strength)
+            if clip is not None and clip_strength != 0:
+                if output_clip is clip:
+                    output_clip = clip.clone()
+                output_clip.add_patches(patches, clip_strength)
+        return output_model, output_clip
+    
+    def _find_bundle(self, resolved_loras, timer):
+        """
+        LoRAの組み合わせを結合したバンドルを検索
+        
+        auto_bundle_min_uses が1以上の場合は、その回数だけ使われた組み合わせの
+        バンドルの作成をバックグラウンドで開始する（作成が終わるまでは個別に適用する）。
+        
+        Args:
+            resolved_loras: (LoRAファイルパス, モデル強度, CLIP強度) のリスト
+            timer: 処理時間を記録するStageTimer
+            
+        Returns:
+            バンドルファイルのパス、または使用しない場合はNone
+        """
+        settings = self.lora_manager.settings
+        # バンドルはモデルとCLIPに同じ強度を掛けて作るため、強度が異なる組み合わせは対象外
+        if (len(resolved_loras) < 2 or not settings.get('lora_bundles', True)
+                or any(model_strength != clip_strength for _, model_strength, clip_strength in resolved_loras)):
+            return None
+        
+        store = get_bundle_store(settings)
+        sources = [(lora_path, model_strength) for lora_path, model_strength, _ in resolved_loras]
+        with timer.stage('bundle', lora_files=[lora_path for lora_path, _ in sources]) as span:
+            bundle_path = store.find(sources)
+            result = 'hit' if bundle_path else 'miss'
+            min_uses = int(settings.get('auto_bundle_min_uses', 0))
+            if bundle_path is None and min_uses > 0:
+                try:
+                    if store.record_use(sources) >= min_uses and store.build_in_background(sources):
+                        result = 'building'
+                except (OSError, ValueError) as e:
+                    print(f"[AutoLoRA] バンドルを作成できません: {e}")
+                    result = 'failed'
+            span['result'] = result
+        bundle_lookups_total.inc(result=result)
+        return bundle_path
+    
+    def _apply_lora(self, model, clip, lora_path, model_strength, clip_strength, timer=None):
         """
         LoRAを適用
         
@@ -127,28 +355,120 @@ class AutoLoRANode:
             lora_path: LoRAファイルパス
             model_strength: モデル強度
             clip_strength: CLIP強度
+            timer: 処理時間を記録するStageTimer（省略時は計測値にのみ記録）
             
         Returns:
-            (model, clip): LoRA適用後のモデルとCLIP
+            (model, clip): LoRA適用後のモデルとCLIP（失敗した場合は入力のまま）
+        """
+        patches = self._lora_patches(model, clip, lora_path, model_strength, clip_strength, timer)
+        if patches is None:
+            return model, clip
+        return self._patch_models(model, clip, ((patches, model_strength, clip_strength),))
+    
+    def _lora_patches(self, model, clip, lora_path, model_strength, clip_strength, timer=None):
+        """
+        LoRAを読み込み、モデルの重みキーに対応付けたパッチを作成
+        
+        作成したパッチはLoRAのテンソルのみを参照し、入力モデルは参照しない。
+        
+        Args:
+            model: モデル
+            clip: CLIP
+            lora_path: LoRAファイルパス
+            model_strength: モデル強度
+            clip_strength: CLIP強度
+            timer: 処理時間を記録するStageTimer（省略時は計測値にのみ記録）
+            
+        Returns:
+            重みキー -> パッチ の辞書、または失敗した場合はNone
         """
         try:
             # ComfyUIのLoRA読み込み機能を使用
             import comfy.utils
-            import comfy.model_management
+            import comfy.lora
+            
+            # LoRAを読み込み（同じファイルはキャッシュから再利用）
+            cache_size_mb = self.lora_manager.settings.get('lora_cache_size_mb', DEFAULT_CACHE_SIZE_MB)
+            lora_state_cache.set_max_bytes(int(cache_size_mb * 1024 * 1024))
+            
+            # キャッシュに保持するテンソルのdtype（fp16 / bf16 でメモリを削減）
+            cache_dtype = self.lora_manager.settings.get('lora_cache_dtype', 'none')
+            if cache_dtype not in CACHE_DTYPES:
+                print(f"[AutoLoRA] 不正な lora_cache_dtype です: {cache_dtype}（none として扱います）")
+                cache_dtype = 'none'
             
-            # LoRAを読み込み
-            lora = comfy.utils.load_torch_file(lora_path, safe_load=True)
+            timer = timer or StageTimer()
+            bytes_read = []
             
-            # モデルにLoRAを適用
-            model_lora = comfy.model_management.load_lora_for_models(
-                model, clip, lora, model_strength, clip_strength
-            )
+            def timed(loader):
+                # キャッシュにない場合のみ呼ばれるため、ディスクからの読み込みだけが記録される
+                def load(path):
+                    with timer.stage('load', lora_file=path) as span:
+                        state_dict = loader(path)
+                        span['bytes'] = nbytes = state_dict_nbytes(state_dict)
+                    bytes_loaded_total.inc(nbytes)
+                    bytes_read.append(nbytes)
+                    return state_dict
+                return load
             
-            return model_lora
+            def load_full(path):
+                return comfy.utils.load_torch_file(path, safe_load=True)
+            
+            load_mode = self.lora_manager.settings.get('lora_load_mode', 'full')
+            if load_mode == 'lazy' and lora_path.lower().endswith('.safetensors'):
+                # 適用先のモデルに存在するキーのテンソルのみを読み込む
+                key_map = self._lora_key_map(model, clip, model_strength, clip_strength)
+                key_filter = lora_key_filter(key_map)
+                
+                def load_lazy(path):
+                    # キーが1つも一致しない形式の場合は通常の読み込みに切り替える
+                    return load_safetensors_filtered(path, key_filter) or load_full(path)
+                
+                lora = lora_state_cache.get_or_load(
+                    lora_path, timed(load_lazy), variant=('lazy', hash(frozenset(key_map))),
+                    cache_dtype=cache_dtype
+                )
+            else:
+                lora = lora_state_cache.get_or_load(lora_path, timed(load_full), cache_dtype=cache_dtype)
+            
+            # LoRAのキーをモデルの重みキーに対応付ける
+            with timer.stage('apply', lora_file=lora_path, strength=model_strength,
+                             cache='miss' if bytes_read else 'hit', bytes_read=sum(bytes_read)):
+                try:
+                    # 新しいComfyUIでは他の形式のLoRAキーを変換してから対応付ける
+                    import comfy.lora_convert
+                    lora = comfy.lora_convert.convert_lora(lora)
+                except ImportError:
+                    pass
+                patches = comfy.lora.load_lora(lora, self._lora_key_map(model, clip, 1.0, 1.0))
+            
+            return patches
             
         except Exception as e:
             print(f"[AutoLoRA] LoRA適用エラー: {e}")
-            return model, clip
+            return None
+    
+    def _lora_key_map(self, model, clip, model_strength, clip_strength):
+        """
+        適用先のモデルが受け付けるLoRAキーのマップを作成
+        
+        Args:
+            model: モデル
+            clip: CLIP
+            model_strength: モデル強度（0の場合はモデル側のキーを含めない）
+            clip_strength: CLIP強度（0の場合はCLIP側のキーを含めない）
+            
+        Returns:
+            LoRAキー -> モデルの重みキー の辞書
+        """
+        import comfy.lora
+        
+        key_map = {}
+        if model is not None and model_strength != 0:
+            key_map = comfy.lora.model_lora_keys_unet(model.model, key_map)
+        if clip is not None and clip_strength != 0:
+            key_map = comfy.lora.model_lora_keys_clip(clip.cond_stage_model, key_map)
+        return key_map
 
 
 class LoRAManagerNode:
@@ -160,7 +480,7 @@ class LoRAManagerNode:
     def INPUT_TYPES(cls):
         return {
             "required": {
-                "action": (["list", "add", "remove", "reload"], {"default": "list"}),
+                "action": (["list", "add", "remove", "reload", "cache_stats", "clear_cache", "scan", "scan_import"], {"default": "list"}),
             },
             "optional": {
                 "trigger_word": ("STRING", {"default": ""}),
@@ -177,7 +497,7 @@ class LoRAManagerNode:
     DESCRIPTION = "LoRA設定の管理"
     
     def __init__(self):
-        self.lora_manager = LoraManager()
+        self.lora_manager = LoraManager.get_shared()
     
     def manage_lora(self, action, trigger_word="", lora_file="", strength=1.0, description=""):
         """
@@ -194,6 +514,9 @@ class LoRAManagerNode:
             (result,): 処理結果
         """
         try:
+            if action != "reload":
+                self.lora_manager.reload_if_changed()
+            
             if action == "list":
                 mappings = self.lora_manager.list_all_mappings()
                 if mappings:
@@ -203,6 +526,11 @@ class LoRAManagerNode:
                         if mapping.get('description'):
                             line += f" - {mapping['description']}"
                         result_lines.append(line)
+                    for duplicate in self.lora_manager.get_duplicate_mappings():
+                        result_lines.append(
+                            f"※ '{duplicate['trigger_word']}' ({duplicate['lora_file']}) は "
+                            f"'{duplicate['active_trigger_word']}' と重複しているため使用されません"
+                        )
                     result = "\\n".join(result_lines)
                 else:
                     result = "登録済みLoRAはありません"
@@ -233,6 +561,47 @@ class LoRAManagerNode:
                 self.lora_manager.load_config()
                 result = "設定ファイルを再読み込みしました"
             
+            elif action == "cache_stats":
+                stats = lora_state_cache.stats()
+                result = (
+                    f"LoRAキャッシュ: {stats['entries']}件 "
+                    f"{stats['bytes'] / (1024 * 1024):.1f}/{stats['max_bytes'] / (1024 * 1024):.0f}MB "
+                    f"(ヒット: {stats['hits']}, ミス: {stats['misses']}, 破棄: {stats['evictions']})"
+                )
+                if stats['saved_bytes']:
+                    result += f" 精度変換による削減: {stats['saved_bytes'] / (1024 * 1024):.1f}MB"
+                patched_stats = patched_model_cache.stats()
+                result += (
+                    f"\n適用済みモデルキャッシュ: {patched_stats['entries']}/{patched_stats['max_entries']}件 "
+                    f"(ヒット: {patched_stats['hits']}, ミス: {patched_stats['misses']})"
+                )
+                match_stats = self.lora_manager.get_match_cache_stats()
+                result += (
+                    f"\nプロンプト検出キャッシュ: {match_stats['entries']}/{match_stats['max_entries']}件 "
+                    f"(ヒット率: {match_stats['hit_rate']:.1%}, ヒット: {match_stats['hits']}, ミス: {match_stats['misses']})"
+                )
+            
+            elif action in ("scan", "scan_import"):
+                # LoRAファイルのメタデータからマッピング候補を作成（scan_importは一括登録）
+                scan_result = scan_and_propose(
+                    self.lora_manager, import_mappings=(action == "scan_import")
+                )
+                result_lines = [f"=== メタデータスキャン: {scan_result['scanned']}件 ==="]
+                for proposal in scan_result['proposals']:
+                    note = "（タグから推定・要確認）" if proposal['source'] == 'tags' else ""
+                    result_lines.append(f"'{proposal['trigger_word']}' -> {proposal['lora_file']}{note}")
+                if action == "scan_import":
+                    # タグから推定した候補は登録しない（WebUIで確認して登録する）
+                    result_lines.append(f"登録: {scan_result['added']}件")
+                else:
+                    result_lines.append(f"候補: {len(scan_result['proposals'])}件（scan_import で一括登録）")
+                result = "\n".join(result_lines)
+            
+            elif action == "clear_cache":
+                lora_state_cache.clear()
+                patched_model_cache.clear()
+                result = "LoRAキャッシュを破棄しました"
+            
             else:
                 result = f"不明なアクション: {action}"
                 
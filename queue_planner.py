@@ -0,0 +1,291 @@
+"""
+プロンプトのキューを適用されるLoRAの組み合わせごとにまとめる
+
+大量のプロンプトを投入する際、異なるLoRAを使うジョブが交互に並ぶと
+切り替えのたびにLoRAの適用し直しやファイルの読み込みが発生する。
+plan_queue() は各プロンプトに適用されるLoRA（ファイルと強度の並び）を
+Auto LoRA ノードと同じマッチャーで調べ、同じ組み合わせのジョブが
+連続するように並べ替えた実行計画を返す。グループ内の順序と、
+グループ同士の順序（最初に現れた順）は元のキューの順序を保つ。
+
+    python queue_planner.py queue.txt -o planned.txt
+    python queue_planner.py jobs.jsonl --in-place --multi-lora
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple
+
+try:
+    from .lora_manager import LoraManager
+except ImportError:
+    from lora_manager import LoraManager
+
+# キューファイルの形式（text: 1行1プロンプト / jsonl: 1行1ジョブ / json: ジョブの配列）
+QUEUE_FORMATS = ('text', 'jsonl', 'json')
+
+# グループの並べ方（first: 最初に現れた順 / files: LoRAファイル名順で共通のファイルを持つグループを近づける）
+GROUP_ORDERS = ('first', 'files')
+
+# LoRAの組み合わせ: ((LoRAファイル, 強度), ...)
+LoraKey = Tuple[Tuple[str, float], ...]
+
+
+def count_loads(keys: Sequence[LoraKey], cache_entries: int = 0) -> Dict:
+    """
+    ジョブをこの順に実行した場合のLoRAの切り替え回数とファイルの読み込み回数を見積もる
+
+    読み込み済みのLoRAは最大 cache_entries 個（少なくとも実行中のジョブの分）を
+    最近使った順に保持するものとして数える。
+
+    Args:
+        keys: ジョブごとのLoRAの組み合わせ
+        cache_entries: 保持する読み込み済みLoRAの数（0の場合は直前のジョブの分のみ）
+
+    Returns:
+        switches（組み合わせが変わった回数）, patches（LoRAを適用したジョブ数）,
+        file_loads（ファイルの読み込み回数）を持つ辞書
+    """
+    switches = 0
+    patches = 0
+    file_loads = 0
+    loaded = OrderedDict()
+    previous = None
+    for key in keys:
+        if key == previous:
+            continue
+        if previous is not None:
+            switches += 1
+        previous = key
+        if not key:
+            continue
+        patches += 1
+        files = {lora_file for lora_file, _ in key}
+        for lora_file in files:
+            if lora_file in loaded:
+                loaded.move_to_end(lora_file)
+            else:
+                file_loads += 1
+                loaded[lora_file] = True
+        # 実行中のジョブのファイル以外を古いものから破棄
+        limit = max(cache_entries, len(files))
+        for lora_file in list(loaded):
+            if len(loaded) <= limit:
+                break
+            if lora_file not in files:
+                del loaded[lora_file]
+    return {'switches': switches, 'patches': patches, 'file_loads': file_loads}
+
+
+def plan_queue(lora_manager: LoraManager, prompts: Sequence[str], multi_lora: bool = False,
+               manual_strength: float = -1.0, group_order: str = 'first', cache_entries: int = 0,
+               executor=None) -> Dict:
+    """
+    プロンプトを適用されるLoRAの組み合わせごとにまとめた実行計画を作成
+
+    Args:
+        lora_manager: LoraManager
+        prompts: 元のキューの順序のプロンプト
+        multi_lora: 複数LoRA適用モード（ノードの multi_lora と同じ）
+        manual_strength: 0以上の場合は設定ファイルの強度の代わりに使う（ノードと同じ）
+        group_order: グループの並べ方（GROUP_ORDERS のいずれか）
+        cache_entries: 読み込み回数の見積もりで保持するLoRAの数（count_loads を参照）
+        executor: 照合を並行に行う concurrent.futures のExecutor
+
+    Returns:
+        order（実行順の元のインデックス）, groups（loras と prompts（元のインデックス）の辞書のリスト）,
+        version（照合に使った設定バージョン）, original / planned（count_loads の結果）を持つ辞書
+    """
+    if group_order not in GROUP_ORDERS:
+        raise ValueError(f"不正なグループの並べ方です: {group_order}")
+
+    snapshot = lora_manager.snapshot()
+    matches = lora_manager.match_prompts(list(prompts), multi_lora, executor, snapshot=snapshot)
+
+    groups: Dict[LoraKey, Dict] = {}
+    keys: List[LoraKey] = []
+    for index, (loras, _) in enumerate(matches):
+        key = tuple(
+            (lora['lora_file'], manual_strength if manual_strength >= 0 else lora['strength'])
+            for lora in loras
+        )
+        keys.append(key)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                'loras': [
+                    {'trigger_word': lora['trigger_word'], 'lora_file': lora_file, 'strength': strength}
+                    for lora, (lora_file, strength) in zip(loras, key)
+                ],
+                'prompts': [],
+            }
+        group['prompts'].append(index)
+
+    ordered_keys = list(groups)
+    if group_order == 'files':
+        ordered_keys.sort(key=lambda key: (sorted(lora_file for lora_file, _ in key), key))
+
+    order = [index for key in ordered_keys for index in groups[key]['prompts']]
+    return {
+        'order': order,
+        'groups': [groups[key] for key in ordered_keys],
+        'version': snapshot.version,
+        'original': count_loads(keys, cache_entries),
+        'planned': count_loads(ordered_keys, cache_entries),
+    }
+
+
+def _detect_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension == '.json':
+        return 'json'
+    return 'text'
+
+
+def read_queue(path: str, fmt: str) -> Tuple[List, List[str]]:
+    """
+    キューファイルを読み込む
+
+    jsonl / json の各ジョブは文字列、または prompt（ComfyUIのAPI形式の場合は
+    text）を持つオブジェクト。
+
+    Args:
+        path: キューファイル（'-' の場合は標準入力）
+        fmt: QUEUE_FORMATS のいずれか
+
+    Returns:
+        (ジョブのリスト, プロンプトのリスト)
+
+    Raises:
+        ValueError: プロンプトを取り出せないジョブがある場合
+    """
+    if path == '-':
+        content = sys.stdin.read()
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+    if fmt == 'text':
+        jobs = [line for line in content.splitlines() if line.strip()]
+    elif fmt == 'jsonl':
+        jobs = [json.loads(line) for line in content.splitlines() if line.strip()]
+    elif fmt == 'json':
+        jobs = json.loads(content)
+        if not isinstance(jobs, list):
+            raise ValueError("JSONのキューはジョブの配列である必要があります")
+    else:
+        raise ValueError(f"不正な形式です: {fmt}")
+
+    prompts = []
+    for number, job in enumerate(jobs, 1):
+        if isinstance(job, str):
+            prompts.append(job)
+        elif isinstance(job, dict) and isinstance(job.get('prompt', job.get('text')), str):
+            prompts.append(job.get('prompt', job.get('text')))
+        else:
+            raise ValueError(f"{number}件目のジョブからプロンプトを取り出せません")
+    return jobs, prompts
+
+
+def write_queue(path: str, jobs: Sequence, fmt: str):
+    """
+    キューファイルを書き込む（通常のファイルは一時ファイルに書いてから置き換える）
+
+    Args:
+        path: 保存先（'-' の場合は標準出力）
+        jobs: ジョブのリスト
+        fmt: QUEUE_FORMATS のいずれか
+    """
+    if fmt == 'text':
+        content = ''.join(f"{job}\n" for job in jobs)
+    elif fmt == 'jsonl':
+        content = ''.join(json.dumps(job, ensure_ascii=False) + '\n' for job in jobs)
+    else:
+        content = json.dumps(list(jobs), ensure_ascii=False, indent=2) + '\n'
+
+    if path == '-':
+        sys.stdout.write(content)
+        return
+    if os.path.exists(path) and not os.path.isfile(path):
+        # デバイスやパイプは置き換えずにそのまま書き込む
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return
+    # 同じディレクトリの一意な一時ファイルに書き込んでから置き換える（同時に実行しても衝突しない）
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(
+        dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            # mkstemp の一時ファイルは所有者のみ読み書きできるため、元のファイルの権限を引き継ぐ
+            shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description='プロンプトのキューを適用されるLoRAの組み合わせごとに並べ替える')
+    parser.add_argument('queue', help="キューファイル（'-' で標準入力）")
+    parser.add_argument('-o', '--output', help="出力先（省略時は標準出力、'-' で標準出力）")
+    parser.add_argument('--in-place', action='store_true', help='キューファイルを書き換える')
+    parser.add_argument('--format', choices=QUEUE_FORMATS, help='キューファイルの形式（省略時は拡張子から判定）')
+    parser.add_argument('--config', help='設定ファイルのパス（省略時は config/lora_mapping.json）')
+    parser.add_argument('--multi-lora', action='store_true', help='複数LoRA適用モードで照合する')
+    parser.add_argument('--manual-strength', type=float, default=-1.0,
+                        help='ノードの manual_strength（0以上の場合は全てのLoRAの強度として使う）')
+    parser.add_argument('--group-order', choices=GROUP_ORDERS, default='first', help='グループの並べ方')
+    parser.add_argument('--cache-entries', type=int, default=0,
+                        help='読み込み回数の見積もりで保持するLoRAの数')
+    parser.add_argument('--annotate', action='store_true',
+                        help='JSONのジョブに lora_group（グループ番号）と loras を追加する')
+    args = parser.parse_args()
+
+    if args.in_place and (args.output or args.queue == '-'):
+        parser.error('--in-place は -o や標準入力と同時に指定できません')
+    fmt = args.format or _detect_format(args.queue)
+    jobs, prompts = read_queue(args.queue, fmt)
+
+    lora_manager = LoraManager.get_shared(args.config)
+    plan = plan_queue(lora_manager, prompts, args.multi_lora, args.manual_strength,
+                      args.group_order, args.cache_entries)
+
+    planned_jobs = []
+    for group_number, group in enumerate(plan['groups']):
+        for index in group['prompts']:
+            job = jobs[index]
+            if args.annotate and fmt != 'text':
+                job = dict(job) if isinstance(job, dict) else {'prompt': job}
+                job['lora_group'] = group_number
+                job['loras'] = [{'lora_file': lora['lora_file'], 'strength': lora['strength']}
+                                for lora in group['loras']]
+            planned_jobs.append(job)
+
+    output = args.queue if args.in_place else (args.output or '-')
+    write_queue(output, planned_jobs, fmt)
+
+    original, planned = plan['original'], plan['planned']
+    print(f"ジョブ: {len(jobs)}件, グループ: {len(plan['groups'])}件 (設定バージョン {plan['version']})",
+          file=sys.stderr)
+    print(f"LoRAの切り替え: {original['switches']}回 -> {planned['switches']}回, "
+          f"ファイルの読み込み: {original['file_loads']}回 -> {planned['file_loads']}回", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+safetensorsファイルの軽量な読み書きユーティリティ
+
+- read_safetensors_header: 先頭のJSONヘッダーのみを読み込む（テンソル本体は読まない）
+- load_safetensors_filtered: メモリマップしたファイルから必要なテンソルだけを取り出す
+- save_safetensors: state dictをsafetensors形式で書き込む
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Callable, Dict, Tuple
+
+# ヘッダーサイズの上限（壊れたファイルで巨大な読み込みをしないため）
+MAX_HEADER_SIZE = 100 * 1024 * 1024
+
+# safetensorsのdtype名 -> torchのdtype名
+_DTYPE_NAMES = {
+    "F64": "float64",
+    "F32": "float32",
+    "F16": "float16",
+    "BF16": "bfloat16",
+    "I64": "int64",
+    "I32": "int32",
+    "I16": "int16",
+    "I8": "int8",
+    "U8": "uint8",
+    "BOOL": "bool",
+    "F8_E4M3": "float8_e4m3fn",
+    "F8_E5M2": "float8_e5m2",
+}
+
+# torchのdtype名 -> safetensorsのdtype名
+_DTYPE_CODES = {name: code for code, name in _DTYPE_NAMES.items()}
+
+
+def read_safetensors_header(path: str) -> Tuple[Dict, int]:
+    """
+    safetensorsファイルのヘッダーを読み込む
+
+    Args:
+        path: safetensorsファイルのパス
+
+    Returns:
+        (ヘッダー辞書, テンソルデータの開始位置)
+
+    Raises:
+        ValueError: safetensors形式として不正な場合
+    """
+    with open(path, 'rb') as f:
+        size_bytes = f.read(8)
+        if len(size_bytes) != 8:
+            raise ValueError(f"safetensorsヘッダーが読み込めません: {path}")
+        header_size = struct.unpack('<Q', size_bytes)[0]
+        if header_size > MAX_HEADER_SIZE:
+            raise ValueError(f"safetensorsヘッダーが大きすぎます: {path}")
+        header_bytes = f.read(header_size)
+        if len(header_bytes) != header_size:
+            raise ValueError(f"safetensorsヘッダーが途中で切れています: {path}")
+    return json.loads(header_bytes.decode('utf-8')), 8 + header_size
+
+
+def read_safetensors_metadata(path: str) -> Dict[str, str]:
+    """
+    safetensorsファイルの __metadata__ を取得
+
+    Args:
+        path: safetensorsファイルのパス
+
+    Returns:
+        メタデータ辞書（存在しない場合は空）
+    """
+    header, _ = read_safetensors_header(path)
+    return header.get('__metadata__') or {}
+
+
+def load_safetensors_filtered(path: str, key_filter: Callable[[str], bool]) -> Dict:
+    """
+    key_filterを満たすテンソルのみをメモリマップから読み込む
+
+    ヘッダーだけを先に読み、該当するテンソルのみを torch.frombuffer で
+    作成する。ファイルはコピーオンライトでマップされるため、
+    テンソルに書き込まない限りディスク上のページを共有する（ゼロコピー）。
+
+    Args:
+        path: safetensorsファイルのパス
+        key_filter: テンソル名を受け取り、読み込むかどうかを返す関数
+
+    Returns:
+        テンソル名 -> テンソル の辞書
+    """
+    import torch
+
+    header, data_offset = read_safetensors_header(path)
+    selected = [(name, info) for name, info in header.items()
+                if name != '__metadata__' and key_filter(name)]
+    if not selected:
+        return {}
+
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    state_dict = {}
+    for name, info in selected:
+        dtype = getattr(torch, _DTYPE_NAMES[info['dtype']])
+        shape = info['shape']
+        start, end = info['data_offsets']
+        element_size = torch.empty((), dtype=dtype).element_size()
+        count = (end - start) // element_size
+        if count == 0:
+            state_dict[name] = torch.empty(shape, dtype=dtype)
+            continue
+        tensor = torch.frombuffer(mapped, dtype=dtype, count=count, offset=data_offset + start)
+        state_dict[name] = tensor.reshape(shape)
+    return state_dict
+
+
+def save_safetensors(path: str, state_dict: Dict, metadata: Dict[str, str] = None):
+    """
+    state dictをsafetensors形式で書き込む
+
+    同じディレクトリの一時ファイル（書き込みごとに別の名前）にテンソルを順に書き込んでから
+    置き換えるため、書き込み途中のファイルが読み込まれることはなく、複数のプロセスが
+    同じファイルを同時に書き込んでも互いの一時ファイルを壊さない。
+
+    Args:
+        path: 保存先
+        state_dict: テンソル名 -> テンソル の辞書
+        metadata: __metadata__ に保存する文字列の辞書
+
+    Raises:
+        ValueError: safetensorsで保存できないdtypeのテンソルがある場合
+    """
+    import torch
+
+    header = {}
+    if metadata:
+        header['__metadata__'] = {str(key): str(value) for key, value in metadata.items()}
+    tensors = []
+    offset = 0
+    for name, value in state_dict.items():
+        tensor = value.detach().to('cpu').contiguous()
+        dtype_name = str(tensor.dtype).split('.')[-1]
+        if dtype_name not in _DTYPE_CODES:
+            raise ValueError(f"safetensorsで保存できないdtypeです: {name} ({dtype_name})")
+        nbytes = tensor.element_size() * tensor.numel()
+        header[name] = {'dtype': _DTYPE_CODES[dtype_name], 'shape': list(tensor.shape),
+                        'data_offsets': [offset, offset + nbytes]}
+        tensors.append((tensor, nbytes))
+        offset += nbytes
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    # テンソルデータの開始位置を8バイト境界に揃える
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), prefix='.' + os.path.basename(path) + '.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            for tensor, nbytes in tensors:
+                if nbytes == 0:
+                    continue
+                buffer = bytearray(nbytes)
+                torch.frombuffer(buffer, dtype=torch.uint8).copy_(tensor.reshape(-1).view(torch.uint8))
+                f.write(buffer)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def lora_key_filter(key_map: Dict) -> Callable[[str], bool]:
+    """
+    ComfyUIのLoRAキーマップに含まれるモジュールのテンソルかを判定する関数を作成
+
+    テンソル名を '.' ごとに区切った先頭部分（例: "lora_unet_xxx.lora_up.weight"
+    の "lora_unet_xxx"）がキーマップに含まれるかで判定する。
+
+    Args:
+        key_map: comfy.lora.model_lora_keys_unet/clip が返すキーマップ
+
+    Returns:
+        テンソル名を受け取る判定関数
+    """
+    def key_filter(name: str) -> bool:
+        position = name.find('.')
+        while position != -1:
+            prefix = name[:position]
+            if prefix in key_map:
+                return True
+            # "{key}_lora.up.weight" 形式
+            if prefix.endswith('_lora') and prefix[:-5] in key_map:
+                return True
+            position = name.find('.', position + 1)
+        return False
+
+    return key_filter
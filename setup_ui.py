@@ -3,21 +3,25 @@
 Auto LoRA WebUI 起動スクリプト
 """
 
-from web_ui import start_web_ui
+from web_ui import start_web_ui, DEFAULT_WORKERS
 import argparse
 
 def main():
     parser = argparse.ArgumentParser(description='Auto LoRA 設定管理WebUIを起動')
     parser.add_argument('--port', type=int, default=8765, help='ポート番号 (デフォルト: 8765)')
+    parser.add_argument('--host', default='', help='待ち受けるアドレス (デフォルト: 全て)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'同時に処理するリクエスト数 (デフォルト: {DEFAULT_WORKERS})')
     
     args = parser.parse_args()
     
     print("=== Auto LoRA 設定管理WebUI ===")
     print(f"ポート: {args.port}")
+    print(f"ワーカー数: {args.workers}")
     print("設定ファイル: config/lora_mapping.json")
     print("")
     
-    start_web_ui(args.port)
+    start_web_ui(args.port, args.host, args.workers)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,19 @@
+"""
+pytestの収集設定（pytest.ini の -p で読み込む）
+
+リポジトリ直下の __init__.py はComfyUIのカスタムノードの登録用で、
+読み込むには torch や ComfyUI本体が必要になる。テストではリポジトリの
+ディレクトリをパッケージではなく通常のディレクトリとして収集する。
+"""
+
+import os
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def pytest_collect_directory(path, parent):
+    if str(path) == REPO_DIR:
+        return pytest.Dir.from_parent(parent, path=path)
+    return None
@@ -0,0 +1,109 @@
+"""
+LoRA関連のキャッシュ
+"""
+
+import gc
+import weakref
+
+import pytest
+
+from lora_cache import LoraStateDictCache, PatchedModelCache, state_dict_nbytes
+
+# fp32 で計算した差分の重みに対する相対誤差の許容値（benchmarks の precision と同じ）
+PRECISION_TOLERANCE = {'fp16': 0.002, 'bf16': 0.016}
+
+
+class FakeModelPatcher:
+    """ComfyUIの ModelPatcher と同様に、複製は元のモデルを parent として参照する"""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.patches = []
+
+    def clone(self):
+        return FakeModelPatcher(parent=self)
+
+
+def test_patched_model_cache_does_not_keep_input_alive():
+    cache = PatchedModelCache()
+    model, clip = FakeModelPatcher(), FakeModelPatcher()
+    steps = (({'weight': 'patch'}, 1.0, 1.0),)
+    cache.put(model, clip, 'key', steps)
+    assert cache.get(model, clip, 'key') is steps
+
+    model_ref = weakref.ref(model)
+    del model
+    gc.collect()
+    assert model_ref() is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_patched_model_cache_clear_releases_finalizers():
+    cache = PatchedModelCache()
+    model, clip = FakeModelPatcher(), FakeModelPatcher()
+    cache.put(model, clip, 'key', ())
+    cache.clear()
+    assert cache.stats()['entries'] == 0
+
+    # 破棄後に同じモデルを登録した場合も、解放時にエントリが破棄される
+    cache.put(model, clip, 'key', ())
+    del model
+    gc.collect()
+    assert cache.stats()['entries'] == 0
+
+
+def _lora_state_dict(torch):
+    generator = torch.Generator().manual_seed(0)
+    return {
+        'lora_unet_block.lora_up.weight': torch.randn(64, 8, generator=generator),
+        'lora_unet_block.lora_down.weight': torch.randn(8, 32, generator=generator) * 0.1,
+        'lora_unet_block.alpha': torch.tensor(4.0),
+        'lora_unet_block.dora_scale': torch.randn(1, generator=generator),
+        'lora_te_block.lora_up.weight': torch.randn(16, 4, generator=generator).half(),
+        'lora_te_block.lora_down.weight': torch.randn(4, 16, generator=generator).half(),
+    }
+
+
+@pytest.mark.parametrize('cache_dtype, dtype_name', [('fp16', 'float16'), ('bf16', 'bfloat16')])
+def test_cache_dtype_conversion(tmp_path, cache_dtype, dtype_name):
+    torch = pytest.importorskip('torch')
+    dtype = getattr(torch, dtype_name)
+    path = tmp_path / 'lora.safetensors'
+    path.write_bytes(b'')
+    original = _lora_state_dict(torch)
+
+    cache = LoraStateDictCache()
+    cached = cache.get_or_load(str(path), lambda _: dict(original), cache_dtype=cache_dtype)
+
+    # fp32 の行列のみ変換し、alpha 等の要素数1のテンソルと fp16 のテンソルはそのまま
+    assert cached['lora_unet_block.lora_up.weight'].dtype == dtype
+    assert cached['lora_unet_block.lora_down.weight'].dtype == dtype
+    for name in ('lora_unet_block.alpha', 'lora_unet_block.dora_scale',
+                 'lora_te_block.lora_up.weight', 'lora_te_block.lora_down.weight'):
+        assert cached[name] is original[name]
+
+    # 削減量は変換した fp32 テンソルの要素数 x 2バイト
+    saved = 2 * (64 * 8 + 8 * 32)
+    stats = cache.stats()
+    assert stats['saved_bytes'] == saved
+    assert stats['bytes'] == state_dict_nbytes(cached) == state_dict_nbytes(original) - saved
+    # 同じ変換のキャッシュヒットでは二重に数えない
+    assert cache.get_or_load(str(path), lambda _: dict(original), cache_dtype=cache_dtype) is cached
+    assert cache.stats()['saved_bytes'] == saved
+    cache.clear()
+    assert cache.stats()['saved_bytes'] == 0
+
+    # パッチ適用後の重み（ComfyUIと同様に元の重みのdtypeで計算）が fp32 の結果と許容範囲で一致する
+    generator = torch.Generator().manual_seed(1)
+    weight = torch.randn(64, 32, generator=generator)
+    alpha = float(original['lora_unet_block.alpha'])
+    scale = 0.8 * alpha / 8
+
+    def patched(state_dict):
+        up = state_dict['lora_unet_block.lora_up.weight'].to(torch.float32)
+        down = state_dict['lora_unet_block.lora_down.weight'].to(torch.float32)
+        return weight + scale * (up @ down)
+
+    expected = patched(original)
+    error = (patched(cached) - expected).norm() / (expected - weight).norm()
+    assert error.item() < PRECISION_TOLERANCE[cache_dtype]
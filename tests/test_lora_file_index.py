@@ -0,0 +1,61 @@
+"""
+LoRAファイルの索引
+"""
+
+import os
+
+import pytest
+
+import lora_file_index
+from lora_file_index import LoraFileIndex
+
+
+@pytest.fixture
+def lora_dir(tmp_path):
+    (tmp_path / 'Style').mkdir()
+    (tmp_path / 'MyLora.safetensors').write_bytes(b'')
+    (tmp_path / 'Style' / 'Watercolor_v2.safetensors').write_bytes(b'')
+    return tmp_path
+
+
+@pytest.mark.parametrize('case_insensitive', [False, True])
+def test_resolve_ignores_case_only_on_case_insensitive_directories(monkeypatch, lora_dir, case_insensitive):
+    monkeypatch.setattr(lora_file_index, 'is_case_insensitive_directory', lambda path: case_insensitive)
+    index = LoraFileIndex(lambda: [str(lora_dir)], refresh_interval=0)
+
+    # 大文字小文字が一致する場合は常に解決できる
+    assert index.resolve('MyLora') == str(lora_dir / 'MyLora.safetensors')
+    assert index.resolve('Style/Watercolor_v2.safetensors') == str(lora_dir / 'Style' / 'Watercolor_v2.safetensors')
+
+    for name, expected in [
+        ('mylora', lora_dir / 'MyLora.safetensors'),
+        ('MYLORA.SAFETENSORS', lora_dir / 'MyLora.safetensors'),
+        ('style\\watercolor_V2.safetensors', lora_dir / 'Style' / 'Watercolor_v2.safetensors'),
+    ]:
+        assert index.resolve(name) == (str(expected) if case_insensitive else None)
+
+
+def test_symlink_loop_is_not_followed(lora_dir):
+    try:
+        os.symlink(str(lora_dir), str(lora_dir / 'Style' / 'loop'), target_is_directory=True)
+        os.symlink(str(lora_dir / 'Style'), str(lora_dir / 'linked'), target_is_directory=True)
+    except (OSError, NotImplementedError):
+        pytest.skip('シンボリックリンクを作成できません')
+    index = LoraFileIndex(lambda: [str(lora_dir)], refresh_interval=0)
+
+    assert sorted(relpath for relpath, _ in index.iter_files()) == [
+        'MyLora.safetensors', 'Style/Watercolor_v2.safetensors', 'linked/Watercolor_v2.safetensors',
+    ]
+    # 循環しないシンボリックリンクは辿る
+    assert index.resolve('linked/Watercolor_v2.safetensors') == str(lora_dir / 'linked' / 'Watercolor_v2.safetensors')
+
+
+def test_shallower_files_win_name_lookups(tmp_path):
+    for relpath in ('a/b/same.safetensors', 'z/same.safetensors'):
+        path = tmp_path / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'')
+    index = LoraFileIndex(lambda: [str(tmp_path)], refresh_interval=0)
+
+    assert index.resolve('same') == str(tmp_path / 'z' / 'same.safetensors')
+    assert index.resolve('a/b/same.safetensors') == str(tmp_path / 'a' / 'b' / 'same.safetensors')
@@ -0,0 +1,153 @@
+"""
+LoraManager の設定ファイルの読み書き
+
+同じ設定ファイルを複数のプロセス（ComfyUI本体とWebUI）が更新する場合を、
+同じファイルを開いた2つの LoraManager で再現する。
+"""
+
+import json
+import random
+import time
+
+import pytest
+
+from lora_manager import LoraManager
+
+
+def _write_config(path, mappings, **settings):
+    config = {
+        'lora_mappings': [
+            {'trigger_word': trigger_word, 'lora_file': lora_file, 'strength': 1.0, 'description': ''}
+            for trigger_word, lora_file in mappings
+        ],
+        'settings': dict({'case_sensitive': False, 'reload_interval': 3600}, **settings),
+    }
+    if path.suffix == '.json':
+        path.write_text(json.dumps(config), encoding='utf-8')
+    else:
+        LoraManager(str(path)).store.save(config)
+
+
+def _trigger_words(path):
+    return [mapping['trigger_word'] for mapping in LoraManager(str(path)).list_all_mappings()]
+
+
+@pytest.fixture(params=['lora_mapping.json', 'lora_mapping.db'])
+def config_path(request, tmp_path):
+    path = tmp_path / request.param
+    _write_config(path, [('base', 'base.safetensors'), ('old', 'old.safetensors')])
+    return path
+
+
+def test_concurrent_writers_keep_both_changes(config_path):
+    first = LoraManager(str(config_path))
+    second = LoraManager(str(config_path))
+
+    assert first.add_lora_mapping('from_first', 'first.safetensors')
+    # second は first の書き込みを読み込んでいない
+    assert second.add_lora_mapping('from_second', 'second.safetensors')
+    assert second.remove_lora_mapping('old')
+
+    assert _trigger_words(config_path) == ['base', 'from_first', 'from_second']
+    assert [mapping['trigger_word'] for mapping in second.list_all_mappings()] == \
+        ['base', 'from_first', 'from_second']
+
+
+def test_write_behind_merges_external_changes(config_path):
+    first = LoraManager(str(config_path))
+    second = LoraManager(str(config_path))
+    assert second.update_settings(write_behind_delay=3600)
+    # 遅延書き込み中は dirty のため外部の変更を再読み込みしない
+    assert second.update_lora_mapping('base', strength=0.5)
+
+    assert first.add_lora_mapping('from_first', 'first.safetensors')
+    assert first.update_settings(max_lora_count=5)
+    assert second.flush()
+
+    manager = LoraManager(str(config_path))
+    assert [mapping['trigger_word'] for mapping in manager.list_all_mappings()] == \
+        ['base', 'old', 'from_first']
+    assert manager.get_lora_mapping('base')['strength'] == 0.5
+    assert manager.settings['max_lora_count'] == 5
+    assert manager.settings['write_behind_delay'] == 3600
+
+
+def _timed_removals(path, count, removals):
+    # 大文字小文字だけが異なる重複を含め、末尾側から削除する
+    _write_config(path, [(f"trigger_{i}", f"lora_{i}.safetensors") for i in range(count)]
+                  + [(f"Trigger_{i}", f"alt_{i}.safetensors") for i in range(count - removals, count)])
+    manager = LoraManager(str(path))
+    with manager.batch():
+        started = time.perf_counter()
+        for i in range(count - removals, count):
+            assert manager.remove_lora_mapping(f"TRIGGER_{i}")
+        elapsed = time.perf_counter() - started
+    return manager, elapsed
+
+
+def test_batch_removals_do_not_scan_all_mappings(tmp_path):
+    removals = 1000
+    small, small_elapsed = _timed_removals(tmp_path / 'small.json', 2000, removals)
+    large, large_elapsed = _timed_removals(tmp_path / 'large.json', 20000, removals)
+
+    mappings = large.list_all_mappings()
+    assert len(mappings) == 20000
+    assert mappings[-1]['trigger_word'] == 'Trigger_19999'
+    # 有効な定義を削除すると重複が繰り上がる
+    assert all(large.get_lora_mapping(f"trigger_{i}")['lora_file'] == f"alt_{i}.safetensors"
+               for i in range(20000 - removals, 20000))
+    assert large.get_duplicate_mappings() == []
+    # 1件ごとの処理がマッピング数に比例する場合は10倍程度になる
+    assert large_elapsed < max(small_elapsed, 0.01) * 4, (small_elapsed, large_elapsed)
+
+
+@pytest.mark.parametrize('case_sensitive', [False, True])
+def test_incremental_snapshot_matches_reloaded_config(tmp_path, case_sensitive):
+    path = tmp_path / 'lora_mapping.db'
+    _write_config(path, [('Miku', 'miku.safetensors'), ('miku', 'miku_alt.safetensors'),
+                         ('style', 'style.safetensors'), ('Style', 'style_alt.safetensors')],
+                  case_sensitive=case_sensitive)
+    manager = LoraManager(str(path))
+    rng = random.Random(0)
+    words = ['Miku', 'miku', 'MIKU', 'style', 'Style', 'watercolor', 'red coat', 'v2']
+    texts = ['miku, style', 'MIKU red coat', 'Style, watercolor v2']
+
+    for step in range(150):
+        word = rng.choice(words)
+        operation = rng.random()
+        if operation < 0.4:
+            manager.add_lora_mapping(word, f"lora_{step}.safetensors")
+        elif operation < 0.7:
+            manager.remove_lora_mapping(word)
+        else:
+            manager.update_lora_mapping(word, strength=step / 100, priority=step % 3)
+
+        # 1件ずつ更新したスナップショットと、保存した内容から作り直したものが一致する
+        reloaded = LoraManager(str(path))
+        assert manager.list_all_mappings() == reloaded.list_all_mappings()
+        assert manager.get_duplicate_mappings() == reloaded.get_duplicate_mappings()
+        assert manager.snapshot().mapping_list == reloaded.snapshot().mapping_list
+        for text in texts:
+            assert manager.find_matching_loras(text, max_count=10) == \
+                reloaded.find_matching_loras(text, max_count=10)
+        reloaded.store.close()
+
+
+def _timed_single_edits(path, count, edits):
+    _write_config(path, [(f"trigger_{i}", f"lora_{i}.safetensors") for i in range(count)])
+    manager = LoraManager(str(path))
+    started = time.perf_counter()
+    for i in range(edits):
+        assert manager.update_lora_mapping(f"trigger_{i}", strength=0.5)
+        assert manager.add_lora_mapping(f"added_{i}", f"added_{i}.safetensors")
+        assert manager.remove_lora_mapping(f"ADDED_{i}")
+    elapsed = time.perf_counter() - started
+    manager.store.close()
+    return elapsed
+
+
+def test_single_edits_do_not_rebuild_snapshot(tmp_path):
+    # SQLiteは変更行のみ書き込むため、公開するスナップショットの作成もマッピング数によらない
+    small = _timed_single_edits(tmp_path / 'small.db', 2000, 50)
+    large = _timed_single_edits(tmp_path / 'large.db', 20000, 50)
+    assert large < max(small, 0.01) * 4, (small, large)
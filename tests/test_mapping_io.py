@@ -0,0 +1,59 @@
+"""
+マッピングの一括インポート
+"""
+
+import json
+
+import pytest
+
+from lora_manager import LoraManager
+from mapping_io import import_mappings
+
+
+def _manager(tmp_path, **settings):
+    path = tmp_path / 'lora_mapping.json'
+    path.write_text(json.dumps({
+        'lora_mappings': [
+            {'trigger_word': 'base', 'lora_file': 'base.safetensors', 'strength': 1.0, 'description': ''},
+        ],
+        'settings': dict({'reload_interval': 3600}, **settings),
+    }), encoding='utf-8')
+    return LoraManager(str(path))
+
+
+def _lines(*rows):
+    return [json.dumps(row) + '\n' for row in rows]
+
+
+@pytest.mark.parametrize('case_sensitive', [False, True])
+def test_duplicate_rows_follow_case_sensitive(tmp_path, case_sensitive):
+    manager = _manager(tmp_path, case_sensitive=case_sensitive)
+    result = import_mappings(manager, _lines(
+        {'trigger_word': 'Miku', 'lora_file': 'miku.safetensors'},
+        {'trigger_word': 'miku', 'lora_file': 'miku_alt.safetensors'},
+    ), partial=True)
+
+    # 大文字小文字を区別する場合は別のトリガーワードとして登録できる
+    assert result['added'] == (2 if case_sensitive else 1)
+    assert result['error_count'] == (0 if case_sensitive else 1)
+    expected = ['base', 'Miku', 'miku'] if case_sensitive else ['base', 'Miku']
+    assert [mapping['trigger_word'] for mapping in manager.list_all_mappings()] == expected
+
+
+def test_upsert_sets_priority_on_added_and_updated_rows(tmp_path):
+    manager = _manager(tmp_path)
+    result = import_mappings(manager, _lines(
+        {'trigger_word': 'BASE', 'lora_file': 'base_v2.safetensors', 'strength': 0.5, 'priority': 3},
+        {'trigger_word': 'new', 'lora_file': 'new.safetensors', 'priority': 2},
+        {'trigger_word': 'plain', 'lora_file': 'plain.safetensors'},
+    ), mode='upsert')
+
+    assert (result['added'], result['updated'], result['committed']) == (2, 1, True)
+    assert manager.get_lora_mapping('base') == {
+        'trigger_word': 'base', 'lora_file': 'base_v2.safetensors', 'strength': 0.5, 'description': '',
+        'priority': 3,
+    }
+    assert manager.get_lora_mapping('new')['priority'] == 2
+    assert 'priority' not in manager.get_lora_mapping('plain')
+    # 保存した内容にも反映されている
+    assert LoraManager(manager.config_path).list_all_mappings() == manager.list_all_mappings()
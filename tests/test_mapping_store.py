@@ -0,0 +1,36 @@
+"""
+設定の保存先（JSON / SQLite）
+"""
+
+import sqlite3
+
+from mapping_store import SQLiteMappingStore, create_store
+
+
+def test_sqlite_store_save_and_reload(tmp_path):
+    path = str(tmp_path / 'lora_mapping.db')
+    config = {
+        'lora_mappings': [
+            {'trigger_word': 'Miku', 'lora_file': 'miku.safetensors', 'strength': 0.8,
+             'description': 'キャラクター', 'priority': 2},
+            {'trigger_word': 'miku', 'lora_file': 'miku_alt.safetensors', 'strength': 1.0, 'description': ''},
+            {'trigger_word': 'watercolor', 'lora_file': 'style/watercolor.safetensors', 'strength': 0.6,
+             'description': ''},
+        ],
+        'settings': {'case_sensitive': True, 'max_lora_count': 3},
+    }
+    store = create_store(path)
+    assert isinstance(store, SQLiteMappingStore)
+    assert store.save(config) == []
+    store.close()
+
+    # 保存先はJSONではなくSQLiteのデータベース
+    with sqlite3.connect(path) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM mappings").fetchone()[0] == 3
+
+    reopened = SQLiteMappingStore(path)
+    try:
+        assert reopened.exists()
+        assert reopened.load() == config
+    finally:
+        reopened.close()
@@ -0,0 +1,44 @@
+"""
+メタデータからのトリガーワード候補の抽出
+"""
+
+import json
+
+from metadata_scanner import extract_trigger_info
+
+
+def _metadata(tag_frequency, image_counts, **extra):
+    metadata = {
+        'ss_tag_frequency': json.dumps(tag_frequency),
+        'ss_dataset_dirs': json.dumps({
+            name: {'n_repeats': 10, 'img_count': count} for name, count in image_counts.items()
+        }),
+    }
+    metadata.update(extra)
+    return metadata
+
+
+def test_trigger_phrase_and_output_name_come_first():
+    info = extract_trigger_info(_metadata(
+        {'10_chara': {'chara_name': 20, '1girl': 20}}, {'10_chara': 20},
+        **{'modelspec.trigger_phrase': 'chara, red coat', 'ss_output_name': 'chara_v2'}
+    ))
+    assert info['trigger_words'] == ['chara', 'red coat', 'chara_v2']
+    assert info['tag_candidates'] == ['chara_name']
+
+
+def test_tag_candidates_require_every_image_and_skip_common_tags():
+    info = extract_trigger_info(_metadata(
+        {
+            '10_front': {'chara_name': 12, 'solo': 12, 'Looking_At_Viewer': 12, 'smile': 9},
+            '5_back': {'chara_name': 4, 'solo': 4, 'from behind': 4},
+        },
+        {'10_front': 12, '5_back': 4},
+    ))
+    assert info['trigger_words'] == []
+    assert info['tag_candidates'] == ['chara_name']
+
+
+def test_no_tag_candidates_without_image_counts():
+    info = extract_trigger_info({'ss_tag_frequency': json.dumps({'10_chara': {'chara_name': 20}})})
+    assert info['tag_candidates'] == []
@@ -0,0 +1,145 @@
+"""
+TriggerMatcher と従来の正規表現による検出の一致確認
+
+従来の実装は設定ファイル上の順にトリガーワードごとに
+re.search(r'\b' + re.escape(trigger_word) + r'\b', search_text) を実行し、
+case_sensitive が無効の場合はトリガーワードとテキストの両方を lower() していた。
+"""
+
+import json
+import random
+import re
+
+import pytest
+
+from lora_manager import LoraManager
+from trigger_matcher import TriggerMatcher
+
+# 単語境界の判定が分かれる文字を多めに含める
+# （英数字・アンダースコア・数字・記号・空白・非ASCIIの単語文字・lower() で長さが変わる文字）
+ALPHABET = (
+    'a', 'b', 'A', 'B', '_', '1', '2', '-', '.', ' ', ' ', ',', '(', ')', ':', "'",
+    'é', 'É', 'ß', '日', '本', '٣', 'İ', '́',
+)
+
+SEEDS = range(40)
+
+
+def _regex_matches(trigger_word: str, text: str, case_sensitive: bool) -> bool:
+    search_text = text if case_sensitive else text.lower()
+    if not case_sensitive:
+        trigger_word = trigger_word.lower()
+    return re.search(r'\b' + re.escape(trigger_word) + r'\b', search_text) is not None
+
+
+def _random_word(rng: random.Random, max_length: int) -> str:
+    return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(1, max_length)))
+
+
+def _random_case(rng: random.Random) -> list:
+    """重なり・入れ子を含むトリガーワードとテキストを作る"""
+    texts = [_random_word(rng, 24) for _ in range(30)]
+    triggers = []
+    for _ in range(25):
+        source = rng.choice(texts)
+        start = rng.randrange(len(source))
+        # テキストの部分文字列から取ると、重なり・入れ子のトリガーワードが多くなる
+        triggers.append(source[start:start + rng.randint(1, 6)])
+    triggers += [_random_word(rng, 4) for _ in range(10)]
+    triggers += [trigger[:-1] for trigger in triggers if len(trigger) > 1][:10]
+    # 大文字小文字だけが異なるトリガーワード
+    triggers += [trigger.swapcase() for trigger in triggers[:5]]
+    texts += [' '.join(rng.sample(triggers, 3)) for _ in range(10)]
+    return triggers, texts
+
+
+@pytest.mark.parametrize('case_sensitive', [False, True])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_matcher_matches_regex(seed, case_sensitive):
+    rng = random.Random(seed)
+    triggers, texts = _random_case(rng)
+    normalize = (lambda value: value) if case_sensitive else str.lower
+    matcher = TriggerMatcher((normalize(trigger), i) for i, trigger in enumerate(triggers))
+
+    for text in texts:
+        expected = {i for i, trigger in enumerate(triggers) if _regex_matches(trigger, text, case_sensitive)}
+        assert matcher.find_all(normalize(text)) == expected, (triggers, text)
+
+
+@pytest.mark.parametrize('trigger_word, text, expected', [
+    ('_miku', 'a _miku b', True),
+    ('_miku', 'a x_miku b', False),
+    ('miku_', 'miku_, style', True),
+    ('miku_', 'miku_v2', False),
+    ('v2', 'miku v2', True),
+    ('v2', 'mikuv2', False),
+    ('2b', '(2b:1.2)', True),
+    ('(2b)', 'x (2b) y', False),
+    ('(2b)', 'x(2b)y', True),
+    ('style.', 'style. next', False),
+    ('日本', '日本 style', True),
+    ('日本', '日本語', False),
+    ('café', 'CAFÉ latte', True),
+])
+def test_boundary_cases(trigger_word, text, expected):
+    assert _regex_matches(trigger_word, text, False) is expected
+    matcher = TriggerMatcher([(trigger_word.lower(), 0)])
+    assert (matcher.find_all(text.lower()) == {0}) is expected
+
+
+@pytest.mark.parametrize('case_sensitive', [False, True])
+@pytest.mark.parametrize('seed', SEEDS[:10])
+def test_find_trigger_words_matches_regex(tmp_path, seed, case_sensitive):
+    rng = random.Random(seed)
+    triggers, texts = _random_case(rng)
+    config_path = tmp_path / 'lora_mapping.json'
+    config_path.write_text(json.dumps({
+        'lora_mappings': [
+            {'trigger_word': trigger, 'lora_file': f"lora_{i}.safetensors"}
+            for i, trigger in enumerate(triggers)
+        ],
+        'settings': {'case_sensitive': case_sensitive, 'match_cache_size': 0},
+    }), encoding='utf-8')
+    manager = LoraManager(str(config_path))
+
+    for text in texts:
+        # 従来は設定ファイル上の順に照合し、最初にマッチしたものを返した
+        expected = next(
+            (f"lora_{i}.safetensors" for i, trigger in enumerate(triggers)
+             if _regex_matches(trigger, text, case_sensitive)),
+            None,
+        )
+        found = manager.find_trigger_words(text)
+        assert (found[0]['lora_file'] if found else None) == expected, (triggers, text)
+
+
+@pytest.mark.parametrize('seed', SEEDS[:10])
+def test_with_values_matches_rebuilt_matcher(seed):
+    rng = random.Random(seed)
+    triggers, texts = _random_case(rng)
+    current = {}
+    matcher = TriggerMatcher()
+    history = []
+    for step in range(60):
+        trigger = rng.choice(triggers + [''])
+        values = () if rng.random() < 0.3 else (step,)
+        history.append((matcher, dict(current)))
+        matcher = matcher.with_values(trigger, values)
+        if values:
+            current[trigger] = values
+        else:
+            current.pop(trigger, None)
+
+        assert len(matcher) == len(current)
+        assert matcher.get(trigger) == values
+        assert sorted(matcher.values()) == sorted(value for values in current.values() for value in values)
+        rebuilt = TriggerMatcher((trigger, value) for trigger, values in current.items() for value in values)
+        for text in texts[:5]:
+            assert matcher.find_all(text) == rebuilt.find_all(text), (current, text)
+
+    # 変更前のマッチャーは変更されない
+    for previous, contents in history[::10]:
+        rebuilt = TriggerMatcher((trigger, value) for trigger, values in contents.items() for value in values)
+        assert len(previous) == len(contents)
+        for text in texts:
+            assert previous.find_all(text) == rebuilt.find_all(text)
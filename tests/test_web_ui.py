@@ -0,0 +1,47 @@
+"""
+WebUIサーバーの接続処理
+"""
+
+import http.client
+import threading
+import time
+
+import pytest
+
+from lora_manager import LoraManager
+from web_ui import create_web_server
+
+
+@pytest.fixture
+def server(tmp_path):
+    httpd = create_web_server('127.0.0.1', 0, workers=1,
+                              lora_manager=LoraManager(str(tmp_path / 'lora_mapping.json')))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _get(connection, path='/api/loras'):
+    connection.request('GET', path)
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def test_idle_keep_alive_connection_does_not_hold_worker(server):
+    port = server.server_address[1]
+    idle = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    assert _get(idle) == 200
+
+    # workers=1 でも、アイドルのkeep-alive接続が処理枠を使っていなければすぐに応答する
+    started = time.monotonic()
+    other = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    assert _get(other) == 200
+    assert time.monotonic() - started < 1.0
+
+    # アイドルだった接続も引き続き使える
+    assert _get(idle) == 200
+    idle.close()
+    other.close()
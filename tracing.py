@@ -0,0 +1,214 @@
+"""
+Auto LoRA ノードの処理のトレース（Chrome trace / Perfetto のJSON形式）
+
+trace_enabled 設定または環境変数 AUTO_LORA_TRACE で有効にすると、
+処理段階ごとのスパンをファイルに追記する。ファイルは chrome://tracing や
+https://ui.perfetto.dev でそのまま開ける。
+
+ファイルは JSON Array Format（"[" で始まり、イベントごとに ",\\n" で区切る）で書き込む。
+末尾の "]" は省略可能な形式のため、書き込み途中のファイルも読み込める。
+サイズが上限を超えた場合は logging.handlers.RotatingFileHandler と同様に
+.1, .2, ... に名前を変えて新しいファイルに切り替える。
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# 環境変数（1/true/on で有効、0/false/off で無効、それ以外はトレースファイルのパス）
+TRACE_ENV = 'AUTO_LORA_TRACE'
+
+# トレースファイルのデフォルトの保存先
+DEFAULT_TRACE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'traces', 'auto_lora_trace.json')
+
+# 1ファイルの上限（MB）と保持する古いファイルの数のデフォルト値
+DEFAULT_TRACE_MAX_MB = 50
+DEFAULT_TRACE_BACKUP_COUNT = 3
+
+_ENABLED_VALUES = ('1', 'true', 'on', 'yes')
+_DISABLED_VALUES = ('', '0', 'false', 'off', 'no')
+
+
+class TraceWriter:
+    """トレースイベントをファイルに追記し、上限を超えたらローテーションする"""
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_TRACE_MAX_MB * 1024 * 1024,
+                 backup_count: int = DEFAULT_TRACE_BACKUP_COUNT):
+        """
+        Args:
+            path: トレースファイルのパス
+            max_bytes: 1ファイルの上限バイト数（0以下の場合はローテーションしない）
+            backup_count: 保持する古いファイルの数
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.pid = os.getpid()
+        self._file = None
+        self._named_threads = set()
+        self._lock = threading.Lock()
+
+    def _open_locked(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if self._file.tell() == 0:
+            self._file.write('[\n')
+        # スレッド名はファイルごとに記録する
+        self._named_threads = set()
+
+    def _rotate_locked(self):
+        self._file.close()
+        self._file = None
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{i}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def _write_locked(self, event: Dict):
+        self._file.write(json.dumps(event, ensure_ascii=False, default=str) + ',\n')
+
+    def write(self, event: Dict):
+        """
+        イベントを1件追記（pid と tid は自動で付ける）
+
+        Args:
+            event: Chrome trace形式のイベント
+        """
+        thread = threading.current_thread()
+        tid = threading.get_native_id()
+        event = dict(event, pid=self.pid, tid=tid)
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._open_locked()
+                if tid not in self._named_threads:
+                    self._named_threads.add(tid)
+                    self._write_locked({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                                        'args': {'name': thread.name}})
+                self._write_locked(event)
+                self._file.flush()
+                if 0 < self.max_bytes <= self._file.tell():
+                    self._rotate_locked()
+            except OSError as e:
+                print(f"[AutoLoRA] トレースの書き込みに失敗しました: {e}")
+
+    def complete(self, name: str, start: float, duration: float, args: Optional[Dict] = None,
+                 category: str = 'autolora'):
+        """
+        開始時刻と長さが決まったスパン（ph: X）を書き込む
+
+        Args:
+            name: スパン名
+            start: 開始時刻（time.perf_counter() の値）
+            duration: 長さ（秒）
+            args: スパンの引数
+            category: カテゴリ
+        """
+        self.write({'name': name, 'cat': category, 'ph': 'X',
+                    'ts': start * 1e6, 'dur': duration * 1e6, 'args': args or {}})
+
+    def instant(self, name: str, args: Optional[Dict] = None, category: str = 'autolora'):
+        """
+        時点のイベント（ph: i）を書き込む
+
+        Args:
+            name: イベント名
+            args: イベントの引数
+            category: カテゴリ
+        """
+        self.write({'name': name, 'cat': category, 'ph': 'i', 's': 't',
+                    'ts': time.perf_counter() * 1e6, 'args': args or {}})
+
+    def close(self):
+        """ファイルを閉じる"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_writer: Optional[TraceWriter] = None
+_writer_lock = threading.Lock()
+
+
+def trace_config(settings: Dict) -> Optional[Dict]:
+    """
+    設定と環境変数からトレースの設定を決める
+
+    環境変数 AUTO_LORA_TRACE が設定されている場合は trace_enabled より優先する。
+
+    Args:
+        settings: LoraManager の設定辞書
+
+    Returns:
+        path, max_bytes, backup_count を持つ辞書（無効の場合はNone）
+    """
+    path = settings.get('trace_file') or DEFAULT_TRACE_FILE
+    enabled = bool(settings.get('trace_enabled', False))
+
+    env_value = os.environ.get(TRACE_ENV)
+    if env_value is not None:
+        value = env_value.strip()
+        if value.lower() in _DISABLED_VALUES:
+            enabled = False
+        elif value.lower() in _ENABLED_VALUES:
+            enabled = True
+        else:
+            enabled = True
+            path = value
+
+    if not enabled:
+        return None
+    return {
+        'path': os.path.abspath(path),
+        'max_bytes': int(float(settings.get('trace_max_mb', DEFAULT_TRACE_MAX_MB)) * 1024 * 1024),
+        'backup_count': int(settings.get('trace_backup_count', DEFAULT_TRACE_BACKUP_COUNT)),
+    }
+
+
+def _same_config(writer: Optional[TraceWriter], config: Dict) -> bool:
+    return (writer is not None and writer.path == config['path']
+            and writer.max_bytes == config['max_bytes'] and writer.backup_count == config['backup_count'])
+
+
+def get_tracer(settings: Dict) -> Optional[TraceWriter]:
+    """
+    有効な場合はトレースの書き込み先を返す（同じ設定の間は同じインスタンス）
+
+    Args:
+        settings: LoraManager の設定辞書
+
+    Returns:
+        TraceWriter、または無効の場合はNone
+    """
+    global _writer
+    config = trace_config(settings)
+    writer = _writer
+    if config is None:
+        if writer is not None:
+            with _writer_lock:
+                if _writer is writer:
+                    _writer = None
+            writer.close()
+        return None
+    if _same_config(writer, config):
+        return writer
+
+    with _writer_lock:
+        previous = _writer
+        if _same_config(previous, config):
+            return previous
+        _writer = TraceWriter(config['path'], config['max_bytes'], config['backup_count'])
+        writer = _writer
+        print(f"[AutoLoRA] トレースを記録します: {config['path']}")
+    if previous is not None:
+        previous.close()
+    return writer
@@ -0,0 +1,179 @@
+"""
+トリガーワード一括検出用のマッチャー
+
+トリガーワードは前後が単語境界の位置にしかマッチしないため、全トリガーワードの
+木（トライ）を単語境界の位置からのみ辿り、プロンプトを1回走査するだけで
+全てのトリガーワードを検出する。単語境界の判定は正規表現の \\b と同じ規則で行う。
+
+マッチャーは作成後に変更しない。with_values は1つのトリガーワードを変更した
+新しいマッチャーを返し、変更した経路の節点のみを複製して残りは共有するため、
+変更にかかる時間はトリガーワードの長さのみによる（トリガーワードの数によらない）。
+公開中のマッチャーを参照している読み込み側には影響しない。
+"""
+
+import re
+from typing import Iterable, Iterator, Set, Tuple
+
+# 正規表現の \b（Unicodeの英数字とアンダースコアを単語の文字とする）
+_BOUNDARY = re.compile(r'\b')
+
+# 節点の辞書で、その節点で終わるトリガーワードの値を保持するキー（1文字の文字列とは重ならない）
+_VALUES = None
+
+
+class TriggerMatcher:
+    """複数トリガーワードを1パスで検出するトライ（作成後は変更しない）"""
+
+    __slots__ = ('_root', '_size')
+
+    def __init__(self, patterns: Iterable[Tuple[str, object]] = ()):
+        """
+        Args:
+            patterns: (正規化済みトリガーワード, 値) の列。値は検出結果として返す
+                ハッシュ可能なオブジェクト（同じトリガーワードの値は全て返す）
+        """
+        # 節点は 文字 -> 子の節点 の辞書。ルートの値は空文字列のトリガーワード
+        self._root = {}
+        self._size = 0
+        for pattern, value in patterns:
+            node = self._root
+            for ch in pattern:
+                child = node.get(ch)
+                if child is None:
+                    child = node[ch] = {}
+                node = child
+            values = node.get(_VALUES, ())
+            if not values:
+                self._size += 1
+            node[_VALUES] = values + (value,)
+
+    @classmethod
+    def _from_root(cls, root: dict, size: int) -> 'TriggerMatcher':
+        matcher = cls.__new__(cls)
+        matcher._root = root
+        matcher._size = size
+        return matcher
+
+    def __len__(self) -> int:
+        """値を持つトリガーワードの数"""
+        return self._size
+
+    def get(self, pattern: str) -> Tuple:
+        """
+        トリガーワードの値を取得
+
+        Args:
+            pattern: 正規化済みトリガーワード
+
+        Returns:
+            値のタプル（登録されていない場合は空のタプル）
+        """
+        node = self._root
+        for ch in pattern:
+            node = node.get(ch)
+            if node is None:
+                return ()
+        return node.get(_VALUES, ())
+
+    def with_values(self, pattern: str, values: Tuple) -> 'TriggerMatcher':
+        """
+        トリガーワードの値を置き換えた新しいマッチャーを返す（自身は変更しない）
+
+        Args:
+            pattern: 正規化済みトリガーワード
+            values: 新しい値のタプル（空のタプルの場合はトリガーワードを削除）
+
+        Returns:
+            新しい TriggerMatcher
+        """
+        # ルートから変更する節点までの経路（存在しない節点はNone）
+        path = []
+        node = self._root
+        for ch in pattern:
+            path.append(node)
+            node = node.get(ch) if node is not None else None
+
+        had_values = node is not None and bool(node.get(_VALUES))
+        if node is None and not values:
+            return self
+        replacement = dict(node) if node is not None else {}
+        if values:
+            replacement[_VALUES] = tuple(values)
+        else:
+            replacement.pop(_VALUES, None)
+
+        # 経路上の節点を複製して付け替える（空になった節点は取り除く）
+        for ch, parent in zip(reversed(pattern), reversed(path)):
+            child = replacement
+            replacement = dict(parent) if parent is not None else {}
+            if child:
+                replacement[ch] = child
+            else:
+                replacement.pop(ch, None)
+
+        return self._from_root(replacement, self._size + bool(values) - had_values)
+
+    def values(self) -> Iterator:
+        """全トリガーワードの値を返す（順序は不定）"""
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            for ch, child in node.items():
+                if ch is _VALUES:
+                    yield from child
+                else:
+                    stack.append(child)
+
+    def find_all(self, text: str) -> Set:
+        """
+        単語境界を満たして出現する全トリガーワードの値を返す
+
+        Args:
+            text: 正規化済み（大文字小文字の扱いを揃えた）検索対象テキスト
+
+        Returns:
+            マッチしたトリガーワードの値の集合
+        """
+        matched = set()
+        if not text:
+            return matched
+
+        starts = [match.start() for match in _BOUNDARY.finditer(text)]
+        if not starts:
+            return matched
+        root = self._root
+        # 空文字列のトリガーワード（\b\b と同等で、単語境界が1つでもあればマッチ）
+        empty_values = root.get(_VALUES)
+        if empty_values:
+            matched.update(empty_values)
+
+        boundaries = set(starts)
+        text_length = len(text)
+        for start in starts:
+            if start == text_length:
+                break
+            node = root.get(text[start])
+            end = start + 1
+            while node is not None:
+                values = node.get(_VALUES)
+                if values is not None and end in boundaries:
+                    matched.update(values)
+                if end == text_length:
+                    break
+                node = node.get(text[end])
+                end += 1
+
+        return matched
+
+    def find_first(self, text: str):
+        """
+        最も小さい値（設定ファイル上で最初のもの）を返す
+
+        Args:
+            text: 正規化済み検索対象テキスト
+
+        Returns:
+            値、またはNone
+        """
+        matched = self.find_all(text)
+        return min(matched) if matched else None
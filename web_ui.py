@@ -3,34 +3,326 @@ LoRA設定管理用のWeb UI（シンプル版）
 ComfyUIのサーバーが動いていない場合でも独立して動作
 """
 
+import email.utils
+import functools
+import gzip
+import hashlib
 import http.server
-import socketserver
+import io
 import json
+import signal
+import socket
+import threading
+import time
 import urllib.parse
 import os
-from .lora_manager import LoraManager
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .lora_manager import LoraManager
+    from .event_stream import EventHub, change_event_to_sse, format_event
+    from .lora_file_index import LoraFileIndex, get_lora_directories
+    from .mapping_io import FORMATS, import_mappings, iter_export_lines
+    from .mapping_query import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MappingQueryCache
+    from .metadata_scanner import scan_and_propose
+    from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, cache_stats_collector, prompts_total, stage_seconds
+    from .metrics import registry as metrics_registry
+except ImportError:
+    from lora_manager import LoraManager
+    from event_stream import EventHub, change_event_to_sse, format_event
+    from lora_file_index import LoraFileIndex, get_lora_directories
+    from mapping_io import FORMATS, import_mappings, iter_export_lines
+    from mapping_query import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MappingQueryCache
+    from metadata_scanner import scan_and_propose
+    from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, cache_stats_collector, prompts_total, stage_seconds
+    from metrics import registry as metrics_registry
+
+# 同時に処理するリクエスト数のデフォルト値
+DEFAULT_WORKERS = 8
+
+# keep-alive接続で次のリクエストを待つ秒数（待っている間は処理枠を使わない）
+KEEP_ALIVE_TIMEOUT = 5
+
+# /api/match で大量のプロンプトを分けて処理するスレッド数
+DEFAULT_MATCH_WORKERS = min(4, os.cpu_count() or 1)
+
+# /api/match で1回に受け付けるプロンプト数の上限
+MAX_MATCH_PROMPTS = 100000
+
+# このサイズ（バイト）以上のレスポンスはgzip圧縮する
+GZIP_MIN_SIZE = 1024
+
+# チャンク転送で1回に送るおおよそのバイト数
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# ETagに含めるプロセスごとの値（再起動後に古いETagが一致しないように）
+_INSTANCE_TOKEN = os.urandom(4).hex()
+
+
+class ThreadPoolHTTPServer(http.server.HTTPServer):
+    """
+    接続ごとのスレッドで処理し、同時に処理するリクエスト数を workers 個に制限するHTTPサーバー
+    
+    keep-alive接続が次のリクエストを待っている間は処理枠を使わないため、
+    アイドル接続が多くても他のクライアントのリクエストは待たされない。
+    遅いクライアントや大きなレスポンスがあっても他の接続の処理は止まらない。
+    server_close() では待機中のkeep-alive接続を閉じ、処理中のリクエストの完了を待つ。
+    """
+    
+    allow_reuse_address = True
+    # /api/events の配信先（create_web_server で設定）
+    event_hub = None
+    
+    def __init__(self, server_address, handler_class, workers: int = DEFAULT_WORKERS,
+                 match_workers: int = DEFAULT_MATCH_WORKERS):
+        """
+        Args:
+            server_address: (ホスト, ポート)
+            handler_class: リクエストハンドラー
+            workers: 同時に処理するリクエスト数
+            match_workers: /api/match の大量のプロンプトを処理するスレッド数
+        """
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        # リクエストの処理中のみ取得する枠（LoRAWebUIHandler.handle_one_request で使用）
+        self.request_slots = threading.BoundedSemaphore(workers)
+        self._threads = set()
+        self._closing = False
+        self.match_executor = ThreadPoolExecutor(max_workers=match_workers,
+                                                 thread_name_prefix='AutoLoRA-Match')
+        self._connections = set()
+        self._detached = set()
+        self._connections_lock = threading.Lock()
+        # server_close() で呼ぶ関数
+        self.close_callbacks = []
+    
+    def process_request(self, request, client_address):
+        with self._connections_lock:
+            if self._closing:
+                # 停止処理中
+                self.shutdown_request(request)
+                return
+            self._connections.add(request)
+            thread = threading.Thread(target=self._process_request_worker,
+                                      args=(request, client_address),
+                                      name='AutoLoRA-WebUI', daemon=True)
+            self._threads.add(thread)
+        thread.start()
+    
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self._connections_lock:
+                self._connections.discard(request)
+                self._threads.discard(threading.current_thread())
+                detached = request in self._detached
+                self._detached.discard(request)
+            if not detached:
+                self.shutdown_request(request)
+    
+    def detach_request(self, request):
+        """
+        リクエスト処理の終了後も接続を閉じないようにする（SSE等で別スレッドに引き渡す場合）
+        
+        Args:
+            request: ハンドラーの self.request
+        """
+        with self._connections_lock:
+            self._detached.add(request)
+    
+    def server_close(self):
+        super().server_close()
+        for callback in self.close_callbacks:
+            callback()
+        if self.event_hub is not None:
+            self.event_hub.close()
+        with self._connections_lock:
+            self._closing = True
+            connections = list(self._connections)
+            threads = list(self._threads)
+        for connection in connections:
+            # 受信側のみ閉じ、処理中のレスポンスは最後まで送る
+            try:
+                connection.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+        for thread in threads:
+            thread.join()
+        self.match_executor.shutdown(wait=True)
+
+
+class _RequestBodyReader(io.RawIOBase):
+    """リクエスト本文を少しずつ読み込むストリーム（Content-Length / chunked に対応）"""
+    
+    def __init__(self, rfile, content_length: int = 0, chunked: bool = False):
+        self._rfile = rfile
+        self._remaining = content_length
+        self._chunked = chunked
+        self._done = False
+    
+    def readable(self) -> bool:
+        return True
+    
+    def _next_chunk(self):
+        size_line = self._rfile.readline(65537)
+        try:
+            size = int(size_line.split(b';')[0].strip(), 16)
+        except ValueError:
+            raise ValueError("chunked形式の本文が不正です")
+        if size == 0:
+            # トレーラーを読み飛ばす
+            while self._rfile.readline(65537) not in (b'\r\n', b'\n', b''):
+                pass
+            self._done = True
+        self._remaining = size
+    
+    def readinto(self, buffer) -> int:
+        if self._chunked and self._remaining == 0 and not self._done:
+            self._next_chunk()
+        size = min(len(buffer), self._remaining)
+        if size == 0:
+            return 0
+        data = self._rfile.read(size)
+        if not data:
+            raise ValueError("リクエスト本文が途中で切れています")
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+        if self._chunked and self._remaining == 0:
+            # チャンク末尾の改行
+            self._rfile.readline(3)
+        return len(data)
+
 
 class LoRAWebUIHandler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, lora_manager=None, **kwargs):
-        self.lora_manager = lora_manager or LoraManager()
+    # keep-alive（全レスポンスに Content-Length を付ける）
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEP_ALIVE_TIMEOUT
+    # ヘッダーと本文を別々に書き込むため、Nagleアルゴリズムによる遅延を避ける
+    disable_nagle_algorithm = True
+    
+    def __init__(self, *args, lora_manager=None, file_index=None, query_cache=None, **kwargs):
+        self.lora_manager = lora_manager or LoraManager.get_shared()
+        self.file_index = file_index
+        self.query_cache = query_cache or MappingQueryCache()
         super().__init__(*args, **kwargs)
     
+    def handle_one_request(self):
+        """
+        次のリクエストが届くまで処理枠を使わずに待ち、届いてから枠を取得して処理する
+        
+        アイドルのkeep-alive接続が workers 個の処理枠を占有しないようにする。
+        """
+        try:
+            # 先読みしたデータがあればすぐに返り、なければ timeout 秒まで受信を待つ
+            if not self.rfile.peek(1):
+                self.close_connection = True
+                return
+        except OSError:
+            # タイムアウト（socket.timeout）や切断
+            self.close_connection = True
+            return
+        slots = getattr(self.server, 'request_slots', None)
+        if slots is None:
+            super().handle_one_request()
+            return
+        with slots:
+            super().handle_one_request()
+    
     def do_GET(self):
-        if self.path == '/' or self.path == '/index.html':
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/' or url.path == '/index.html':
             self.serve_main_page()
-        elif self.path == '/api/loras':
-            self.serve_lora_list()
-        elif self.path.startswith('/api/'):
+        elif url.path == '/api/loras':
+            self.serve_lora_list(urllib.parse.parse_qs(url.query))
+        elif url.path == '/api/export':
+            self.serve_export(urllib.parse.parse_qs(url.query))
+        elif url.path == '/api/events':
+            self.serve_events()
+        elif url.path == '/metrics':
+            self.serve_metrics()
+        elif url.path.startswith('/api/'):
             self.send_error(404)
         else:
             super().do_GET()
     
     def do_POST(self):
-        if self.path == '/api/loras':
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/api/loras':
             self.handle_lora_action()
+        elif url.path == '/api/scan':
+            self.handle_scan()
+        elif url.path == '/api/import':
+            self.handle_import(urllib.parse.parse_qs(url.query))
+        elif url.path == '/api/match':
+            self.handle_match()
         else:
             self.send_error(404)
     
+    def _accepts_gzip(self) -> bool:
+        encodings = self.headers.get('Accept-Encoding', '')
+        return any(part.split(';')[0].strip() == 'gzip' for part in encodings.split(','))
+    
+    def _send_body(self, body: bytes, content_type: str, status: int = 200, headers: dict = None):
+        """
+        Content-Length付きでレスポンスを送信
+        
+        大きなレスポンスはクライアントが対応していればgzip圧縮する。
+        """
+        compressed = len(body) >= GZIP_MIN_SIZE and self._accepts_gzip()
+        if compressed:
+            body = gzip.compress(body, compresslevel=6)
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_chunked(self, chunks, content_type: str, headers: dict = None):
+        """
+        文字列の列をチャンク転送で送信（全体をメモリ上にまとめない）
+        
+        Args:
+            chunks: 文字列のイテレーター
+            content_type: Content-Type
+            headers: 追加のヘッダー
+        """
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        
+        def write_chunk(data: bytes):
+            self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
+        
+        pending = []
+        pending_size = 0
+        for chunk in chunks:
+            data = chunk.encode('utf-8')
+            pending.append(data)
+            pending_size += len(data)
+            if pending_size >= STREAM_CHUNK_SIZE:
+                write_chunk(b''.join(pending))
+                pending = []
+                pending_size = 0
+        if pending:
+            write_chunk(b''.join(pending))
+        self.wfile.write(b'0\r\n\r\n')
+    
+    def _send_json(self, data, status: int = 200, headers: dict = None):
+        """JSONレスポンスを送信"""
+        self._send_body(json.dumps(data, ensure_ascii=False).encode('utf-8'), 'application/json',
+                        status, headers)
+    
     def serve_main_page(self):
         html_content = '''<!DOCTYPE html>
 <html lang="ja">
@@ -60,6 +352,10 @@ class LoRAWebUIHandler(http.server.SimpleHTTPRequestHandler):
         .actions { text-align: center; margin: 20px 0; }
         .delete-btn { background: #dc3545; padding: 5px 10px; color: white; text-decoration: none; border-radius: 3px; }
         .delete-btn:hover { background: #c82333; }
+        .filters { display: flex; gap: 8px; align-items: center; }
+        .filters input, .filters select { width: auto; }
+        .filters input[type=text] { flex: 1; }
+        .pager { display: flex; gap: 8px; align-items: center; justify-content: center; }
     </style>
 </head>
 <body>
@@ -68,9 +364,45 @@ class LoRAWebUIHandler(http.server.SimpleHTTPRequestHandler):
         
         <div class="section">
             <h2>📋 登録済みLoRA一覧</h2>
+            <div class="filters">
+                <input type="text" id="filter-q" placeholder="絞り込み（部分一致）" />
+                <select id="filter-mode">
+                    <option value="q">部分一致</option>
+                    <option value="prefix">前方一致</option>
+                </select>
+                <select id="filter-field">
+                    <option value="all">全項目</option>
+                    <option value="trigger_word">トリガーワード</option>
+                    <option value="lora_file">LoRAファイル</option>
+                    <option value="description">説明</option>
+                </select>
+                <select id="sort">
+                    <option value="position">登録順</option>
+                    <option value="trigger_word">トリガーワード</option>
+                    <option value="lora_file">LoRAファイル</option>
+                    <option value="strength">強度</option>
+                    <option value="description">説明</option>
+                </select>
+                <select id="order">
+                    <option value="asc">昇順</option>
+                    <option value="desc">降順</option>
+                </select>
+                <select id="page-size">
+                    <option value="50">50件</option>
+                    <option value="100" selected>100件</option>
+                    <option value="500">500件</option>
+                </select>
+            </div>
+            <div id="duplicates" class="error" style="display: none;"></div>
             <div id="lora-list">読み込み中...</div>
+            <div class="pager">
+                <button id="prev-page" onclick="changePage(-1)">◀ 前へ</button>
+                <span id="page-info"></span>
+                <button id="next-page" onclick="changePage(1)">次へ ▶</button>
+            </div>
             <div class="actions">
                 <button onclick="loadLoraList()">🔄 更新</button>
+                <button onclick="scanMetadata()">🔍 メタデータから一括登録</button>
             </div>
         </div>
         
@@ -102,38 +434,212 @@ class LoRAWebUIHandler(http.server.SimpleHTTPRequestHandler):
             </form>
         </div>
         
+        <div class="section">
+            <h2>📦 一括エクスポート・インポート</h2>
+            <div class="actions">
+                <a href="/api/export?format=jsonl"><button type="button">⬇️ JSONLでエクスポート</button></a>
+                <a href="/api/export?format=csv"><button type="button">⬇️ CSVでエクスポート</button></a>
+            </div>
+            <div class="filters">
+                <input type="file" id="import-file" accept=".jsonl,.csv,.txt" />
+                <select id="import-mode">
+                    <option value="add">追加のみ</option>
+                    <option value="upsert">追加・更新</option>
+                </select>
+                <label><input type="checkbox" id="import-partial" /> エラーのない行だけ登録</label>
+                <button type="button" onclick="importMappings()">⬆️ インポート</button>
+            </div>
+            <pre id="import-result" style="display: none;"></pre>
+        </div>
+        
         <div id="message" style="margin: 20px 0; padding: 10px; display: none;"></div>
     </div>
 
     <script>
+        let currentOffset = 0;
+        let currentTotal = 0;
+        // 表示中の行と、その取得元の設定バージョン（/api/events の差分適用に使用）
+        let currentRows = [];
+        let currentVersion = null;
+        
+        function pageSize() {
+            return parseInt(document.getElementById('page-size').value);
+        }
+        
+        function filterText() {
+            return document.getElementById('filter-q').value;
+        }
+        
+        function escapeHtml(value) {
+            // innerHTML に埋め込む値は必ずエスケープする（トリガーワード等はメタデータ由来の場合がある）
+            return String(value ?? '').replace(/[&<>"']/g, ch => (
+                { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[ch]
+            ));
+        }
+        
         async function loadLoraList() {
+            const params = new URLSearchParams({
+                offset: currentOffset,
+                limit: pageSize(),
+                field: document.getElementById('filter-field').value,
+                sort: document.getElementById('sort').value,
+                order: document.getElementById('order').value
+            });
+            if (filterText()) params.set(document.getElementById('filter-mode').value, filterText());
+            
             try {
-                const response = await fetch('/api/loras');
+                // 変更がなければサーバーは304を返し、ブラウザのキャッシュが使われる
+                const response = await fetch('/api/loras?' + params.toString(), { cache: 'no-cache' });
                 const data = await response.json();
+                if (!data.success) throw new Error(data.error);
                 
-                if (data.loras && data.loras.length > 0) {
-                    let html = '<table><thead><tr><th>トリガーワード</th><th>LoRAファイル</th><th>強度</th><th>説明</th><th>操作</th></tr></thead><tbody>';
-                    
-                    data.loras.forEach(lora => {
-                        html += `<tr>
-                            <td><strong>${lora.trigger_word}</strong></td>
-                            <td>${lora.lora_file}</td>
-                            <td>${lora.strength}</td>
-                            <td>${lora.description || '-'}</td>
-                            <td><a href="#" class="delete-btn" onclick="deleteLora('${lora.trigger_word}')">🗑️ 削除</a></td>
-                        </tr>`;
-                    });
-                    
-                    html += '</tbody></table>';
-                    document.getElementById('lora-list').innerHTML = html;
-                } else {
-                    document.getElementById('lora-list').innerHTML = '<p>登録済みのLoRAはありません。</p>';
+                currentTotal = data.total;
+                if (currentOffset > 0 && currentOffset >= currentTotal) {
+                    // 削除等で最終ページが空になった場合は前のページへ
+                    currentOffset = Math.max(0, currentOffset - pageSize());
+                    return loadLoraList();
                 }
+                
+                currentRows = data.loras;
+                currentVersion = data.version;
+                renderDuplicates(data.duplicates || []);
+                renderLoraList();
             } catch (error) {
-                document.getElementById('lora-list').innerHTML = '<p class="error">読み込みエラー: ' + error.message + '</p>';
+                document.getElementById('lora-list').innerHTML = '<p class="error">読み込みエラー: ' + escapeHtml(error.message) + '</p>';
+            }
+        }
+        
+        function renderLoraList() {
+            if (currentRows.length > 0) {
+                let html = '<table><thead><tr><th>トリガーワード</th><th>LoRAファイル</th><th>強度</th><th>説明</th><th>操作</th></tr></thead><tbody>';
+                
+                currentRows.forEach(lora => {
+                    html += `<tr>
+                        <td><strong>${escapeHtml(lora.trigger_word)}</strong></td>
+                        <td>${escapeHtml(lora.lora_file)}${lora.file_exists === false ? ' <span class="error" title="ファイルが見つかりません">⚠️</span>' : ''}</td>
+                        <td>${escapeHtml(lora.strength)}</td>
+                        <td>${escapeHtml(lora.description || '-')}</td>
+                        <td><a href="#" class="delete-btn" data-trigger-word="${escapeHtml(lora.trigger_word)}">🗑️ 削除</a></td>
+                    </tr>`;
+                });
+                
+                html += '</tbody></table>';
+                const list = document.getElementById('lora-list');
+                list.innerHTML = html;
+                list.querySelectorAll('.delete-btn').forEach(button => {
+                    button.addEventListener('click', e => {
+                        e.preventDefault();
+                        deleteLora(button.dataset.triggerWord);
+                    });
+                });
+            } else {
+                document.getElementById('lora-list').innerHTML = filterText()
+                    ? '<p>条件に合うLoRAはありません。</p>'
+                    : '<p>登録済みのLoRAはありません。</p>';
             }
+            
+            const first = currentTotal === 0 ? 0 : currentOffset + 1;
+            const last = currentOffset + currentRows.length;
+            document.getElementById('page-info').textContent = `${first}-${last} / ${currentTotal}件`;
+            document.getElementById('prev-page').disabled = currentOffset === 0;
+            document.getElementById('next-page').disabled = last >= currentTotal;
         }
         
+        function renderDuplicates(duplicates) {
+            // 設定ファイルに残っているが、先に書かれた定義と重複しているため使われないマッピング
+            const container = document.getElementById('duplicates');
+            container.replaceChildren();
+            container.style.display = duplicates.length > 0 ? 'block' : 'none';
+            if (duplicates.length === 0) return;
+            const title = document.createElement('p');
+            title.textContent = `重複しているトリガーワードが${duplicates.length}件あります（先に書かれた定義のみ使われます）:`;
+            const list = document.createElement('ul');
+            duplicates.forEach(duplicate => {
+                const item = document.createElement('li');
+                item.textContent = `${duplicate.trigger_word} -> ${duplicate.lora_file}`
+                    + `（有効: ${duplicate.active_trigger_word} -> ${duplicate.active_lora_file}）`;
+                list.appendChild(item);
+            });
+            container.append(title, list);
+        }
+        
+        function findRow(triggerWord) {
+            // 変更通知のトリガーワードは保存されている値そのもの
+            return currentRows.findIndex(row => row.trigger_word === triggerWord);
+        }
+        
+        function applyChanges(event) {
+            if (currentVersion === null || event.previous_version !== currentVersion) {
+                // 途中の変更を受け取っていない
+                loadLoraList();
+                return;
+            }
+            const appendable = !filterText()
+                && document.getElementById('sort').value === 'position'
+                && document.getElementById('order').value === 'asc';
+            for (const change of event.changes) {
+                if (change.type === 'updated') {
+                    const index = findRow(change.mapping.trigger_word);
+                    if (index >= 0) currentRows[index] = Object.assign({}, currentRows[index], change.mapping);
+                } else if (change.type === 'removed') {
+                    const index = findRow(change.trigger_word);
+                    if (index >= 0) {
+                        currentRows.splice(index, 1);
+                        currentTotal -= 1;
+                    } else if (!filterText()) {
+                        currentTotal -= 1;
+                    }
+                } else if (change.type === 'added') {
+                    if (!appendable) {
+                        // 並び順・絞り込みによっては表示中のページに入るため取得し直す
+                        loadLoraList();
+                        return;
+                    }
+                    // 登録順の場合は末尾に追加される
+                    if (currentOffset + currentRows.length === currentTotal && currentRows.length < pageSize()) {
+                        currentRows.push(change.mapping);
+                    }
+                    currentTotal += 1;
+                }
+            }
+            currentVersion = event.version;
+            if (currentRows.length === 0 && currentTotal > 0) {
+                loadLoraList();
+                return;
+            }
+            renderLoraList();
+        }
+        
+        function connectEvents() {
+            if (!window.EventSource) return;
+            const events = new EventSource('/api/events');
+            events.addEventListener('hello', e => {
+                const data = JSON.parse(e.data);
+                if (currentVersion !== null && data.version !== currentVersion) loadLoraList();
+            });
+            events.addEventListener('changes', e => applyChanges(JSON.parse(e.data)));
+            events.addEventListener('reloaded', () => loadLoraList());
+        }
+        
+        function changePage(direction) {
+            currentOffset = Math.max(0, currentOffset + direction * pageSize());
+            loadLoraList();
+        }
+        
+        function resetAndLoad() {
+            currentOffset = 0;
+            loadLoraList();
+        }
+        
+        let filterTimer = null;
+        document.getElementById('filter-q').addEventListener('input', () => {
+            clearTimeout(filterTimer);
+            filterTimer = setTimeout(resetAndLoad, 250);
+        });
+        ['filter-mode', 'filter-field', 'sort', 'order', 'page-size'].forEach(id => {
+            document.getElementById(id).addEventListener('change', resetAndLoad);
+        });
+        
         async function deleteLora(triggerWord) {
             if (!confirm(`"${triggerWord}" を削除しますか？`)) return;
             
@@ -155,6 +661,81 @@ class LoRAWebUIHandler(http.server.SimpleHTTPRequestHandler):
             }
         }
         
+        async function scanMetadata() {
+            try {
+                const preview = await (await fetch('/api/scan', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ import: false })
+                })).json();
+                
+                if (!preview.success) {
+                    showMessage(preview.message, 'error');
+                    return;
+                }
+                if (preview.proposals.length === 0) {
+                    showMessage(`新しい候補はありません（スキャン: ${preview.scanned}件）`, 'success');
+                    return;
+                }
+                const summarize = proposals => {
+                    const lines = proposals.slice(0, 20).map(p => `${p.trigger_word} -> ${p.lora_file}`);
+                    if (proposals.length > 20) lines.push(`...他 ${proposals.length - 20}件`);
+                    return lines.join('\\n');
+                };
+                const fromMetadata = preview.proposals.filter(p => p.source !== 'tags');
+                const fromTags = preview.proposals.filter(p => p.source === 'tags');
+                if (fromMetadata.length > 0
+                        && !confirm(`${fromMetadata.length}件の候補を登録しますか？\\n\\n${summarize(fromMetadata)}`)) return;
+                // 学習時のタグから推定した候補は誤検出が多いため、個別に確認する
+                const includeTags = fromTags.length > 0 && confirm(
+                    `学習時のタグから推定した候補が${fromTags.length}件あります。内容を確認のうえ登録しますか？\\n\\n${summarize(fromTags)}`);
+                if (fromMetadata.length === 0 && !includeTags) return;
+                
+                const result = await (await fetch('/api/scan', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ import: true, include_tags: includeTags })
+                })).json();
+                showMessage(result.success ? `${result.added}件登録しました` : result.message,
+                            result.success ? 'success' : 'error');
+                loadLoraList();
+            } catch (error) {
+                showMessage('スキャンエラー: ' + error.message, 'error');
+            }
+        }
+        
+        async function importMappings() {
+            const file = document.getElementById('import-file').files[0];
+            if (!file) {
+                showMessage('ファイルを選択してください', 'error');
+                return;
+            }
+            const params = new URLSearchParams({
+                format: file.name.toLowerCase().endsWith('.csv') ? 'csv' : 'jsonl',
+                mode: document.getElementById('import-mode').value,
+                partial: document.getElementById('import-partial').checked ? '1' : '0'
+            });
+            try {
+                const result = await (await fetch('/api/import?' + params.toString(), {
+                    method: 'POST',
+                    body: file
+                })).json();
+                if (result.message) {
+                    showMessage(result.message, 'error');
+                    return;
+                }
+                const summary = `${result.rows}行: 追加 ${result.added}件, 更新 ${result.updated}件, エラー ${result.error_count}件` +
+                    (result.committed ? '' : '（登録していません）');
+                showMessage(summary, result.committed ? 'success' : 'error');
+                const resultEl = document.getElementById('import-result');
+                resultEl.textContent = result.errors.map(e => `${e.line}行目: ${e.error}`).join('\\n');
+                resultEl.style.display = result.errors.length ? 'block' : 'none';
+                if (result.committed) loadLoraList();
+            } catch (error) {
+                showMessage('インポートエラー: ' + error.message, 'error');
+            }
+        }
+        
         function showMessage(message, type) {
             const messageEl = document.getElementById('message');
             messageEl.textContent = message;
@@ -196,33 +777,115 @@ class LoRAWebUIHandler(http.server.SimpleHTTPRequestHandler):
         
         // 初期読み込み
         loadLoraList();
+        // 他のユーザー・ComfyUIでの変更を受け取る
+        connectEvents();
     </script>
 </body>
 </html>'''
         
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
-        self.wfile.write(html_content.encode('utf-8'))
+        self._send_body(html_content.encode('utf-8'), 'text/html; charset=utf-8')
+    
+    def _is_not_modified(self, etag: str, last_modified: float) -> bool:
+        """条件付きリクエストに対して304を返せるか"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return etag in tags or '*' in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError):
+                return False
+            return int(last_modified) <= since
+        return False
     
-    def serve_lora_list(self):
+    def serve_lora_list(self, params: dict = None):
+        """
+        登録済みLoRA一覧を1ページ分返す
+        
+        クエリパラメータ:
+            offset, limit: ページ（limit は最大 MAX_PAGE_SIZE）
+            sort: position / trigger_word / lora_file / strength / description
+            order: asc / desc
+            q: 部分一致、prefix: 前方一致（大文字小文字を区別しない）
+            field: 絞り込む項目（trigger_word / lora_file / description / all）
+        
+        ETagは設定バージョン・LoRAファイル索引・クエリから作成し、
+        変更がなければ304を返す。
+        """
+        params = params or {}
+        
+        def param(name, default=''):
+            return params.get(name, [default])[0]
+        
         try:
-            loras = self.lora_manager.list_all_mappings()
+            offset = int(param('offset', 0))
+            limit = min(int(param('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+            query = {
+                'q': param('q'),
+                'prefix': param('prefix'),
+                'field': param('field', 'all'),
+                'sort': param('sort', 'position'),
+                'order': param('order', 'asc'),
+                'offset': offset,
+                'limit': limit,
+            }
+            
+            # ComfyUI側（LoRA Managerノード）での変更を反映
+            self.lora_manager.reload_if_changed()
+            snapshot = self.lora_manager.snapshot()
+            last_modified = snapshot.published_at
+            file_generation = 0
+            if self.file_index is not None:
+                self.file_index.refresh()
+                file_generation = self.file_index.generation
+                last_modified = max(last_modified, self.file_index.changed_at)
+            
+            query_hash = hashlib.sha1(
+                json.dumps(query, sort_keys=True).encode('utf-8')
+            ).hexdigest()[:16]
+            etag = f'"{_INSTANCE_TOKEN}-{snapshot.version}-{file_generation}-{query_hash}"'
+            cache_headers = {
+                'ETag': etag,
+                'Last-Modified': email.utils.formatdate(last_modified, usegmt=True),
+                'Cache-Control': 'no-cache',
+            }
+            if self._is_not_modified(etag, last_modified):
+                self.send_response(304)
+                for name, value in cache_headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                return
+            
+            result = self.query_cache.get(snapshot).query(**query)
+            loras = result['items']
+            if self.file_index is not None:
+                # LoRAディレクトリが分かる場合はファイルの有無を索引で確認（表示する行のみ）
+                loras = [dict(lora, file_exists=self.file_index.exists(lora['lora_file']))
+                         for lora in loras]
             response_data = {
                 'success': True,
-                'loras': loras
+                'loras': loras,
+                'total': result['total'],
+                'offset': offset,
+                'limit': limit,
+                'version': snapshot.version,
+                'duplicates': self.lora_manager.get_duplicate_mappings()
             }
+        except ValueError as e:
+            self._send_json({'success': False, 'error': str(e), 'loras': []}, 400)
+            return
         except Exception as e:
             response_data = {
                 'success': False,
                 'error': str(e),
                 'loras': []
             }
+            self._send_json(response_data)
+            return
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+        self._send_json(response_data, headers=cache_headers)
     
     def handle_lora_action(self):
         try:
@@ -258,33 +921,274 @@ class LoRAWebUIHandler(http.server.SimpleHTTPRequestHandler):
                 'message': f'エラー: {str(e)}'
             }
         
+        self._send_json(response_data)
+
+
+    def serve_metrics(self):
+        """計測値をPrometheusのテキスト形式で返す"""
+        self._send_body(metrics_registry.render().encode('utf-8'), METRICS_CONTENT_TYPE)
+    
+    def serve_events(self):
+        """
+        設定の変更をServer-Sent Eventsで配信
+        
+        接続直後に現在の設定バージョンを hello として送り、以降は変更のたびに
+        changes（差分）または reloaded（一覧の再取得が必要）を送る。
+        接続はイベント配信スレッドに引き渡し、このワーカースレッドは解放する。
+        """
+        hub = getattr(self.server, 'event_hub', None)
+        if hub is None:
+            self.send_error(404)
+            return
+        
         self.send_response(200)
-        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
         self.end_headers()
-        self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+        self.wfile.flush()
+        self.close_connection = True
+        
+        lora_manager = self.lora_manager
+        last_event_id = self.headers.get('Last-Event-ID')
+        
+        def initial_event() -> bytes:
+            version = lora_manager.config_version
+            payload = format_event('hello', {'version': version}, version)
+            if last_event_id is not None and last_event_id != str(version):
+                # 再接続までの間に変更があった
+                payload += format_event('reloaded', {'version': version}, version)
+            return payload
+        
+        self.server.detach_request(self.request)
+        hub.attach(self.connection, initial_event)
+    
+    def serve_export(self, params: dict):
+        """
+        全マッピングを JSONL（format=jsonl）または CSV（format=csv）でエクスポート
+        
+        公開中のスナップショットを1行ずつ変換しながらチャンク転送で送信する。
+        """
+        fmt = params.get('format', ['jsonl'])[0]
+        if fmt not in FORMATS:
+            self._send_json({'success': False, 'error': f"不正な形式です: {fmt}"}, 400)
+            return
+        
+        self.lora_manager.reload_if_changed()
+        snapshot = self.lora_manager.snapshot()
+        content_type = 'application/x-ndjson; charset=utf-8' if fmt == 'jsonl' else 'text/csv; charset=utf-8'
+        self._send_chunked(iter_export_lines(snapshot.mapping_list, fmt), content_type, {
+            'Content-Disposition': f'attachment; filename="lora_mapping.{fmt}"',
+            'X-Config-Version': str(snapshot.version),
+        })
+    
+    def handle_import(self, params: dict):
+        """
+        JSONL / CSV のマッピングを一括登録
+        
+        本文は1行ずつ読み込んで検証し、設定ファイルへの書き込みは1回にまとめる。
+        
+        クエリパラメータ:
+            format: jsonl / csv
+            mode: add（登録済みはエラー） / upsert（登録済みは更新）
+            partial: 1 の場合はエラーのない行だけ登録（デフォルトは1行でもエラーがあれば何もしない）
+            dry_run: 1 の場合は検証のみ
+        """
+        def param(name, default=''):
+            return params.get(name, [default])[0]
+        
+        fmt = param('format', 'jsonl')
+        mode = param('mode', 'add')
+        if fmt not in FORMATS or mode not in ('add', 'upsert'):
+            # 本文を読まずに返すため、この接続は閉じる
+            self.close_connection = True
+            self._send_json({'success': False, 'message': f"不正なパラメータです: format={fmt}, mode={mode}"}, 400)
+            return
+        
+        chunked = 'chunked' in self.headers.get('Transfer-Encoding', '').lower()
+        body = _RequestBodyReader(self.rfile, int(self.headers.get('Content-Length') or 0), chunked)
+        lines = io.TextIOWrapper(io.BufferedReader(body, STREAM_CHUNK_SIZE), encoding='utf-8-sig', newline='')
+        try:
+            result = import_mappings(self.lora_manager, lines, fmt, mode,
+                                     partial=param('partial') in ('1', 'true'),
+                                     dry_run=param('dry_run') in ('1', 'true'))
+        except (ValueError, UnicodeDecodeError) as e:
+            self.close_connection = True
+            self._send_json({'success': False, 'message': f'エラー: {str(e)}'}, 400)
+            return
+        
+        result['success'] = result['error_count'] == 0 or result['committed']
+        self._send_json(result)
+    
+    def handle_match(self):
+        """
+        プロンプトに対して適用されるLoRAを調べる（ComfyUIのジョブは実行しない）
+        
+        本文: {"prompt": "..."} または {"prompts": ["...", ...]}
+        任意: multi_lora（AutoLoRANodeの複数LoRA適用モード）, manual_strength
+        
+        AutoLoRANodeと同じコンパイル済みマッチャーで照合し、全てのプロンプトを
+        同じ設定バージョンで処理する。大量のプロンプトはワーカースレッドに分けて処理する。
+        """
+        try:
+            content_length = int(self.headers.get('Content-Length') or 0)
+            data = json.loads(self.rfile.read(content_length).decode('utf-8') if content_length else '{}')
+            
+            single = 'prompts' not in data
+            prompts = [data.get('prompt', '')] if single else data['prompts']
+            if not isinstance(prompts, list) or not all(isinstance(p, str) for p in prompts):
+                raise ValueError("prompts は文字列の配列で指定してください")
+            if len(prompts) > MAX_MATCH_PROMPTS:
+                raise ValueError(f"プロンプトは1回に{MAX_MATCH_PROMPTS}件までです")
+            multi_lora = bool(data.get('multi_lora', False))
+            manual_strength = float(data.get('manual_strength', -1.0))
+        except (ValueError, TypeError) as e:
+            self._send_json({'success': False, 'message': f'エラー: {str(e)}'}, 400)
+            return
+        
+        self.lora_manager.reload_if_changed()
+        snapshot = self.lora_manager.snapshot()
+        start = time.perf_counter()
+        matches = self.lora_manager.match_prompts(prompts, multi_lora, self.server.match_executor,
+                                                  snapshot=snapshot)
+        total_ms = (time.perf_counter() - start) * 1000
+        
+        results = []
+        for loras, elapsed in matches:
+            stage_seconds.observe(elapsed, stage='match')
+            prompts_total.inc(result='matched' if loras else 'unmatched')
+            entries = []
+            for lora in loras:
+                entry = {
+                    'trigger_word': lora['trigger_word'],
+                    'lora_file': lora['lora_file'],
+                    'strength': manual_strength if manual_strength >= 0 else lora['strength'],
+                }
+                if self.file_index is not None:
+                    entry['file_exists'] = self.file_index.exists(lora['lora_file'])
+                entries.append(entry)
+            results.append({'loras': entries, 'match_ms': round(elapsed * 1000, 4)})
+        
+        response_data = {
+            'success': True,
+            'version': snapshot.version,
+            'count': len(results),
+            'total_ms': round(total_ms, 3)
+        }
+        if single:
+            response_data.update(results[0])
+        else:
+            response_data['results'] = results
+        self._send_json(response_data)
+    
+    def handle_scan(self):
+        """LoRAファイルのメタデータをスキャンし、マッピング候補を返す（import指定時は一括登録）"""
+        try:
+            content_length = int(self.headers.get('Content-Length') or 0)
+            post_data = self.rfile.read(content_length) if content_length else b'{}'
+            data = json.loads(post_data.decode('utf-8'))
+            
+            # タグから推定した候補は、画面で確認した後 include_tags を指定した場合のみ登録する
+            scan_result = scan_and_propose(self.lora_manager, import_mappings=bool(data.get('import')),
+                                           include_tags=bool(data.get('include_tags')))
+            response_data = {
+                'success': True,
+                'scanned': scan_result['scanned'],
+                'proposals': scan_result['proposals'],
+                'added': scan_result['added']
+            }
+        except Exception as e:
+            response_data = {
+                'success': False,
+                'message': f'エラー: {str(e)}'
+            }
+        
+        self._send_json(response_data)
 
 
-def start_web_ui(port=8765):
+def create_web_server(host: str = "", port: int = 8765, workers: int = DEFAULT_WORKERS,
+                      lora_manager: LoraManager = None) -> ThreadPoolHTTPServer:
     """
-    LoRA設定管理用WebUIを起動
+    WebUIのHTTPサーバーを作成（全ワーカーで1つのLoraManagerを共有）
     
     Args:
+        host: 待ち受けるアドレス（空文字の場合は全て）
         port: ポート番号
+        workers: 同時に処理するリクエスト数
+        lora_manager: 使用するLoraManager（Noneの場合は共有インスタンス）
+        
+    Returns:
+        ThreadPoolHTTPServer
     """
-    lora_manager = LoraManager()
+    lora_manager = lora_manager or LoraManager.get_shared()
+    
+    # LoRAディレクトリ（ComfyUI外では settings.lora_directories）の索引
+    file_index = None
+    if get_lora_directories(lora_manager.settings):
+        file_index = LoraFileIndex(lambda: get_lora_directories(lora_manager.settings))
     
-    def handler(*args, **kwargs):
-        return LoRAWebUIHandler(*args, lora_manager=lora_manager, **kwargs)
+    handler = functools.partial(LoRAWebUIHandler, lora_manager=lora_manager, file_index=file_index,
+                                query_cache=MappingQueryCache())
+    httpd = ThreadPoolHTTPServer((host, port), handler, workers)
+    
+    # 設定の変更を /api/events に配信（他のプロセスによる変更も定期的に確認）
+    httpd.event_hub = EventHub(on_tick=lora_manager.reload_if_changed)
+    listener = change_event_to_sse(httpd.event_hub)
+    lora_manager.add_change_listener(listener)
+    httpd.close_callbacks.append(lambda: lora_manager.remove_change_listener(listener))
+    
+    # /metrics に出力する値
+    metrics_registry.register_collector('match_cache', cache_stats_collector(
+        'autolora_match_cache', 'プロンプト検出キャッシュ', lora_manager.get_match_cache_stats,
+        gauges=('entries', 'max_entries')
+    ))
+    metrics_registry.register_collector('event_clients', lambda: [(
+        'autolora_event_clients', 'gauge', '/api/events の接続数', [({}, httpd.event_hub.client_count)]
+    )])
+    httpd.close_callbacks.append(lambda: metrics_registry.unregister_collector('event_clients'))
+    return httpd
+
+
+def start_web_ui(port=8765, host="", workers=DEFAULT_WORKERS):
+    """
+    LoRA設定管理用WebUIを起動
     
+    Ctrl+C または SIGTERM で停止する。停止時は処理中のリクエストの完了と
+    遅延書き込み中の設定の保存を待ってから終了する。
+    
+    Args:
+        port: ポート番号
+        host: 待ち受けるアドレス（空文字の場合は全て）
+        workers: 同時に処理するリクエスト数
+    """
+    lora_manager = LoraManager.get_shared()
     try:
-        with socketserver.TCPServer(("", port), handler) as httpd:
-            print(f"LoRA設定管理WebUIが起動しました: http://localhost:{port}")
-            print("Ctrl+C で停止")
-            httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\\nWebUIを停止しました")
+        httpd = create_web_server(host, port, workers, lora_manager)
     except Exception as e:
         print(f"WebUI起動エラー: {e}")
+        return
+    
+    def request_shutdown(signum, frame):
+        # serve_forever と同じスレッドから shutdown() を呼ぶと終了しないため別スレッドで実行
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+    
+    try:
+        signal.signal(signal.SIGTERM, request_shutdown)
+    except ValueError:
+        # メインスレッド以外から起動された場合
+        pass
+    
+    try:
+        print(f"LoRA設定管理WebUIが起動しました: http://{host or 'localhost'}:{port}")
+        print(f"ワーカー数: {workers}")
+        print("Ctrl+C で停止")
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        lora_manager.flush()
+    print("\nWebUIを停止しました")
 
 
 if __name__ == "__main__":